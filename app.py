@@ -1,5 +1,3 @@
-import yfinance as yf
-import talib
 import pandas as pd
 import gradio as gr
 from datetime import datetime
@@ -8,375 +6,87 @@ from plotly.subplots import make_subplots
 import numpy as np
 import os
 
-# ------------------------------------------------------
-# 1) 蠟燭形態對照表（中文） + 偵測函式
-# ------------------------------------------------------
-pattern_descriptions = {
-    "CDL2CROWS": "雙鴉（CDL2CROWS）",
-    "CDL3BLACKCROWS": "三烏鴉（CDL3BLACKCROWS）",
-    "CDL3INSIDE": "內困三日上升 / 下降（CDL3INSIDE）",
-    "CDL3LINESTRIKE": "三線打擊（CDL3LINESTRIKE）",
-    "CDL3OUTSIDE": "外側三日上升 / 下降（CDL3OUTSIDE）",
-    "CDL3STARSINSOUTH": "南方三星（CDL3STARSINSOUTH）",
-    "CDL3WHITESOLDIERS": "三白兵（CDL3WHITESOLDIERS）",
-    "CDLABANDONEDBABY": "棄嬰（CDLABANDONEDBABY）",
-    "CDLADVANCEBLOCK": "大敵當前（CDLADVANCEBLOCK）",
-    "CDLBELTHOLD": "捉腰帶線（CDLBELTHOLD）",
-    "CDLBREAKAWAY": "脫離（CDLBREAKAWAY）",
-    "CDLCLOSINGMARUBOZU": "收盤缺影線（CDLCLOSINGMARUBOZU）",
-    "CDLCONCEALBABYSWALL": "藏嬰吞沒（CDLCONCEALBABYSWALL）",
-    "CDLCOUNTERATTACK": "反擊線（CDLCOUNTERATTACK）",
-    "CDLDARKCLOUDCOVER": "烏雲壓頂（CDLDARKCLOUDCOVER）",
-    "CDLDOJI": "十字（CDLDOJI）",
-    "CDLDOJISTAR": "十字星（CDLDOJISTAR）",
-    "CDLDRAGONFLYDOJI": "蜻蜓十字（CDLDRAGONFLYDOJI）",
-    "CDLENGULFING": "吞噬模式（CDLENGULFING）",
-    "CDLEVENINGDOJISTAR": "十字暮星（CDLEVENINGDOJISTAR）",
-    "CDLEVENINGSTAR": "暮星（CDLEVENINGSTAR）",
-    "CDLGAPSIDESIDEWHITE": "向上 / 下跳空並列陽線（CDLGAPSIDESIDEWHITE）",
-    "CDLGRAVESTONEDOJI": "墓碑十字（CDLGRAVESTONEDOJI）",
-    "CDLHAMMER": "錘頭（CDLHAMMER）",
-    "CDLHANGINGMAN": "上吊線（CDLHANGINGMAN）",
-    "CDLHARAMI": "母子線（CDLHARAMI）",
-    "CDLHARAMICROSS": "十字孕線（CDLHARAMICROSS）",
-    "CDLHIGHWAVE": "風高浪大線（CDLHIGHWAVE）",
-    "CDLHIKKAKE": "陷阱（CDLHIKKAKE）",
-    "CDLHIKKAKEMOD": "修正陷阱（CDLHIKKAKEMOD）",
-    "CDLHOMINGPIGEON": "家鴿（CDLHOMINGPIGEON）",
-    "CDLIDENTICAL3CROWS": "三胞胎烏鴉（CDLIDENTICAL3CROWS）",
-    "CDLINNECK": "頸內線（CDLINNECK）",
-    "CDLINVERTEDHAMMER": "倒錘頭（CDLINVERTEDHAMMER）",
-    "CDLKICKING": "反衝型態（CDLKICKING）",
-    "CDLKICKINGBYLENGTH": "由較長缺影線決定的反衝型態（CDLKICKINGBYLENGTH）",
-    "CDLLADDERBOTTOM": "梯底（CDLLADDERBOTTOM）",
-    "CDLLONGLEGGEDDOJI": "長腳十字（CDLLONGLEGGEDDOJI）",
-    "CDLLONGLINE": "長蠟燭（CDLLONGLINE）",
-    "CDLMARUBOZU": "光頭光腳 / 缺影線（CDLMARUBOZU）",
-    "CDLMATCHINGLOW": "相同低價（CDLMATCHINGLOW）",
-    "CDLMATHOLD": "鋪墊（CDLMATHOLD）",
-    "CDLMORNINGDOJISTAR": "十字晨星（CDLMORNINGDOJISTAR）",
-    "CDLMORNINGSTAR": "晨星（CDLMORNINGSTAR）",
-    "CDLONNECK": "頸上線（CDLONNECK）",
-    "CDLPIERCING": "刺透（CDLPIERCING）",
-    "CDLRICKSHAWMAN": "黃包車伕（CDLRICKSHAWMAN）",
-    "CDLRISEFALL3METHODS": "上升 / 下降三法（CDLRISEFALL3METHODS）",
-    "CDLSEPARATINGLINES": "分離線（CDLSEPARATINGLINES）",
-    "CDLSHOOTINGSTAR": "射擊之星（CDLSHOOTINGSTAR）",
-    "CDLSHORTLINE": "短蠟燭（CDLSHORTLINE）",
-    "CDLSPINNINGTOP": "紡錘（CDLSPINNINGTOP）",
-    "CDLSTALLEDPATTERN": "停頓（CDLSTALLEDPATTERN）",
-    "CDLSTICKSANDWICH": "條形三明治（CDLSTICKSANDWICH）",
-    "CDLTAKURI": "探水竿（CDLTAKURI）",
-    "CDLTASUKIGAP": "跳空並列陰陽線（CDLTASUKIGAP）",
-    "CDLTHRUSTING": "插入（CDLTHRUSTING）",
-    "CDLTRISTAR": "三星（CDLTRISTAR）",
-    "CDLUNIQUE3RIVER": "奇特三河床（CDLUNIQUE3RIVER）",
-    "CDLUPSIDEGAP2CROWS": "向上跳空雙烏鴉（CDLUPSIDEGAP2CROWS）",
-    "CDLXSIDEGAP3METHODS": "上升 / 下降跳空三法（CDLXSIDEGAP3METHODS）"
-}
-
-def detect_candlestick_patterns(data):
-    open_prices = data['Open'].values
-    high_prices = data['High'].values
-    low_prices = data['Low'].values
-    close_prices = data['Close'].values
-
-    patterns = {
-        "CDL2CROWS": talib.CDL2CROWS,
-        "CDL3BLACKCROWS": talib.CDL3BLACKCROWS,
-        "CDL3INSIDE": talib.CDL3INSIDE,
-        "CDL3LINESTRIKE": talib.CDL3LINESTRIKE,
-        "CDL3OUTSIDE": talib.CDL3OUTSIDE,
-        "CDL3STARSINSOUTH": talib.CDL3STARSINSOUTH,
-        "CDL3WHITESOLDIERS": talib.CDL3WHITESOLDIERS,
-        "CDLABANDONEDBABY": talib.CDLABANDONEDBABY,
-        "CDLADVANCEBLOCK": talib.CDLADVANCEBLOCK,
-        "CDLBELTHOLD": talib.CDLBELTHOLD,
-        "CDLBREAKAWAY": talib.CDLBREAKAWAY,
-        "CDLCLOSINGMARUBOZU": talib.CDLCLOSINGMARUBOZU,
-        "CDLCONCEALBABYSWALL": talib.CDLCONCEALBABYSWALL,
-        "CDLCOUNTERATTACK": talib.CDLCOUNTERATTACK,
-        "CDLDARKCLOUDCOVER": talib.CDLDARKCLOUDCOVER,
-        "CDLDOJI": talib.CDLDOJI,
-        "CDLDOJISTAR": talib.CDLDOJISTAR,
-        "CDLDRAGONFLYDOJI": talib.CDLDRAGONFLYDOJI,
-        "CDLENGULFING": talib.CDLENGULFING,
-        "CDLEVENINGDOJISTAR": talib.CDLEVENINGDOJISTAR,
-        "CDLEVENINGSTAR": talib.CDLEVENINGSTAR,
-        "CDLGAPSIDESIDEWHITE": talib.CDLGAPSIDESIDEWHITE,
-        "CDLGRAVESTONEDOJI": talib.CDLGRAVESTONEDOJI,
-        "CDLHAMMER": talib.CDLHAMMER,
-        "CDLHANGINGMAN": talib.CDLHANGINGMAN,
-        "CDLHARAMI": talib.CDLHARAMI,
-        "CDLHARAMICROSS": talib.CDLHARAMICROSS,
-        "CDLHIGHWAVE": talib.CDLHIGHWAVE,
-        "CDLHIKKAKE": talib.CDLHIKKAKE,
-        "CDLHIKKAKEMOD": talib.CDLHIKKAKEMOD,
-        "CDLHOMINGPIGEON": talib.CDLHOMINGPIGEON,
-        "CDLIDENTICAL3CROWS": talib.CDLIDENTICAL3CROWS,
-        "CDLINNECK": talib.CDLINNECK,
-        "CDLINVERTEDHAMMER": talib.CDLINVERTEDHAMMER,
-        "CDLKICKING": talib.CDLKICKING,
-        "CDLKICKINGBYLENGTH": talib.CDLKICKINGBYLENGTH,
-        "CDLLADDERBOTTOM": talib.CDLLADDERBOTTOM,
-        "CDLLONGLEGGEDDOJI": talib.CDLLONGLEGGEDDOJI,
-        "CDLLONGLINE": talib.CDLLONGLINE,
-        "CDLMARUBOZU": talib.CDLMARUBOZU,
-        "CDLMATCHINGLOW": talib.CDLMATCHINGLOW,
-        "CDLMATHOLD": talib.CDLMATHOLD,
-        "CDLMORNINGDOJISTAR": talib.CDLMORNINGDOJISTAR,
-        "CDLMORNINGSTAR": talib.CDLMORNINGSTAR,
-        "CDLONNECK": talib.CDLONNECK,
-        "CDLPIERCING": talib.CDLPIERCING,
-        "CDLRICKSHAWMAN": talib.CDLRICKSHAWMAN,
-        "CDLRISEFALL3METHODS": talib.CDLRISEFALL3METHODS,
-        "CDLSEPARATINGLINES": talib.CDLSEPARATINGLINES,
-        "CDLSHOOTINGSTAR": talib.CDLSHOOTINGSTAR,
-        "CDLSHORTLINE": talib.CDLSHORTLINE,
-        "CDLSPINNINGTOP": talib.CDLSPINNINGTOP,
-        "CDLSTALLEDPATTERN": talib.CDLSTALLEDPATTERN,
-        "CDLSTICKSANDWICH": talib.CDLSTICKSANDWICH,
-        "CDLTAKURI": talib.CDLTAKURI,
-        "CDLTASUKIGAP": talib.CDLTASUKIGAP,
-        "CDLTHRUSTING": talib.CDLTHRUSTING,
-        "CDLTRISTAR": talib.CDLTRISTAR,
-        "CDLUNIQUE3RIVER": talib.CDLUNIQUE3RIVER,
-        "CDLUPSIDEGAP2CROWS": talib.CDLUPSIDEGAP2CROWS,
-        "CDLXSIDEGAP3METHODS": talib.CDLXSIDEGAP3METHODS,
-    }
-
-    results = {}
-    for name, func in patterns.items():
-        results[name] = func(open_prices, high_prices, low_prices, close_prices)
-    return pd.DataFrame(results, index=data.index)
-
-
-# ------------------------------------------------------
-# 2) 常用形態分類
-# ------------------------------------------------------
-COMMON_PATTERNS = {
-    "看漲形態": [
-        "CDLMORNINGSTAR",
-        "CDLMORNINGDOJISTAR",
-        "CDLHAMMER",
-        "CDLINVERTEDHAMMER",
-        "CDLENGULFING",
-        "CDLPIERCING",
-        "CDL3WHITESOLDIERS",
-        "CDLHARAMI",
-        "CDLINNECK",
-        "CDLONNECK",
-        "CDLBELTHOLD",
-        "CDLHOMINGPIGEON",
-        "CDLMATCHINGLOW",
-        "CDLTHRUSTING",
-        "CDLUNIQUE3RIVER",
-        "CDLLADDERBOTTOM",
-        "CDLMARUBOZU"
-    ],
-    "看跌形態": [
-        "CDLEVENINGSTAR",
-        "CDLEVENINGDOJISTAR",
-        "CDLHANGINGMAN",
-        "CDLSHOOTINGSTAR",
-        "CDLDARKCLOUDCOVER",
-        "CDL3BLACKCROWS",
-        "CDL2CROWS",
-        "CDL3STARSINSOUTH",
-        "CDLIDENTICAL3CROWS",
-        "CDLADVANCEBLOCK",
-        "CDLBREAKAWAY",
-        "CDLCOUNTERATTACK",
-        "CDLGAPSIDESIDEWHITE",
-        "CDLGRAVESTONEDOJI",
-        "CDLHIGHWAVE",
-        "CDLSTALLEDPATTERN",
-        "CDLUPSIDEGAP2CROWS",
-        "CDLXSIDEGAP3METHODS"
-    ]
-}
-
+from compact import COMPACT_DTYPES, assemble_results, compact_frames
+from confluence import score_frame
+from indicators import DEFAULT_INDICATORS, TECHNICAL_INDICATORS, split_indicator_text
+from pattern_events import PATTERN_IDS, PatternEvents
+from pattern_stats import ticker_performance
+from patterns import detect_candlestick_patterns_incremental, pattern_descriptions, resolve_patterns
+from prewarm import precomputed, start_prewarm_scheduler
+from resample import fetch_any_interval
+from result_cache import cached_indicators, cached_patterns, content_fingerprint
+from scanner import load_universe, scan_market
+from similarity import find_similar
 
 # ------------------------------------------------------
-# 3) 技術指標計算 (完整清單)
+# 1) 資料抓取
 # ------------------------------------------------------
-TECHNICAL_INDICATORS = [
-    # Overlap Studies
-    "MA", "SMA", "EMA", "WMA", "DEMA", "TEMA", "TRIMA", "KAMA", "BBANDS", "SAR", "MIDPOINT", "MIDPRICE",
-    # Momentum Indicators
-    "RSI", "STOCH", "STOCHF", "STOCHRSI", "MACD", "TRIX", "WILLR", "ADX", "ADXR", "APO", "AROON", "AROONOSC",
-    "CCI", "CMO", "MFI", "MOM", "PPO", "ROC", "ULTOSC",
-    # Volume Indicators
-    "AD", "ADOSC", "OBV",
-    # Volatility Indicators
-    "TRANGE", "ATR", "NATR",
-    # Price Transform
-    "AVGPRICE", "MEDPRICE", "TYPPRICE", "WCLPRICE"
-]
-
-def calculate_selected_indicators(data, selected_indicators):
+def fetch_stock_data(ticker, period='6mo', interval='1d', start=None, end=None):
     """
-    根據使用者勾選，動態計算各種技術指標並回傳 DataFrame
+    取得 OHLCV：優先讀取本地 K 線快取 (market_data.BarStore)，
+    快取已涵蓋的區間直接切片，只向 Yahoo 補抓缺少的區段。
+    有指定 start / end 時忽略 period。
+    週 K / 月 K / 4h 等週期由快取的日 K、分鐘線合成 (resample.RESAMPLE_BASE)
     """
-    indicators = {}
-    close_prices = data['Close'].values
-    high_prices = data['High'].values
-    low_prices = data['Low'].values
-    volume = data['Volume'].values if 'Volume' in data.columns else None
-    open_prices = data['Open'].values
-
-    # Overlap Studies
-    if "MA" in selected_indicators:
-        indicators['MA'] = talib.MA(close_prices)
-    if "SMA" in selected_indicators:
-        indicators['SMA_30'] = talib.SMA(close_prices, timeperiod=30)
-    if "EMA" in selected_indicators:
-        indicators['EMA_30'] = talib.EMA(close_prices, timeperiod=30)
-    if "WMA" in selected_indicators:
-        indicators['WMA_30'] = talib.WMA(close_prices, timeperiod=30)
-    if "DEMA" in selected_indicators:
-        indicators['DEMA_30'] = talib.DEMA(close_prices, timeperiod=30)
-    if "TEMA" in selected_indicators:
-        indicators['TEMA_30'] = talib.TEMA(close_prices, timeperiod=30)
-    if "TRIMA" in selected_indicators:
-        indicators['TRIMA_30'] = talib.TRIMA(close_prices, timeperiod=30)
-    if "KAMA" in selected_indicators:
-        indicators['KAMA_30'] = talib.KAMA(close_prices, timeperiod=30)
-    if "BBANDS" in selected_indicators:
-        upper, middle, lower = talib.BBANDS(close_prices, timeperiod=20)
-        indicators['BBANDS_Upper'] = upper
-        indicators['BBANDS_Middle'] = middle
-        indicators['BBANDS_Lower'] = lower
-    if "SAR" in selected_indicators:
-        indicators['SAR'] = talib.SAR(high_prices, low_prices, acceleration=0.02, maximum=0.2)
-    if "MIDPOINT" in selected_indicators:
-        indicators['MIDPOINT'] = talib.MIDPOINT(close_prices, timeperiod=14)
-    if "MIDPRICE" in selected_indicators:
-        indicators['MIDPRICE'] = talib.MIDPRICE(high_prices, low_prices, timeperiod=14)
-
-    # Momentum Indicators
-    if "RSI" in selected_indicators:
-        indicators['RSI_14'] = talib.RSI(close_prices, timeperiod=14)
-    if "STOCH" in selected_indicators:
-        slowk, slowd = talib.STOCH(high_prices, low_prices, close_prices)
-        indicators['STOCH_%K'] = slowk
-        indicators['STOCH_%D'] = slowd
-    if "STOCHF" in selected_indicators:
-        fastk, fastd = talib.STOCHF(high_prices, low_prices, close_prices)
-        indicators['STOCHF_%K'] = fastk
-        indicators['STOCHF_%D'] = fastd
-    if "STOCHRSI" in selected_indicators:
-        fastk, fastd = talib.STOCHRSI(close_prices, timeperiod=14)
-        indicators['STOCHRSI_%K'] = fastk
-        indicators['STOCHRSI_%D'] = fastd
-    if "MACD" in selected_indicators:
-        macd, signal, hist = talib.MACD(close_prices, fastperiod=12, slowperiod=26, signalperiod=9)
-        indicators['MACD'] = macd
-        indicators['MACD_Signal'] = signal
-        indicators['MACD_Hist'] = hist
-    if "TRIX" in selected_indicators:
-        indicators['TRIX'] = talib.TRIX(close_prices, timeperiod=30)
-    if "WILLR" in selected_indicators:
-        indicators['WILLR'] = talib.WILLR(high_prices, low_prices, close_prices, timeperiod=14)
-    if "ADX" in selected_indicators:
-        indicators['ADX'] = talib.ADX(high_prices, low_prices, close_prices, timeperiod=14)
-    if "ADXR" in selected_indicators:
-        indicators['ADXR'] = talib.ADXR(high_prices, low_prices, close_prices, timeperiod=14)
-    if "APO" in selected_indicators:
-        indicators['APO'] = talib.APO(close_prices, fastperiod=12, slowperiod=26)
-    if "AROON" in selected_indicators:
-        aroon_down, aroon_up = talib.AROON(high_prices, low_prices, timeperiod=14)
-        indicators['AROON_Up'] = aroon_up
-        indicators['AROON_Down'] = aroon_down
-    if "AROONOSC" in selected_indicators:
-        indicators['AROONOSC'] = talib.AROONOSC(high_prices, low_prices, timeperiod=14)
-    if "CCI" in selected_indicators:
-        indicators['CCI'] = talib.CCI(high_prices, low_prices, close_prices, timeperiod=14)
-    if "CMO" in selected_indicators:
-        indicators['CMO'] = talib.CMO(close_prices, timeperiod=14)
-    if "MFI" in selected_indicators and volume is not None:
-        indicators['MFI'] = talib.MFI(high_prices, low_prices, close_prices, volume, timeperiod=14)
-    if "MOM" in selected_indicators:
-        indicators['MOM'] = talib.MOM(close_prices, timeperiod=10)
-    if "PPO" in selected_indicators:
-        indicators['PPO'] = talib.PPO(close_prices, fastperiod=12, slowperiod=26)
-    if "ROC" in selected_indicators:
-        indicators['ROC'] = talib.ROC(close_prices, timeperiod=10)
-    if "ULTOSC" in selected_indicators:
-        indicators['ULTOSC'] = talib.ULTOSC(high_prices, low_prices, close_prices)
-
-    # Volume Indicators
-    if "AD" in selected_indicators and volume is not None:
-        indicators['AD'] = talib.AD(high_prices, low_prices, close_prices, volume)
-    if "ADOSC" in selected_indicators and volume is not None:
-        indicators['ADOSC'] = talib.ADOSC(high_prices, low_prices, close_prices, volume)
-    if "OBV" in selected_indicators and volume is not None:
-        indicators['OBV'] = talib.OBV(close_prices, volume)
-
-    # Volatility Indicators
-    if "TRANGE" in selected_indicators:
-        indicators['TRANGE'] = talib.TRANGE(high_prices, low_prices, close_prices)
-    if "ATR" in selected_indicators:
-        indicators['ATR'] = talib.ATR(high_prices, low_prices, close_prices, timeperiod=14)
-    if "NATR" in selected_indicators:
-        indicators['NATR'] = talib.NATR(high_prices, low_prices, close_prices, timeperiod=14)
-
-    # Price Transform
-    if "AVGPRICE" in selected_indicators:
-        indicators['AVGPRICE'] = talib.AVGPRICE(open_prices, high_prices, low_prices, close_prices)
-    if "MEDPRICE" in selected_indicators:
-        indicators['MEDPRICE'] = talib.MEDPRICE(high_prices, low_prices)
-    if "TYPPRICE" in selected_indicators:
-        indicators['TYPPRICE'] = talib.TYPPRICE(high_prices, low_prices, close_prices)
-    if "WCLPRICE" in selected_indicators:
-        indicators['WCLPRICE'] = talib.WCLPRICE(high_prices, low_prices, close_prices)
-
-    return pd.DataFrame(indicators, index=data.index)
-
-
-# ------------------------------------------------------
-# 4) 資料抓取
-# ------------------------------------------------------
-def fetch_stock_data(ticker, period='6mo'):
-    data = yf.download(ticker, period=period, progress=False)
-    if data.empty:
-        raise ValueError(f"{ticker} 在所選時間內無資料。")
-    if isinstance(data.columns, pd.MultiIndex):
-        level0 = data.columns.get_level_values(0)
-        level1 = data.columns.get_level_values(1)
-        if 'Close' in level0 or 'Open' in level0:
-            data.columns = level0
-        elif 'Close' in level1 or 'Open' in level1:
-            data.columns = level1
-        else:
-            data.columns = level0
-    required_columns = ['Open', 'High', 'Low', 'Close']
-    missing = [col for col in required_columns if col not in data.columns]
-    if missing:
-        raise ValueError(f"資料缺少必要欄位：{missing}")
-    data = data.dropna(subset=required_columns)
-    return data
+    return fetch_any_interval(ticker, period=period, interval=interval, start=start, end=end)
 
 
 # ------------------------------------------------------
-# 5) 建立多子圖 (3 rows):
+# 2) 建立多子圖 (3 rows，開啟形態時間軸時 4 rows):
 #    row=1: Candlestick + 蠟燭形態標記
 #    row=2: Volume
 #    row=3: 技術指標
+#    row=4: 形態時間軸 (熱圖)
 # ------------------------------------------------------
-def create_subplots_chart(data, patterns_df, tech_df):
+TIMELINE_COLORSCALE = [[0.0, 'rgb(0,140,60)'], [0.5, 'rgb(255,255,255)'], [1.0, 'rgb(210,20,20)']]
+
+
+def create_pattern_timeline(pattern_events, date_strings):
+    """
+    形態時間軸：單一 Heatmap trace (形態 × 日期)，顏色為帶正負號的強度 (紅漲綠跌)。
+    直接由事件轉成的矩陣建立，沒有出現過的形態不佔列，沒有訊號的格子留白
+    """
+    present = set(np.unique(pattern_events.pattern_ids).tolist())
+    columns = [name for name in pattern_events.columns if PATTERN_IDS[name] in present]
+    matrix = np.array(pattern_events.to_dense(columns).to_numpy(), dtype='float64').T
+    matrix[matrix == 0] = np.nan
+    return go.Heatmap(
+        z=matrix,
+        x=date_strings,
+        y=[pattern_descriptions.get(name, name) for name in columns],
+        colorscale=TIMELINE_COLORSCALE,
+        zmin=-200,
+        zmax=200,
+        zmid=0,
+        showscale=False,
+        hoverongaps=False,
+        hovertemplate="%{x}<br>%{y}<br>強度 %{z}<extra></extra>",
+        name='形態時間軸'
+    )
+
+
+def create_subplots_chart(data, pattern_events, tech_df, pattern_timeline=False):
     """
     建立一個包含 3 個子圖的 figure:
-    - row=1: K 線 + 形態標記
+    - row=1: K 線 + 形態標記 (pattern_events 為 PatternEvents)
     - row=2: 成交量
     - row=3: 技術指標
+    pattern_timeline=True 時改以第 4 列的熱圖呈現形態，K 線上不再逐根加文字標籤
     """
-    date_strings = [d.strftime('%Y-%m-%d') for d in data.index]
-
-    # 產生 3x1 子圖, row_heights 可自行調整
-    fig = make_subplots(rows=3, cols=1, shared_xaxes=True,
-                        row_heights=[0.4, 0.2, 0.4],
-                        vertical_spacing=0.03)
+    # 分鐘線需要顯示到時:分，否則同一天的 K 線會疊在一起
+    date_format = '%Y-%m-%d' if (data.index == data.index.normalize()).all() else '%Y-%m-%d %H:%M'
+    date_strings = list(data.index.strftime(date_format))
+    pattern_timeline = pattern_timeline and len(pattern_events) > 0
+
+    # 產生 3x1 (或 4x1) 子圖, row_heights 可自行調整
+    if pattern_timeline:
+        fig = make_subplots(rows=4, cols=1, shared_xaxes=True,
+                            row_heights=[0.35, 0.15, 0.3, 0.2],
+                            vertical_spacing=0.03)
+    else:
+        fig = make_subplots(rows=3, cols=1, shared_xaxes=True,
+                            row_heights=[0.4, 0.2, 0.4],
+                            vertical_spacing=0.03)
 
     # (A) row=1, col=1 放 K 線
     fig.add_trace(
@@ -391,29 +101,25 @@ def create_subplots_chart(data, patterns_df, tech_df):
         row=1, col=1
     )
 
-    # (B) row=1, col=1: 標記蠟燭形態
-    if not patterns_df.empty:
-        pattern_dates = patterns_df.index
-        if len(pattern_dates) > 0:
-            found_labels = []
-            for dt in pattern_dates:
-                row_data = patterns_df.loc[dt]
-                shapes = row_data[row_data != 0].index.tolist()
-                friendly = [pattern_descriptions.get(x, x) for x in shapes]
-                found_labels.append('\n'.join(friendly))
-            date_markers = [d.strftime('%Y-%m-%d') for d in pattern_dates]
-            fig.add_trace(
-                go.Scatter(
-                    x=date_markers,
-                    y=data.loc[pattern_dates, 'High'],
-                    mode='markers+text',
-                    marker=dict(symbol='triangle-down', size=15, color='red'),
-                    text=found_labels,
-                    textposition="top center",
-                    name='形態標記'
-                ),
-                row=1, col=1
-            )
+    # (B) row=1, col=1: 標記蠟燭形態 (直接依事件彙整，不逐列掃描形態表格)
+    if pattern_timeline:
+        fig.add_trace(create_pattern_timeline(pattern_events, date_strings), row=4, col=1)
+    elif len(pattern_events):
+        bars, labels = pattern_events.bar_labels(pattern_descriptions)
+        found_labels = ['\n'.join(friendly) for friendly in labels]
+        date_markers = [date_strings[i] for i in bars]
+        fig.add_trace(
+            go.Scatter(
+                x=date_markers,
+                y=np.asarray(data['High'])[bars],
+                mode='markers+text',
+                marker=dict(symbol='triangle-down', size=15, color='red'),
+                text=found_labels,
+                textposition="top center",
+                name='形態標記'
+            ),
+            row=1, col=1
+        )
 
     # (C) row=2, col=1: 成交量 (獨立子圖)
     fig.add_trace(
@@ -440,7 +146,7 @@ def create_subplots_chart(data, patterns_df, tech_df):
             )
 
     fig.update_layout(
-        height=900,
+        height=1100 if pattern_timeline else 900,
         title="Candlestick Pattern & Technical Indicator Analysis by David888.com",
         xaxis_title="日期"
     )
@@ -449,42 +155,58 @@ def create_subplots_chart(data, patterns_df, tech_df):
 
 
 # ------------------------------------------------------
-# 6) 主分析函式: 整合形態偵測、技術指標計算、以及繪製多子圖
+# 3) 主分析函式: 整合形態偵測、技術指標計算、以及繪製多子圖
 # ------------------------------------------------------
-def analyze_stock(ticker, period='6mo', pattern_types=None, signal_strength=0, selected_indicators=None):
+def analyze_stock(ticker, period='6mo', pattern_types=None, signal_strength=0, selected_indicators=None,
+                  start_date=None, end_date=None, interval='1d', pattern_timeline=False, compact=COMPACT_DTYPES,
+                  export_all_patterns=True, data=None):
     try:
-        # 抓取股價資料
-        data = fetch_stock_data(ticker, period)
-
-        # (1) 蠟燭形態偵測
-        all_patterns = detect_candlestick_patterns(data)
-
-        # 依照勾選的形態群組，組出 columns
-        if pattern_types and len(pattern_types) > 0:
-            selected_cols = []
-            for group in pattern_types:
-                selected_cols.extend(COMMON_PATTERNS.get(group, []))
+        # 抓取股價資料 (有填開始 / 結束日期時以日期為準)；呼叫端已抓好時直接使用
+        if data is None:
+            data = fetch_stock_data(ticker, period, interval=interval or '1d',
+                                    start=start_date or None, end=end_date or None)
+
+        # (1) 蠟燭形態偵測：圖表與共振分數只用勾選群組內的形態 (都沒勾時為全部)；
+        #     CSV 預設與原本相同匯出全部 61 種形態，export_all_patterns=False 時只計算 / 匯出勾選的形態。
+        #     觀察清單已預熱時直接取用；否則依 K 線內容快取，換一組勾選 / 別的使用者開同一張圖時
+        #     只算還沒算過的形態，同一張圖補進新 K 線時只重算尾端
+        selected_cols = resolve_patterns(pattern_types)
+        export_cols = resolve_patterns() if export_all_patterns else selected_cols
+        fingerprint = content_fingerprint(data)
+        export_df = precomputed.get_patterns(ticker, period, data, interval=interval or '1d',
+                                             fingerprint=fingerprint)
+        if export_df is None:
+            detector_key = (ticker.strip().upper(), period, interval, start_date or None, end_date or None)
+            export_df = cached_patterns(
+                data, export_cols, fingerprint=fingerprint,
+                compute=lambda d, names: detect_candlestick_patterns_incremental(detector_key, d, names))
         else:
-            selected_cols = all_patterns.columns
+            export_df = export_df[export_cols]
+        pattern_df = export_df[selected_cols]
 
-        # 信號強度過濾
-        patterns_filtered = all_patterns[selected_cols]
-        if signal_strength > 0:
-            patterns_filtered = patterns_filtered[
-                (patterns_filtered >= signal_strength) | (patterns_filtered <= -signal_strength)
-            ]
-        patterns_filtered = patterns_filtered[(patterns_filtered != 0).any(axis=1)]
+        # 信號強度過濾：轉成稀疏事件後只保留 |強度| >= 門檻的訊號
+        pattern_events = PatternEvents.from_frame(pattern_df).query(min_strength=signal_strength)
 
         # (2) 技術指標
         tech_df = pd.DataFrame()
         if selected_indicators:
-            tech_df = calculate_selected_indicators(data, selected_indicators)
+            tech_df = precomputed.get_indicators(ticker, period, data, selected_indicators,
+                                                  interval=interval or '1d', fingerprint=fingerprint)
+            if tech_df is None:
+                tech_df = cached_indicators(data, selected_indicators, fingerprint=fingerprint)
+
+        # 精簡型別模式：形態 int16、指標 float32、價格在精度允許時 float32
+        if compact:
+            data, export_df, tech_df = compact_frames(data, export_df, tech_df)
+            pattern_df = export_df[selected_cols]
 
         # (3) 建立多子圖 (3 rows)
-        chart = create_subplots_chart(data, patterns_filtered, tech_df)
+        chart = create_subplots_chart(data, pattern_events, tech_df, pattern_timeline=pattern_timeline)
 
-        # (4) 合併所有資訊到 results_df 方便下載
-        results_df = pd.concat([data, all_patterns, tech_df], axis=1)
+        # (4) 合併所有資訊到 results_df 方便下載 (直接引用各欄陣列，不再複製一份)，
+        #     最後一欄為形態 + 指標的共振分數 (勾選的指標才會列入條件)
+        score = score_frame(data, pattern_df, tech_df)
+        results_df = assemble_results(data, export_df, tech_df, score.to_frame())
 
         # (5) 輸出 CSV
         os.makedirs('tmp', exist_ok=True)
@@ -500,61 +222,148 @@ def analyze_stock(ticker, period='6mo', pattern_types=None, signal_strength=0, s
 
 
 # ------------------------------------------------------
-# 7) Gradio 介面
+# 4) Gradio 介面
 # ------------------------------------------------------
-with gr.Blocks() as interface:
-    gr.Markdown("# Candlestick Pattern & Technical Indicator Analysis by David888.com")
-    gr.Markdown("請輸入股票代碼、時間區間，選擇欲偵測的蠟燭形態、訊號強度以及技術指標。")
-
-    with gr.Row():
-        ticker_input = gr.Textbox(label="股票代碼", placeholder="例如：AAPL")
-        period_input = gr.Dropdown(
-            label="時間區間",
-            choices=["1mo", "3mo", "6mo", "1y"],
-            value="3mo"
+def build_interface():
+    with gr.Blocks() as interface:
+        gr.Markdown("# Candlestick Pattern & Technical Indicator Analysis by David888.com")
+        gr.Markdown("請輸入股票代碼、時間區間，選擇欲偵測的蠟燭形態、訊號強度以及技術指標。")
+
+        with gr.Row():
+            ticker_input = gr.Textbox(label="股票代碼", placeholder="例如：AAPL")
+            period_input = gr.Dropdown(
+                label="時間區間",
+                choices=["1mo", "3mo", "6mo", "1y"],
+                value="3mo"
+            )
+            interval_input = gr.Dropdown(
+                label="K 線週期",
+                choices=["1mo", "1wk", "1d", "4h", "60m", "15m", "5m", "1m"],
+                value="1d"
+            )
+            start_input = gr.Textbox(label="開始日期 (選填)", placeholder="YYYY-MM-DD，填寫後忽略時間區間")
+            end_input = gr.Textbox(label="結束日期 (選填)", placeholder="YYYY-MM-DD")
+        with gr.Row():
+            pattern_type = gr.CheckboxGroup(
+                label="蠟燭形態類型",
+                choices=["看漲形態", "看跌形態"],
+                value=["看漲形態", "看跌形態"]
+            )
+            signal_strength = gr.Slider(
+                label="訊號強度 (0=不過濾)",
+                minimum=0,
+                maximum=100,
+                value=0,
+                step=10
+            )
+            timeline_toggle = gr.Checkbox(label="形態時間軸 (熱圖，適合長區間)", value=False)
+            export_all_toggle = gr.Checkbox(label="CSV 匯出全部形態 (取消時只計算勾選的形態)", value=True)
+        with gr.Row():
+            indicator_selector = gr.CheckboxGroup(
+                label="技術指標 (可多選)",
+                choices=TECHNICAL_INDICATORS,
+                value=DEFAULT_INDICATORS  # 可自行調整預設勾選
+            )
+            custom_indicators = gr.Textbox(label="自訂指標參數 (選填)",
+                                           placeholder="例如：SMA(5/20/60/120), RSI(6), MACD(8,21,5)")
+        with gr.Row():
+            submit_btn = gr.Button("Submit")
+            clear_btn = gr.Button("Clear")
+
+        with gr.Column():
+            chart_output = gr.Plot(label="分析圖")
+            output_table = gr.Dataframe(label="分析結果")
+            performance_table = gr.Dataframe(label="形態歷史績效 (本地快取的完整歷史，形態出現後持有 N 根 K 線)")
+            file_output = gr.File(label="下載 CSV")
+
+        def process_input(ticker, period, selected_patterns, strength, selected_indicators, custom, start_date,
+                          end_date, interval, timeline, export_all):
+            selected_indicators = list(selected_indicators or []) + split_indicator_text(custom)
+            # K 線只抓一次：分析與形態歷史績效共用 (沒有本地 K 線快取時，績效表就以這份資料計算)
+            try:
+                data = fetch_stock_data(ticker, period, interval=interval or '1d',
+                                        start=start_date or None, end=end_date or None)
+            except Exception:
+                data = None  # 交給 analyze_stock 重新抓取並顯示錯誤訊息
+            results_df, chart, filename = analyze_stock(ticker, period, selected_patterns, strength, selected_indicators,
+                                                        start_date=start_date, end_date=end_date, interval=interval,
+                                                        pattern_timeline=timeline, export_all_patterns=export_all,
+                                                        data=data)
+            try:
+                performance = ticker_performance(ticker, interval or '1d', selected_patterns, data=data)
+            except Exception as e:
+                performance = pd.DataFrame({"Message": [str(e)]})
+            return results_df, chart, filename, performance
+
+        submit_btn.click(
+            fn=process_input,
+            inputs=[ticker_input, period_input, pattern_type, signal_strength, indicator_selector, custom_indicators,
+                    start_input, end_input, interval_input, timeline_toggle, export_all_toggle],
+            outputs=[output_table, chart_output, file_output, performance_table],
+            concurrency_limit=int(os.environ.get("KLINE_CONCURRENCY_LIMIT", "8"))
         )
-    with gr.Row():
-        pattern_type = gr.CheckboxGroup(
-            label="蠟燭形態類型",
-            choices=["看漲形態", "看跌形態"],
-            value=["看漲形態", "看跌形態"]
+
+        clear_btn.click(
+            fn=lambda: (None, None, None, None),
+            inputs=[],
+            outputs=[output_table, chart_output, file_output, performance_table]
         )
-        signal_strength = gr.Slider(
-            label="訊號強度 (0=不過濾)",
-            minimum=0,
-            maximum=100,
-            value=0,
-            step=10
+
+        # 全市場掃描：沿用上方的時間區間、K 線週期、形態類型、訊號強度與技術指標設定
+        with gr.Accordion("全市場掃描", open=False):
+            with gr.Row():
+                universe_input = gr.Textbox(label="掃描範圍", value="DOW30",
+                                            placeholder="DOW30、watchlist、股票清單檔路徑或逗號分隔代碼")
+                scan_btn = gr.Button("開始掃描")
+            scan_output = gr.Dataframe(label="掃描結果 (最近 K 線出現訊號的股票)")
+            scan_stats = gr.JSON(label="掃描統計")
+
+        def process_scan(universe, period, selected_patterns, strength, selected_indicators, interval):
+            try:
+                table, errors, stats = scan_market(load_universe(universe), period, interval=interval or '1d',
+                                                   patterns=selected_patterns, signal_strength=strength,
+                                                   indicators=selected_indicators)
+            except Exception as e:
+                return pd.DataFrame({"Error": [str(e)]}), None
+            stats['errors'] = errors
+            if table.empty:
+                table = pd.DataFrame({"Message": ["最近的 K 線沒有符合條件的形態。"]})
+            return table, stats
+
+        scan_btn.click(
+            fn=process_scan,
+            inputs=[universe_input, period_input, pattern_type, signal_strength, indicator_selector, interval_input],
+            outputs=[scan_output, scan_stats],
+            concurrency_limit=1
         )
-    with gr.Row():
-        indicator_selector = gr.CheckboxGroup(
-            label="技術指標 (可多選)",
-            choices=TECHNICAL_INDICATORS,
-            value=["MACD", "RSI", "BBANDS"]  # 可自行調整預設勾選
+
+        # 相似走勢搜尋：以上方股票最近 N 根 K 線的收盤價形狀比對歷史
+        with gr.Accordion("相似走勢搜尋", open=False):
+            with gr.Row():
+                similarity_window = gr.Slider(label="比對最近幾根 K 線", minimum=5, maximum=120, value=20, step=1)
+                similarity_scope = gr.Radio(label="搜尋範圍", choices=[("本檔歷史", "ticker"), ("全市場", "universe")],
+                                            value="ticker")
+                similarity_btn = gr.Button("搜尋")
+            similarity_output = gr.Dataframe(label="最相似的歷史區段與之後的報酬")
+
+        def process_similarity(ticker, window, scope, interval):
+            try:
+                return find_similar(ticker, m=int(window), k=10, scope=scope, interval=interval or '1d')
+            except Exception as e:
+                return pd.DataFrame({"Error": [str(e)]})
+
+        similarity_btn.click(
+            fn=process_similarity,
+            inputs=[ticker_input, similarity_window, similarity_scope, interval_input],
+            outputs=[similarity_output]
         )
-    with gr.Row():
-        submit_btn = gr.Button("Submit")
-        clear_btn = gr.Button("Clear")
-
-    with gr.Column():
-        chart_output = gr.Plot(label="分析圖")
-        output_table = gr.Dataframe(label="分析結果")
-        file_output = gr.File(label="下載 CSV")
-
-    def process_input(ticker, period, selected_patterns, strength, selected_indicators):
-        return analyze_stock(ticker, period, selected_patterns, strength, selected_indicators)
-
-    submit_btn.click(
-        fn=process_input,
-        inputs=[ticker_input, period_input, pattern_type, signal_strength, indicator_selector],
-        outputs=[output_table, chart_output, file_output]
-    )
+    return interface
 
-    clear_btn.click(
-        fn=lambda: (None, None, None),
-        inputs=[],
-        outputs=[output_table, chart_output, file_output]
-    )
+
+# 掃描 / 參數掃描的 worker 以 spawn 啟動時會以 __mp_main__ 重新執行本檔，此時不建立介面
+interface = build_interface() if __name__ != '__mp_main__' else None
 
 if __name__ == "__main__":
+    if os.environ.get("KLINE_PREWARM", "0") == "1":
+        start_prewarm_scheduler(refresh_now=True)
     interface.launch(server_name="0.0.0.0", server_port=5678, share=False)
\ No newline at end of file
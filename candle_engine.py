@@ -0,0 +1,576 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from patterns import PATTERN_FUNCTIONS, PATTERN_LOOKBACK, resolve_patterns
+
+# ------------------------------------------------------
+# 向量化蠟燭形態引擎：一次處理 (ticker 數 × K 線數) 的 2-D OHLC 陣列，
+# 回傳與 TA-Lib 相同的 ±80 / ±100 / ±200 代碼。
+# 已移植的形態由 tests/test_candle_engine.py 以合成資料 (另有 --record 錄下的實際行情時一併) 逐格比對 TA-Lib 把關；
+# 尚未移植的形態逐列呼叫 TA-Lib。
+# 實測 1000 根 K 線時約快 1.2 ~ 1.3 倍 (批次越大越明顯)，單檔反而比 TA-Lib 慢，
+# 因此 engine='auto' 只在股票數達 KLINE_VECTOR_MIN_ROWS 時才走向量化路徑
+# ------------------------------------------------------
+VECTOR_MIN_ROWS = int(os.environ.get("KLINE_VECTOR_MIN_ROWS", "8"))
+
+# TA-Lib 預設的蠟燭設定：(比較基準, 平均期間, 倍數)
+CANDLE_SETTINGS = {
+    'BodyLong': ('RealBody', 10, 1.0),
+    'BodyVeryLong': ('RealBody', 10, 3.0),
+    'BodyShort': ('RealBody', 10, 1.0),
+    'BodyDoji': ('HighLow', 10, 0.1),
+    'ShadowLong': ('RealBody', 0, 1.0),
+    'ShadowVeryLong': ('RealBody', 0, 2.0),
+    'ShadowShort': ('Shadows', 10, 1.0),
+    'ShadowVeryShort': ('HighLow', 10, 0.1),
+    'Near': ('HighLow', 5, 0.2),
+    'Far': ('HighLow', 5, 0.6),
+    'Equal': ('HighLow', 5, 0.05),
+}
+
+
+# ------------------------------------------------------
+# 1) 蠟燭基本量
+# ------------------------------------------------------
+class CandleArrays:
+    """
+    2-D OHLC 與實體、影線等衍生量。輸入左側先補 MAX_SHIFT 欄 NaN，之後所有量都是不複製的 view：
+    c.close 為當根，prev('close', k) 為 k 根前 (同形狀)；
+    avg(setting, k) 為 k 根前那根 K 線的 TA-Lib 蠟燭平均 (不足期間時為 NaN，比較結果為 False)
+    """
+    MAX_SHIFT = 3
+
+    def __init__(self, open_, high, low, close):
+        self.shape = open_.shape
+        self.width = open_.shape[1]
+        open_, high, low, close = (
+            np.pad(v, ((0, 0), (self.MAX_SHIFT, 0)), constant_values=np.nan) for v in (open_, high, low, close)
+        )
+        top = np.maximum(open_, close)
+        bottom = np.minimum(open_, close)
+        self._full = {
+            'open': open_,
+            'high': high,
+            'low': low,
+            'close': close,
+            'top': top,
+            'bottom': bottom,
+            'body': np.abs(close - open_),
+            'upper': high - top,
+            'lower': bottom - low,
+            'range': high - low,
+            'color': np.where(close >= open_, 1, -1).astype('int32'),
+        }
+        for name in self._full:
+            setattr(self, name, self.prev(name, 0))
+        self._sums = {}
+        self._averages = {}
+
+    def _view(self, values, k):
+        start = self.MAX_SHIFT - k
+        return values[:, start:start + self.width]
+
+    def prev(self, name, k):
+        return self._view(self._full[name], k)
+
+    def avg(self, setting, k=0):
+        if setting not in self._averages:
+            range_type, period, factor = CANDLE_SETTINGS[setting]
+            if period:
+                average = factor * self._trailing_mean(range_type, period)
+            else:
+                average = factor * self._full['body' if range_type == 'RealBody' else 'range']
+            if range_type == 'Shadows':
+                average = average / 2.0
+            self._averages[setting] = average
+        return self._view(self._averages[setting], k)
+
+    def _trailing_mean(self, range_type, period):
+        """前 period 根 (不含當根) 的平均；相同基準與期間的設定共用 (例如 BodyLong / BodyShort)"""
+        key = (range_type, period)
+        if key not in self._sums:
+            if range_type == 'RealBody':
+                base = self._full['body']
+            elif range_type == 'HighLow':
+                base = self._full['range']
+            else:
+                base = self._full['upper'] + self._full['lower']
+            mean = np.full_like(base, np.nan)
+            if base.shape[1] > period:
+                windows = np.lib.stride_tricks.sliding_window_view(base, period, axis=1)
+                mean[:, period:] = windows[:, :-1].sum(axis=2) / period
+            self._sums[key] = mean
+        return self._sums[key]
+
+    def body_gap_up(self, a, b):
+        """第 a 根的實體整個高於第 b 根 (a、b 為往前幾根)"""
+        return self.prev('bottom', a) > self.prev('top', b)
+
+    def body_gap_down(self, a, b):
+        return self.prev('top', a) < self.prev('bottom', b)
+
+
+def _signed(condition, sign, value=100):
+    return condition * (sign * value)
+
+
+# ------------------------------------------------------
+# 2) 已移植的形態 (與 TA-Lib 原始碼的判斷條件一一對應)
+# ------------------------------------------------------
+def _doji(c):
+    return _signed(c.body <= c.avg('BodyDoji'), 1)
+
+
+def _dragonfly_doji(c):
+    return _signed((c.body <= c.avg('BodyDoji')) & (c.upper < c.avg('ShadowVeryShort'))
+                   & (c.lower > c.avg('ShadowVeryShort')), 1)
+
+
+def _gravestone_doji(c):
+    return _signed((c.body <= c.avg('BodyDoji')) & (c.lower < c.avg('ShadowVeryShort'))
+                   & (c.upper > c.avg('ShadowVeryShort')), 1)
+
+
+def _long_legged_doji(c):
+    return _signed((c.body <= c.avg('BodyDoji'))
+                   & ((c.lower > c.avg('ShadowLong')) | (c.upper > c.avg('ShadowLong'))), 1)
+
+
+def _rickshaw_man(c):
+    middle = c.low + c.range / 2
+    return _signed((c.body <= c.avg('BodyDoji')) & (c.lower > c.avg('ShadowLong'))
+                   & (c.upper > c.avg('ShadowLong'))
+                   & (c.bottom <= middle + c.avg('Near')) & (c.top >= middle - c.avg('Near')), 1)
+
+
+def _takuri(c):
+    return _signed((c.body <= c.avg('BodyDoji')) & (c.upper < c.avg('ShadowVeryShort'))
+                   & (c.lower > c.avg('ShadowVeryLong')), 1)
+
+
+def _hammer(c):
+    return _signed((c.body < c.avg('BodyShort')) & (c.lower > c.avg('ShadowLong'))
+                   & (c.upper < c.avg('ShadowVeryShort'))
+                   & (c.bottom <= c.prev('low', 1) + c.avg('Near', 1)), 1)
+
+
+def _hanging_man(c):
+    return _signed((c.body < c.avg('BodyShort')) & (c.lower > c.avg('ShadowLong'))
+                   & (c.upper < c.avg('ShadowVeryShort'))
+                   & (c.bottom >= c.prev('high', 1) - c.avg('Near', 1)), -1)
+
+
+def _inverted_hammer(c):
+    return _signed((c.body < c.avg('BodyShort')) & (c.upper > c.avg('ShadowLong'))
+                   & (c.lower < c.avg('ShadowVeryShort')) & c.body_gap_down(0, 1), 1)
+
+
+def _shooting_star(c):
+    return _signed((c.body < c.avg('BodyShort')) & (c.upper > c.avg('ShadowLong'))
+                   & (c.lower < c.avg('ShadowVeryShort')) & c.body_gap_up(0, 1), -1)
+
+
+def _marubozu(c):
+    return _signed((c.body > c.avg('BodyLong')) & (c.upper < c.avg('ShadowVeryShort'))
+                   & (c.lower < c.avg('ShadowVeryShort')), c.color)
+
+
+def _closing_marubozu(c):
+    return _signed((c.body > c.avg('BodyLong'))
+                   & (((c.color == 1) & (c.upper < c.avg('ShadowVeryShort')))
+                      | ((c.color == -1) & (c.lower < c.avg('ShadowVeryShort')))), c.color)
+
+
+def _belt_hold(c):
+    return _signed((c.body > c.avg('BodyLong'))
+                   & (((c.color == 1) & (c.lower < c.avg('ShadowVeryShort')))
+                      | ((c.color == -1) & (c.upper < c.avg('ShadowVeryShort')))), c.color)
+
+
+def _long_line(c):
+    return _signed((c.body > c.avg('BodyLong')) & (c.upper < c.avg('ShadowShort'))
+                   & (c.lower < c.avg('ShadowShort')), c.color)
+
+
+def _short_line(c):
+    return _signed((c.body < c.avg('BodyShort')) & (c.upper < c.avg('ShadowShort'))
+                   & (c.lower < c.avg('ShadowShort')), c.color)
+
+
+def _spinning_top(c):
+    return _signed((c.body < c.avg('BodyShort')) & (c.upper > c.body) & (c.lower > c.body), c.color)
+
+
+def _high_wave(c):
+    return _signed((c.body < c.avg('BodyShort')) & (c.upper > c.avg('ShadowVeryLong'))
+                   & (c.lower > c.avg('ShadowVeryLong')), c.color)
+
+
+def _engulfing(c):
+    o, cl = c.open, c.close
+    o1, c1 = c.prev('open', 1), c.prev('close', 1)
+    color1 = c.prev('color', 1)
+    white = (c.color == 1) & (color1 == -1) & (((cl >= o1) & (o < c1)) | ((cl > o1) & (o <= c1)))
+    black = (c.color == -1) & (color1 == 1) & (((o >= c1) & (cl < o1)) | ((o > c1) & (cl <= o1)))
+    strict = (o != c1) & (cl != o1)
+    return _signed(white | black, c.color, np.where(strict, 100, 80))
+
+
+def _harami_like(c, current_small):
+    top1, bottom1 = c.prev('top', 1), c.prev('bottom', 1)
+    base = (c.prev('body', 1) > c.avg('BodyLong', 1)) & current_small
+    inside = (c.top < top1) & (c.bottom > bottom1)
+    touching = (c.top <= top1) & (c.bottom >= bottom1)
+    return _signed(base & touching, -c.prev('color', 1), np.where(inside, 100, 80))
+
+
+def _harami(c):
+    return _harami_like(c, c.body <= c.avg('BodyShort'))
+
+
+def _harami_cross(c):
+    return _harami_like(c, c.body <= c.avg('BodyDoji'))
+
+
+def _piercing(c):
+    c1, o1 = c.prev('close', 1), c.prev('open', 1)
+    body1 = c.prev('body', 1)
+    return _signed((c.prev('color', 1) == -1) & (body1 > c.avg('BodyLong', 1))
+                   & (c.color == 1) & (c.body > c.avg('BodyLong'))
+                   & (c.open < c.prev('low', 1)) & (c.close < o1) & (c.close > c1 + body1 * 0.5), 1)
+
+
+def _dark_cloud_cover(c, penetration=0.5):
+    c1, o1 = c.prev('close', 1), c.prev('open', 1)
+    body1 = c.prev('body', 1)
+    return _signed((c.prev('color', 1) == 1) & (body1 > c.avg('BodyLong', 1)) & (c.color == -1)
+                   & (c.open > c.prev('high', 1)) & (c.close > o1)
+                   & (c.close < c1 - body1 * penetration), -1)
+
+
+def _homing_pigeon(c):
+    return _signed((c.prev('color', 1) == -1) & (c.color == -1)
+                   & (c.prev('body', 1) > c.avg('BodyLong', 1)) & (c.body <= c.avg('BodyShort'))
+                   & (c.open < c.prev('open', 1)) & (c.close > c.prev('close', 1)), 1)
+
+
+def _matching_low(c):
+    c1 = c.prev('close', 1)
+    return _signed((c.prev('color', 1) == -1) & (c.color == -1)
+                   & (c.close <= c1 + c.avg('Equal', 1)) & (c.close >= c1 - c.avg('Equal', 1)), 1)
+
+
+def _neck_base(c):
+    return ((c.prev('color', 1) == -1) & (c.prev('body', 1) > c.avg('BodyLong', 1))
+            & (c.color == 1) & (c.open < c.prev('low', 1)))
+
+
+def _in_neck(c):
+    c1 = c.prev('close', 1)
+    return _signed(_neck_base(c) & (c.close <= c1 + c.avg('Equal', 1)) & (c.close >= c1), -1)
+
+
+def _on_neck(c):
+    l1 = c.prev('low', 1)
+    return _signed(_neck_base(c) & (c.close <= l1 + c.avg('Equal', 1))
+                   & (c.close >= l1 - c.avg('Equal', 1)), -1)
+
+
+def _thrusting(c):
+    c1 = c.prev('close', 1)
+    return _signed(_neck_base(c) & (c.close > c1 + c.avg('Equal', 1))
+                   & (c.close <= c1 + c.prev('body', 1) * 0.5), -1)
+
+
+def _doji_star(c):
+    color1 = c.prev('color', 1)
+    return _signed((c.prev('body', 1) > c.avg('BodyLong', 1)) & (c.body <= c.avg('BodyDoji'))
+                   & (((color1 == 1) & c.body_gap_up(0, 1)) | ((color1 == -1) & c.body_gap_down(0, 1))),
+                   -color1)
+
+
+def _star(c, bullish, middle, penetration=0.3):
+    color2, body2, c2 = c.prev('color', 2), c.prev('body', 2), c.prev('close', 2)
+    base = (body2 > c.avg('BodyLong', 2)) & middle & (c.body > c.avg('BodyShort'))
+    if bullish:
+        return _signed(base & (color2 == -1) & c.body_gap_down(1, 2) & (c.color == 1)
+                       & (c.close > c2 + body2 * penetration), 1)
+    return _signed(base & (color2 == 1) & c.body_gap_up(1, 2) & (c.color == -1)
+                   & (c.close < c2 - body2 * penetration), -1)
+
+
+def _morning_star(c):
+    return _star(c, True, c.prev('body', 1) <= c.avg('BodyShort', 1))
+
+
+def _evening_star(c):
+    return _star(c, False, c.prev('body', 1) <= c.avg('BodyShort', 1))
+
+
+def _morning_doji_star(c):
+    return _star(c, True, c.prev('body', 1) <= c.avg('BodyDoji', 1))
+
+
+def _evening_doji_star(c):
+    return _star(c, False, c.prev('body', 1) <= c.avg('BodyDoji', 1))
+
+
+def _three_inside(c):
+    color2, o2 = c.prev('color', 2), c.prev('open', 2)
+    return _signed((c.prev('body', 2) > c.avg('BodyLong', 2)) & (c.prev('body', 1) <= c.avg('BodyShort', 1))
+                   & (c.prev('top', 1) < c.prev('top', 2)) & (c.prev('bottom', 1) > c.prev('bottom', 2))
+                   & (((color2 == 1) & (c.color == -1) & (c.close < o2))
+                      | ((color2 == -1) & (c.color == 1) & (c.close > o2))), -color2)
+
+
+def _three_outside(c):
+    color1, color2 = c.prev('color', 1), c.prev('color', 2)
+    o1, c1, o2, c2 = c.prev('open', 1), c.prev('close', 1), c.prev('open', 2), c.prev('close', 2)
+    return _signed(((color1 == 1) & (color2 == -1) & (c1 > o2) & (o1 < c2) & (c.close > c1))
+                   | ((color1 == -1) & (color2 == 1) & (o1 > c2) & (c1 < o2) & (c.close < c1)), color1)
+
+
+def _three_black_crows(c):
+    o, cl = c.open, c.close
+    o1, c1, o2, c2 = c.prev('open', 1), c.prev('close', 1), c.prev('open', 2), c.prev('close', 2)
+    short_lower = [c.prev('lower', k) < c.avg('ShadowVeryShort', k) for k in (2, 1, 0)]
+    return _signed((c.prev('color', 3) == 1) & (c.prev('color', 2) == -1) & (c.prev('color', 1) == -1)
+                   & (c.color == -1) & short_lower[0] & short_lower[1] & short_lower[2]
+                   & (o1 < o2) & (o1 > c2) & (o < o1) & (o > c1)
+                   & (c.prev('high', 3) > c2) & (c2 > c1) & (c1 > cl), -1)
+
+
+def _two_crows(c):
+    o1, c1, o2, c2 = c.prev('open', 1), c.prev('close', 1), c.prev('open', 2), c.prev('close', 2)
+    return _signed((c.prev('color', 2) == 1) & (c.prev('body', 2) > c.avg('BodyLong', 2))
+                   & (c.prev('color', 1) == -1) & c.body_gap_up(1, 2) & (c.color == -1)
+                   & (c.open < o1) & (c.open > c1) & (c.close > o2) & (c.close < c2), -1)
+
+
+def _upside_gap_two_crows(c):
+    o1, c1, c2 = c.prev('open', 1), c.prev('close', 1), c.prev('close', 2)
+    return _signed((c.prev('color', 2) == 1) & (c.prev('body', 2) > c.avg('BodyLong', 2))
+                   & (c.prev('color', 1) == -1) & (c.prev('body', 1) <= c.avg('BodyShort', 1))
+                   & c.body_gap_up(1, 2) & (c.color == -1)
+                   & (c.open > o1) & (c.close < c1) & (c.close > c2), -1)
+
+
+VECTORIZED_PATTERNS = {
+    "CDL2CROWS": _two_crows,
+    "CDL3BLACKCROWS": _three_black_crows,
+    "CDL3INSIDE": _three_inside,
+    "CDL3OUTSIDE": _three_outside,
+    "CDLBELTHOLD": _belt_hold,
+    "CDLCLOSINGMARUBOZU": _closing_marubozu,
+    "CDLDARKCLOUDCOVER": _dark_cloud_cover,
+    "CDLDOJI": _doji,
+    "CDLDOJISTAR": _doji_star,
+    "CDLDRAGONFLYDOJI": _dragonfly_doji,
+    "CDLENGULFING": _engulfing,
+    "CDLEVENINGDOJISTAR": _evening_doji_star,
+    "CDLEVENINGSTAR": _evening_star,
+    "CDLGRAVESTONEDOJI": _gravestone_doji,
+    "CDLHAMMER": _hammer,
+    "CDLHANGINGMAN": _hanging_man,
+    "CDLHARAMI": _harami,
+    "CDLHARAMICROSS": _harami_cross,
+    "CDLHIGHWAVE": _high_wave,
+    "CDLHOMINGPIGEON": _homing_pigeon,
+    "CDLINNECK": _in_neck,
+    "CDLINVERTEDHAMMER": _inverted_hammer,
+    "CDLLONGLEGGEDDOJI": _long_legged_doji,
+    "CDLLONGLINE": _long_line,
+    "CDLMARUBOZU": _marubozu,
+    "CDLMATCHINGLOW": _matching_low,
+    "CDLMORNINGDOJISTAR": _morning_doji_star,
+    "CDLMORNINGSTAR": _morning_star,
+    "CDLONNECK": _on_neck,
+    "CDLPIERCING": _piercing,
+    "CDLRICKSHAWMAN": _rickshaw_man,
+    "CDLSHOOTINGSTAR": _shooting_star,
+    "CDLSHORTLINE": _short_line,
+    "CDLSPINNINGTOP": _spinning_top,
+    "CDLTAKURI": _takuri,
+    "CDLTHRUSTING": _thrusting,
+    "CDLUPSIDEGAP2CROWS": _upside_gap_two_crows,
+}
+
+
+# ------------------------------------------------------
+# 3) 批次偵測
+# ------------------------------------------------------
+def _as_2d(values):
+    array = np.asarray(values, dtype='float64')
+    return array[np.newaxis, :] if array.ndim == 1 else array
+
+
+def _talib_rows(name, open_, high, low, close):
+    """TA-Lib 路徑：逐列 (逐檔) 呼叫"""
+    function = PATTERN_FUNCTIONS[name]
+    result = np.zeros(open_.shape, dtype='int32')
+    for row in range(open_.shape[0]):
+        if np.isnan(close[row]).all():
+            continue
+        result[row] = function(open_[row], high[row], low[row], close[row])
+    return result
+
+
+def _vectorized(name, candles, first_valid):
+    result = VECTORIZED_PATTERNS[name](candles).astype('int32')
+    # 與 TA-Lib 相同：每一列從第一根有效 K 線 + lookback 才開始輸出
+    columns = np.arange(result.shape[1])
+    result[columns[np.newaxis, :] < (first_valid + PATTERN_LOOKBACK[name])[:, np.newaxis]] = 0
+    return result
+
+
+def _first_valid(close):
+    valid = ~np.isnan(close)
+    return np.where(valid.any(axis=1), valid.argmax(axis=1), close.shape[1])
+
+
+def detect_patterns_2d(open_, high, low, close, patterns=None, engine='auto'):
+    """
+    一次偵測多檔股票：輸入 (ticker 數 × K 線數) 陣列 (1-D 視為單檔)，
+    回傳 {CDL 名稱: 同形狀的 int32 代碼陣列}。
+    engine='auto' 時股票數達 VECTOR_MIN_ROWS 才走向量化路徑，'numpy' 一律向量化，
+    'talib' 則全部逐列呼叫 TA-Lib
+    """
+    if engine not in ('auto', 'numpy', 'talib'):
+        raise ValueError(f"未知的形態引擎：{engine}")
+    open_, high, low, close = (_as_2d(v) for v in (open_, high, low, close))
+    if not (open_.shape == high.shape == low.shape == close.shape):
+        raise ValueError("OHLC 陣列形狀不一致。")
+
+    names = resolve_patterns(patterns)
+    if engine == 'talib' or (engine == 'auto' and open_.shape[0] < VECTOR_MIN_ROWS):
+        ported = set()
+    else:
+        ported = set(VECTORIZED_PATTERNS)
+    candles = CandleArrays(open_, high, low, close) if ported.intersection(names) else None
+    first_valid = _first_valid(close)
+
+    results = {}
+    for name in names:
+        if name in ported:
+            results[name] = _vectorized(name, candles, first_valid)
+        else:
+            results[name] = _talib_rows(name, open_, high, low, close)
+    return results
+
+
+def detect_universe_patterns(universe, patterns=None, tickers=None, engine='auto'):
+    """
+    對 universe_store.UniverseStore 的整個市場 (或指定股票) 一次偵測，回傳同 detect_patterns_2d。
+    中間有缺值 (停牌等) 的股票與 UniverseStore.bars 相同，先壓縮成不含缺值的 K 線再偵測，
+    結果放回原本的日期位置 (缺值處為 0)，與 detect_candlestick_patterns(universe.bars(t)) 一致
+    """
+    names = list(universe.tickers) if tickers is None else list(tickers)
+    positions = {t: i for i, t in enumerate(universe.tickers)}
+    rows = [positions[t] for t in names] if tickers is not None else slice(None)
+    fields = [np.asarray(universe.field(f)[rows], dtype='float64') for f in ('Open', 'High', 'Low', 'Close')]
+    results = detect_patterns_2d(*fields, patterns=patterns, engine=engine)
+
+    for row, ticker in enumerate(names):
+        if universe.is_dense(ticker):
+            continue
+        valid = ~np.isnan(fields[3][row])
+        compressed = detect_patterns_2d(*(values[row][valid] for values in fields), patterns=patterns, engine=engine)
+        for name, codes in results.items():
+            codes[row] = 0
+            codes[row, valid] = compressed[name][0]
+    return results
+
+
+# ------------------------------------------------------
+# 4) 與 TA-Lib 的一致性校驗
+# ------------------------------------------------------
+def compare_with_talib(open_, high, low, close, patterns=None):
+    """
+    在給定資料 (合成或實際紀錄) 上比較已移植形態與 TA-Lib，
+    回傳 {CDL 名稱: (不一致的格數, TA-Lib 出現訊號的格數)}
+    """
+    open_, high, low, close = (_as_2d(v) for v in (open_, high, low, close))
+    names = [n for n in resolve_patterns(patterns) if n in VECTORIZED_PATTERNS]
+    ours = detect_patterns_2d(open_, high, low, close, names, engine='numpy')
+    reference = detect_patterns_2d(open_, high, low, close, names, engine='talib')
+    return {
+        name: (int((ours[name] != reference[name]).sum()), int((reference[name] != 0).sum()))
+        for name in names
+    }
+
+
+def synthetic_ohlc(tickers=64, bars=800, seed=7):
+    """
+    校驗用的合成 K 線：價格取到小數兩位 (製造相等的邊界情況)，
+    並刻意混入十字線、缺影線、跳空與長實體，讓各形態都有機會出現
+    """
+    rng = np.random.default_rng(seed)
+    shape = (tickers, bars)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, shape), axis=1))
+    prev_close = np.concatenate([close[:, :1], close[:, :-1]], axis=1)
+    gap = rng.normal(0, 0.01, shape) * (rng.random(shape) < 0.3)
+    open_ = prev_close * (1 + gap)
+    long_body = rng.random(shape) < 0.15
+    close = np.where(long_body, open_ * (1 + rng.choice([-1, 1], shape) * rng.uniform(0.03, 0.06, shape)), close)
+    doji = rng.random(shape) < 0.12
+    close = np.where(doji, open_ * (1 + rng.normal(0, 0.0005, shape)), close)
+    span = np.abs(close - open_) + close * 0.002
+    upper = span * rng.exponential(0.6, shape) * (rng.random(shape) > 0.2)
+    lower = span * rng.exponential(0.6, shape) * (rng.random(shape) > 0.2)
+    high = np.maximum(open_, close) + upper
+    low = np.minimum(open_, close) - lower
+    return tuple(np.round(v, 2) for v in (open_, high, low, close))
+
+
+def record_fixture(universe, path, tickers=None, bars=500):
+    """
+    將 universe_store 中股票最近 bars 根實際 K 線存成 CSV (date, ticker, OHLC)，
+    存成 tests/fixtures/recorded_ohlc.csv 時 tests/test_candle_engine.py 會以它比對 TA-Lib
+    """
+    frames = []
+    for ticker in tickers or universe.tickers:
+        data = universe.bars(ticker).to_frame().iloc[-bars:]
+        frame = data[['Open', 'High', 'Low', 'Close']].copy()
+        frame.insert(0, 'Ticker', ticker)
+        frames.append(frame.rename_axis('Date').reset_index())
+    pd.concat(frames).to_csv(path, index=False)
+
+
+# ------------------------------------------------------
+# 命令列：python candle_engine.py [--universe cache/universe/tw] [--record tests/fixtures/recorded_ohlc.csv]
+#   不指定時以合成資料校驗；指定時以實際資料校驗，並比較兩條路徑的耗時。
+#   --record 將實際行情存成測試用的 CSV
+# ------------------------------------------------------
+if __name__ == "__main__":
+    import time
+
+    parser = argparse.ArgumentParser(description="向量化蠟燭形態引擎與 TA-Lib 的一致性校驗")
+    parser.add_argument('--universe', help="universe_store 目錄 (實際資料)")
+    parser.add_argument('--record', help="將 --universe 的資料存成測試用 CSV")
+    parser.add_argument('--tickers', nargs='*', help="--record 時只存這些股票")
+    args = parser.parse_args()
+
+    if args.universe:
+        from universe_store import UniverseStore
+
+        universe = UniverseStore(args.universe)
+        if args.record:
+            record_fixture(universe, args.record, args.tickers)
+            print(f"-> {args.record}")
+            raise SystemExit(0)
+        arrays = [np.asarray(universe.field(f), dtype='float64') for f in ('Open', 'High', 'Low', 'Close')]
+    else:
+        arrays = list(synthetic_ohlc())
+
+    for name, (mismatches, hits) in compare_with_talib(*arrays).items():
+        status = "OK" if mismatches == 0 else "不一致"
+        print(f"{name:<22} {status:<4} 不一致 {mismatches:>6}  訊號 {hits:>6}")
+    print(f"未移植 (TA-Lib)：{', '.join(sorted(set(PATTERN_FUNCTIONS) - set(VECTORIZED_PATTERNS)))}")
+
+    for engine in ('talib', 'numpy'):
+        started = time.perf_counter()
+        detect_patterns_2d(*arrays, engine=engine)
+        print(f"{engine:<6} {time.perf_counter() - started:.3f}s")
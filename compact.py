@@ -0,0 +1,123 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# ------------------------------------------------------
+# 精簡型別模式 (KLINE_COMPACT_DTYPES=1)：
+#   形態代碼  int32   -> int16 (代碼只有 0 / ±80 / ±100 / ±200，超出 int8 範圍)
+#   技術指標  float64 -> float32
+#   價格      float64 -> float32 (轉換後仍能保留 KLINE_COMPACT_PRICE_DECIMALS 位小數時才轉)
+#   成交量    int64   -> int32 (不會溢位時才轉)
+# 適合常駐大量股票結果的掃描 / 預熱快取
+# ------------------------------------------------------
+COMPACT_DTYPES = os.environ.get("KLINE_COMPACT_DTYPES", "0") == "1"
+COMPACT_PRICE_DECIMALS = int(os.environ.get("KLINE_COMPACT_PRICE_DECIMALS", "4"))
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close']
+
+
+def compact_patterns(frame):
+    return frame.astype('int16')
+
+
+def compact_indicators(frame):
+    return frame.astype('float32')
+
+
+def _fits_float32(values, decimals):
+    values = np.asarray(values, dtype='float64')
+    error = np.abs(values.astype('float32').astype('float64') - values)
+    return bool(np.nanmax(error, initial=0.0) < 0.5 * 10.0 ** -decimals)
+
+
+def compact_prices(frame, decimals=COMPACT_PRICE_DECIMALS):
+    """價格欄位在不損失 decimals 位小數的前提下轉成 float32；成交量在 int32 範圍內時轉成 int32"""
+    dtypes = {}
+    for col in PRICE_COLUMNS:
+        if col in frame.columns and frame[col].dtype == 'float64' and _fits_float32(frame[col], decimals):
+            dtypes[col] = 'float32'
+    if 'Volume' in frame.columns and frame['Volume'].dtype == 'int64' and len(frame):
+        if frame['Volume'].max() <= np.iinfo('int32').max and frame['Volume'].min() >= np.iinfo('int32').min:
+            dtypes['Volume'] = 'int32'
+    return frame.astype(dtypes) if dtypes else frame
+
+
+def compact_frames(data, pattern_df, tech_df):
+    return compact_prices(data), compact_patterns(pattern_df), compact_indicators(tech_df)
+
+
+def assemble_results(*frames):
+    """
+    將多個相同索引的表格並排成一張：直接引用各欄的陣列 (不合併成 2-D block)，
+    不像 pd.concat(axis=1) 會再複製一份
+    """
+    frames = [f for f in frames if f is not None and len(f.columns)]
+    if not frames:
+        return pd.DataFrame()
+    index = frames[0].index
+    columns = {}
+    for frame in frames:
+        for col in frame.columns:
+            columns[col] = frame[col].to_numpy()
+    return pd.DataFrame(columns, index=index, copy=False)
+
+
+# ------------------------------------------------------
+# 記憶體統計
+# ------------------------------------------------------
+def frame_nbytes(frame):
+    return 0 if frame is None else int(frame.memory_usage(index=False, deep=True).sum())
+
+
+def _baseline_itemsize(col, dtype):
+    """預設型別的每格大小：形態代碼 int32，成交量 int64，其餘 float64"""
+    if np.issubdtype(dtype, np.integer) and col != 'Volume':
+        return 4
+    return 8
+
+
+def memory_report(**frames):
+    """
+    各表格目前佔用的 bytes，以及若以預設型別 (float64 / int32 / int64) 保存時的大小，
+    用來顯示精簡模式省下多少記憶體
+    """
+    report = {}
+    total = baseline = 0
+    for name, frame in frames.items():
+        if frame is None:
+            continue
+        used = frame_nbytes(frame)
+        full = sum(len(frame) * _baseline_itemsize(col, dtype) for col, dtype in frame.dtypes.items())
+        report[name] = {'bytes': used, 'baseline_bytes': full}
+        total += used
+        baseline += full
+    report['total'] = {
+        'bytes': total,
+        'baseline_bytes': baseline,
+        'saved_ratio': round(1 - total / baseline, 4) if baseline else 0.0,
+    }
+    return report
+
+
+# ------------------------------------------------------
+# 命令列：python compact.py AAPL --period 1y  (比較預設型別與精簡型別的記憶體用量)
+# ------------------------------------------------------
+if __name__ == "__main__":
+    import argparse
+
+    from indicators import DEFAULT_INDICATORS, calculate_selected_indicators
+    from market_data import load_bars
+    from patterns import detect_candlestick_patterns
+
+    parser = argparse.ArgumentParser(description="精簡型別的記憶體用量")
+    parser.add_argument('ticker')
+    parser.add_argument('--period', default='1y')
+    parser.add_argument('--interval', default='1d')
+    args = parser.parse_args()
+
+    data = load_bars(args.ticker, args.period, interval=args.interval)
+    frames = (data, detect_candlestick_patterns(data), calculate_selected_indicators(data, DEFAULT_INDICATORS))
+    for label, (d, p, t) in (('預設', frames), ('精簡', compact_frames(*frames))):
+        report = memory_report(data=d, patterns=p, indicators=t)
+        print(label, {name: entry['bytes'] for name, entry in report.items()}, report['total'])
@@ -0,0 +1,227 @@
+import argparse
+import operator
+
+import numpy as np
+import pandas as pd
+
+from candle_engine import detect_universe_patterns
+from indicators import calculate_selected_indicators
+from patterns import PATTERN_DIRECTIONS, pattern_signal
+from universe_store import UniverseBars
+
+# ------------------------------------------------------
+# 形態 + 指標共振分數：
+#   看漲強度 = Σ 形態權重 × max(方向強度, 0) / 100，看跌強度同理 (取負值)
+#   分數 = 看漲強度 × (1 + 成立的看漲條件權重和) - 看跌強度 × (1 + 成立的看跌條件權重和)
+# 方向強度由 patterns.pattern_signal 依 PATTERN_DIRECTIONS 決定 (不直接看 TA-Lib 代碼的正負號)，
+# 十字、紡錘等無方向的形態不計分。
+# 沒有形態的 K 線分數為 0；指標條件只用來加權同一根 K 線上的形態訊號。
+# 形態與條件以 (股票數 × K 線數) 陣列運算；指標仍是逐檔呼叫 TA-Lib (見 indicator_arrays)
+# ------------------------------------------------------
+
+# 條件名稱: (需要的指標, 左欄, 比較, 右欄或門檻, 支持的方向, 權重)
+CONFLUENCE_CONDITIONS = {
+    'RSI超賣': ('RSI', 'RSI_14', '<', 30, 'bullish', 1.0),
+    'RSI超買': ('RSI', 'RSI_14', '>', 70, 'bearish', 1.0),
+    '收盤跌破布林下軌': ('BBANDS', 'Close', '<', 'BBANDS_Lower', 'bullish', 1.0),
+    '收盤突破布林上軌': ('BBANDS', 'Close', '>', 'BBANDS_Upper', 'bearish', 1.0),
+    'MACD柱狀體為正': ('MACD', 'MACD_Hist', '>', 0, 'bullish', 0.5),
+    'MACD柱狀體為負': ('MACD', 'MACD_Hist', '<', 0, 'bearish', 0.5),
+}
+
+_OPERATORS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+
+def _as_2d(values):
+    array = np.asarray(values, dtype='float64')
+    return array[np.newaxis, :] if array.ndim == 1 else array
+
+
+def _columns(frame):
+    """DataFrame (單檔，每欄一個序列) 或 {欄名: 陣列} 統一成 {欄名: 2-D 陣列}"""
+    if frame is None:
+        return {}
+    if isinstance(frame, pd.DataFrame):
+        return {col: _as_2d(frame[col].to_numpy(dtype='float64', na_value=np.nan)) for col in frame.columns}
+    return {col: _as_2d(values) for col, values in frame.items()}
+
+
+def resolve_conditions(conditions=None, weights=None):
+    """
+    conditions 為條件名稱清單 (None 表示全部)，weights 為 {條件名稱: 權重} 覆寫預設權重；
+    回傳 {條件名稱: 條件定義}
+    """
+    names = list(CONFLUENCE_CONDITIONS) if conditions is None else list(conditions)
+    resolved = {}
+    for name in names:
+        if name not in CONFLUENCE_CONDITIONS:
+            raise ValueError(f"未知的共振條件：{name}")
+        definition = CONFLUENCE_CONDITIONS[name]
+        if weights and name in weights:
+            definition = definition[:5] + (float(weights[name]),)
+        resolved[name] = definition
+    return resolved
+
+
+def required_indicators(conditions):
+    return sorted({definition[0] for definition in conditions.values()})
+
+
+# ------------------------------------------------------
+# 1) 指標條件與分數 (純陣列運算)
+# ------------------------------------------------------
+def condition_masks(columns, conditions):
+    """每個條件成立與否的 bool 陣列；需要的欄位不存在 (沒算該指標) 的條件略過"""
+    masks = {}
+    with np.errstate(invalid='ignore'):
+        for name, (_, left, op, right, _, _) in conditions.items():
+            if left not in columns or (isinstance(right, str) and right not in columns):
+                continue
+            rhs = columns[right] if isinstance(right, str) else right
+            # 與 NaN 比較一律為 False：指標暖機期間的條件不成立
+            masks[name] = _OPERATORS[op](columns[left], rhs)
+    return masks
+
+
+def confluence_scores(patterns, indicators, close, conditions=None, weights=None, pattern_weights=None):
+    """
+    patterns：{CDL 名稱: 代碼陣列} 或形態 DataFrame；indicators：{欄名: 陣列} 或指標 DataFrame；
+    close：收盤價。陣列可為 (股票數 × K 線數) 或單檔的 1-D。
+    回傳 {'score', 'bullish', 'bearish'} 三個 (股票數 × K 線數) 陣列，以及各條件的成立遮罩
+    """
+    conditions = resolve_conditions(conditions, weights)
+    pattern_columns = _columns(patterns)
+    close = _as_2d(close)
+    bullish = np.zeros(close.shape)
+    bearish = np.zeros(close.shape)
+    for name, codes in pattern_columns.items():
+        weight = 1.0 if pattern_weights is None else float(pattern_weights.get(name, 1.0))
+        if weight and PATTERN_DIRECTIONS.get(name) is not None:
+            signal = pattern_signal(name, codes)
+            bullish += weight * np.maximum(signal, 0) / 100
+            bearish += weight * np.maximum(-signal, 0) / 100
+
+    columns = _columns(indicators)
+    columns['Close'] = close
+    masks = condition_masks(columns, conditions)
+    bullish_boost = np.ones(close.shape)
+    bearish_boost = np.ones(close.shape)
+    for name, mask in masks.items():
+        _, _, _, _, direction, weight = conditions[name]
+        if direction == 'bullish':
+            bullish_boost += weight * mask
+        else:
+            bearish_boost += weight * mask
+    score = bullish * bullish_boost - bearish * bearish_boost
+    return {'score': score, 'bullish': bullish, 'bearish': bearish}, masks
+
+
+def score_frame(data, pattern_df, tech_df, conditions=None, weights=None, pattern_weights=None):
+    """單一股票的每根 K 線共振分數 (Series)，tech_df 沒有的指標條件不計"""
+    scores, _ = confluence_scores(pattern_df, tech_df, data['Close'], conditions, weights, pattern_weights)
+    return pd.Series(scores['score'][0], index=data.index, name='Confluence_Score')
+
+
+# ------------------------------------------------------
+# 2) 整個市場一次計算
+# ------------------------------------------------------
+def indicator_arrays(fields, dates, indicators):
+    """
+    以 calculate_selected_indicators 逐檔計算，疊成 {指標欄: (股票數 × K 線數)}。
+    每檔只取有效的 K 線計算再放回原位置 (上市前、停牌為 NaN)，不讓缺值污染遞迴型指標；
+    壓縮方式與 UniverseStore.bars / detect_universe_patterns 相同，兩邊的 K 線一一對齊。
+    限制：TA-Lib 只接受 1-D 輸入，這裡仍是逐檔的 Python 迴圈，不是整批向量化
+    """
+    close = fields['Close']
+    arrays = {}
+    for row in range(close.shape[0]):
+        valid = ~np.isnan(close[row])
+        if not valid.any():
+            continue
+        bars = UniverseBars({field: values[row][valid] for field, values in fields.items()}, dates[valid])
+        frame = calculate_selected_indicators(bars, indicators)
+        for col in frame.columns:
+            if col not in arrays:
+                arrays[col] = np.full(close.shape, np.nan)
+            arrays[col][row, valid] = frame[col].to_numpy()
+    return arrays
+
+
+def score_universe(universe, patterns=None, tickers=None, conditions=None, weights=None, pattern_weights=None,
+                   lookback_bars=1, engine='auto'):
+    """
+    對 universe_store.UniverseStore 整個市場 (或指定股票) 計算共振分數，
+    以每檔最近 lookback_bars 根 K 線中 |分數| 最大的一根排序，回傳排行表
+    """
+    names = list(universe.tickers)
+    rows = slice(None)
+    if tickers is not None:
+        positions = {t: i for i, t in enumerate(universe.tickers)}
+        names = [t for t in tickers if t in positions]
+        rows = [positions[t] for t in names]
+    fields = {f: np.asarray(universe.field(f)[rows], dtype='float64') for f in universe.fields}
+    resolved = resolve_conditions(conditions, weights)
+
+    # 形態與指標都在去掉缺值的 K 線上計算，再放回原日期位置
+    pattern_arrays = detect_universe_patterns(universe, patterns, tickers=None if tickers is None else names,
+                                              engine=engine)
+    indicators = indicator_arrays(fields, universe.dates, required_indicators(resolved))
+    scores, masks = confluence_scores(pattern_arrays, indicators, fields['Close'], list(resolved),
+                                      weights, pattern_weights)
+    return rank_scores(names, universe.dates, fields['Close'], scores, masks, lookback_bars)
+
+
+def rank_scores(tickers, dates, close, scores, masks, lookback_bars=1):
+    """每檔取最近 lookback_bars 根 (以各自最後一根有效 K 線為準) 中 |分數| 最大的一根，依 |分數| 排序"""
+    close = _as_2d(close)
+    score = scores['score']
+    valid = ~np.isnan(close)
+    has_data = valid.any(axis=1)
+    last = close.shape[1] - 1 - valid[:, ::-1].argmax(axis=1)
+
+    offsets = np.arange(max(int(lookback_bars), 1))
+    window = np.maximum(last[:, np.newaxis] - offsets[np.newaxis, :], 0)
+    rows = np.arange(len(tickers))[:, np.newaxis]
+    best = window[rows[:, 0], np.abs(score[rows, window]).argmax(axis=1)]
+    rows = rows[:, 0]
+
+    met = {name: mask[rows, best] for name, mask in masks.items()}
+    table = pd.DataFrame({
+        '代碼': tickers,
+        '日期': dates[best],
+        '收盤價': close[rows, best],
+        '共振分數': score[rows, best].round(2),
+        '看漲強度': scores['bullish'][rows, best].round(2),
+        '看跌強度': scores['bearish'][rows, best].round(2),
+        '成立條件': ['、'.join(name for name in met if met[name][i]) for i in range(len(tickers))],
+    })[has_data]
+    table['_abs'] = table['共振分數'].abs()
+    table = table.sort_values(['_abs', '代碼'], ascending=[False, True])
+    return table.drop(columns='_abs').reset_index(drop=True)
+
+
+# ------------------------------------------------------
+# 命令列：python confluence.py cache/universe/tw --top 20 --lookback 3
+# ------------------------------------------------------
+if __name__ == "__main__":
+    import time
+
+    from universe_store import UniverseStore
+
+    parser = argparse.ArgumentParser(description="形態 + 指標共振分數排行")
+    parser.add_argument('universe', help="universe_store 目錄")
+    parser.add_argument('--patterns', nargs='*', help="形態群組或 CDL 名稱 (預設全部)")
+    parser.add_argument('--conditions', nargs='*', help=f"共振條件 (預設全部：{'、'.join(CONFLUENCE_CONDITIONS)})")
+    parser.add_argument('--lookback', type=int, default=1, help="取最近幾根 K 線中最強的訊號")
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--out', help="輸出 CSV")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    table = score_universe(UniverseStore(args.universe), patterns=args.patterns, conditions=args.conditions,
+                           lookback_bars=args.lookback)
+    with pd.option_context('display.max_rows', 200, 'display.width', 200):
+        print(table.head(args.top))
+    print(f"{len(table)} 檔，{time.perf_counter() - started:.3f}s")
+    if args.out:
+        table.to_csv(args.out, index=False)
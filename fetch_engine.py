@@ -0,0 +1,303 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import aiohttp
+import pandas as pd
+
+from market_data import MarketDataProvider, _validate_bars, normalize_ticker
+
+# ------------------------------------------------------
+# 設定
+# ------------------------------------------------------
+YAHOO_BASE_URL = os.environ.get("KLINE_YAHOO_BASE_URL", "https://query1.finance.yahoo.com")
+FETCH_MAX_CONCURRENCY = int(os.environ.get("KLINE_FETCH_MAX_CONCURRENCY", "8"))
+# 每個上游主機每秒允許的請求數與瞬間可用的額度
+FETCH_RATE_PER_HOST = float(os.environ.get("KLINE_FETCH_RATE_PER_HOST", "4"))
+FETCH_BURST = int(os.environ.get("KLINE_FETCH_BURST", "8"))
+FETCH_MAX_RETRIES = int(os.environ.get("KLINE_FETCH_MAX_RETRIES", "4"))
+FETCH_TIMEOUT = float(os.environ.get("KLINE_FETCH_TIMEOUT", "15"))
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+DAILY_INTERVALS = {'1d', '5d', '1wk', '1mo', '3mo'}
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+
+
+class FetchError(Exception):
+    """上游回應錯誤 (重試後仍失敗)"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+# ------------------------------------------------------
+# 1) Token bucket 限流
+# ------------------------------------------------------
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# ------------------------------------------------------
+# 2) 非同步抓取引擎：限制同時連線數、每主機限流、429/5xx 退避重試、共用 keep-alive session
+# ------------------------------------------------------
+class AsyncFetchEngine:
+    """
+    所有請求都在引擎自己的 event loop 執行緒上跑，session 只建立一次並重複使用。
+    同步程式 (例如 Gradio handler) 透過 run() 提交協程並等待結果
+    """
+
+    def __init__(self, max_concurrency=FETCH_MAX_CONCURRENCY, rate_per_host=FETCH_RATE_PER_HOST,
+                 burst=FETCH_BURST, max_retries=FETCH_MAX_RETRIES, timeout=FETCH_TIMEOUT,
+                 base_url=YAHOO_BASE_URL):
+        self.max_concurrency = max_concurrency
+        self.rate_per_host = rate_per_host
+        self.burst = burst
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.base_url = base_url.rstrip('/')
+        self._loop = None
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._session = None
+        self._semaphore = None
+        self._buckets = {}
+        self._stats = {
+            'requests': 0,
+            'retries': 0,
+            'errors': 0,
+            'queue_depth': 0,
+            'max_queue_depth': 0,
+            'inflight': 0,
+            'total_wait': 0.0,
+            'max_wait': 0.0,
+        }
+
+    # --- event loop 執行緒 ---
+    def _ensure_loop(self):
+        with self._thread_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever,
+                                                name='kline-fetch-engine', daemon=True)
+                self._thread.start()
+        return self._loop
+
+    def run(self, coro):
+        """從同步程式提交協程到引擎 loop，並等待結果"""
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    def close(self):
+        if self._loop is None:
+            return
+        if self._session is not None:
+            self.run(self._session.close())
+            self._session = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop = None
+        self._thread = None
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={'User-Agent': USER_AGENT},
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    def _bucket(self, url):
+        host = urlparse(url).netloc
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self.rate_per_host, self.burst)
+        return self._buckets[host]
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        # full jitter：0 ~ min(30, 0.5 * 2^attempt) 秒
+        return random.uniform(0, min(30.0, 0.5 * (2 ** attempt)))
+
+    # --- 請求 ---
+    async def fetch_json(self, url, params=None):
+        session = await self._get_session()
+        stats = self._stats
+        for attempt in range(self.max_retries + 1):
+            queued_at = time.monotonic()
+            stats['queue_depth'] += 1
+            stats['max_queue_depth'] = max(stats['max_queue_depth'], stats['queue_depth'])
+            try:
+                await self._bucket(url).acquire()
+                await self._semaphore.acquire()
+            finally:
+                stats['queue_depth'] -= 1
+            wait = time.monotonic() - queued_at
+            stats['total_wait'] += wait
+            stats['max_wait'] = max(stats['max_wait'], wait)
+            stats['requests'] += 1
+            stats['inflight'] += 1
+            retry_after = None
+            try:
+                async with session.get(url, params=params) as resp:
+                    if resp.status == 200:
+                        return await resp.json(content_type=None)
+                    if resp.status not in RETRY_STATUS:
+                        stats['errors'] += 1
+                        raise FetchError(f"HTTP {resp.status}：{url}", status=resp.status)
+                    retry_after = resp.headers.get('Retry-After')
+                    error = FetchError(f"HTTP {resp.status}：{url}", status=resp.status)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = FetchError(f"連線失敗：{url} ({e})")
+            finally:
+                stats['inflight'] -= 1
+                self._semaphore.release()
+
+            if attempt == self.max_retries:
+                stats['errors'] += 1
+                raise error
+            stats['retries'] += 1
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+
+    async def fetch_chart(self, ticker, period=None, interval='1d', start=None, end=None):
+        """抓取 Yahoo chart API 並整理成與 yf.download (auto_adjust) 相同格式的 OHLCV"""
+        ticker = normalize_ticker(ticker)
+        params = {'interval': interval, 'includeAdjustedClose': 'true', 'events': 'div,splits'}
+        if start is not None or end is not None:
+            params['period1'] = int(pd.Timestamp(start).timestamp()) if start is not None else 0
+            params['period2'] = int(pd.Timestamp(end).timestamp()) if end is not None else int(time.time())
+        else:
+            params['range'] = period or '1mo'
+        try:
+            payload = await self.fetch_json(f"{self.base_url}/v8/finance/chart/{ticker}", params)
+        except FetchError as e:
+            if e.status == 404:
+                raise ValueError(f"{ticker} 在所選時間內無資料。")
+            raise
+        return parse_chart(payload, ticker, interval)
+
+    async def fetch_many(self, tickers, period=None, interval='1d', start=None, end=None):
+        """同時抓取多檔股票，回傳 (frames, errors)"""
+        tickers = list(dict.fromkeys(normalize_ticker(t) for t in tickers))
+        results = await asyncio.gather(
+            *[self.fetch_chart(t, period=period, interval=interval, start=start, end=end) for t in tickers],
+            return_exceptions=True
+        )
+        frames, errors = {}, {}
+        for ticker, result in zip(tickers, results):
+            if isinstance(result, Exception):
+                errors[ticker] = str(result)
+            else:
+                frames[ticker] = result
+        return frames, errors
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['avg_wait'] = stats['total_wait'] / stats['requests'] if stats['requests'] else 0.0
+        return stats
+
+
+def parse_chart(payload, ticker, interval='1d'):
+    chart = (payload or {}).get('chart') or {}
+    if chart.get('error'):
+        raise ValueError(f"{ticker} 在所選時間內無資料。")
+    result = (chart.get('result') or [None])[0]
+    if not result or not result.get('timestamp'):
+        raise ValueError(f"{ticker} 在所選時間內無資料。")
+
+    quote = result['indicators']['quote'][0]
+    data = pd.DataFrame({
+        'Open': quote.get('open'),
+        'High': quote.get('high'),
+        'Low': quote.get('low'),
+        'Close': quote.get('close'),
+        'Volume': quote.get('volume'),
+    }, dtype='float64')
+    adjclose = (result['indicators'].get('adjclose') or [{}])[0].get('adjclose')
+    if adjclose is not None:
+        ratio = pd.Series(adjclose, dtype='float64') / data['Close']
+        for col in ['Open', 'High', 'Low']:
+            data[col] = data[col] * ratio
+        data['Close'] = pd.Series(adjclose, dtype='float64')
+
+    tz = result.get('meta', {}).get('exchangeTimezoneName') or 'UTC'
+    index = pd.to_datetime(result['timestamp'], unit='s', utc=True).tz_convert(tz)
+    if interval in DAILY_INTERVALS:
+        index = index.tz_localize(None).normalize()
+        index.name = 'Date'
+    else:
+        index.name = 'Datetime'
+    data.index = index
+    data = data[~data.index.duplicated(keep='last')]
+    data = _validate_bars(data, ticker)
+    if data['Volume'].notna().all():
+        data['Volume'] = data['Volume'].astype('int64')
+    return data
+
+
+# ------------------------------------------------------
+# 3) 以非同步引擎實作的資料來源 (KLINE_DATA_PROVIDER=async)
+# ------------------------------------------------------
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AsyncFetchEngine()
+        return _engine
+
+
+class AsyncYahooProvider(MarketDataProvider):
+    name = 'async'
+
+    def __init__(self, engine=None):
+        self.engine = engine or get_engine()
+
+    def download(self, ticker, period=None, interval='1d', start=None, end=None):
+        return self.engine.run(self.engine.fetch_chart(ticker, period=period, interval=interval,
+                                                       start=start, end=end))
+
+    def download_batch(self, tickers, period=None, interval='1d', start=None, end=None):
+        return self.engine.run(self.engine.fetch_many(tickers, period=period, interval=interval,
+                                                      start=start, end=end))
+
+    def download_chunks(self, ticker, interval, chunks):
+        async def fetch_all():
+            results = await asyncio.gather(
+                *[self.engine.fetch_chart(ticker, interval=interval, start=s, end=e) for s, e in chunks],
+                return_exceptions=True
+            )
+            for result in results:
+                if isinstance(result, Exception) and not isinstance(result, ValueError):
+                    raise result
+            return [r for r in results if not isinstance(r, Exception)]
+
+        return self.engine.run(fetch_all())
@@ -0,0 +1,291 @@
+import re
+
+import talib
+import talib.abstract
+import numpy as np
+import pandas as pd
+
+# ------------------------------------------------------
+# 1) 技術指標計算 (完整清單)
+# ------------------------------------------------------
+TECHNICAL_INDICATORS = [
+    # Overlap Studies
+    "MA", "SMA", "EMA", "WMA", "DEMA", "TEMA", "TRIMA", "KAMA", "BBANDS", "SAR", "MIDPOINT", "MIDPRICE",
+    # Momentum Indicators
+    "RSI", "STOCH", "STOCHF", "STOCHRSI", "MACD", "TRIX", "WILLR", "ADX", "ADXR", "APO", "AROON", "AROONOSC",
+    "CCI", "CMO", "MFI", "MOM", "PPO", "ROC", "ULTOSC",
+    # Volume Indicators
+    "AD", "ADOSC", "OBV",
+    # Volatility Indicators
+    "TRANGE", "ATR", "NATR",
+    # Price Transform
+    "AVGPRICE", "MEDPRICE", "TYPPRICE", "WCLPRICE"
+]
+
+# 介面預設勾選 (背景預熱也會預先計算這一組)
+DEFAULT_INDICATORS = ["MACD", "RSI", "BBANDS"]
+
+# ------------------------------------------------------
+# 2) 指標登錄表：指標名稱 -> TA-Lib 函式、參數與輸出欄名
+#   參數沒有寫的沿用本機 TA-Lib 的預設值 (talib.abstract)；fixed 為不開放調整的參數 (例如 SMA 的 matype)。
+#   欄名可含 {參數}；非預設參數且欄名不含該參數時，自動在欄名後加上 _參數值
+#   多輸出的函式以 (TA-Lib 輸出名稱, 欄名) 對應
+# ------------------------------------------------------
+def _spec(function, columns, fixed=None, **params):
+    return {'function': function, 'columns': columns, 'fixed': fixed or {}, 'params': params}
+
+
+INDICATOR_REGISTRY = {
+    # Overlap Studies
+    "MA": _spec('MA', ['MA'], timeperiod=30),
+    "SMA": _spec('MA', ['SMA_{timeperiod}'], fixed={'matype': 0}, timeperiod=30),
+    "EMA": _spec('MA', ['EMA_{timeperiod}'], fixed={'matype': 1}, timeperiod=30),
+    "WMA": _spec('MA', ['WMA_{timeperiod}'], fixed={'matype': 2}, timeperiod=30),
+    "DEMA": _spec('MA', ['DEMA_{timeperiod}'], fixed={'matype': 3}, timeperiod=30),
+    "TEMA": _spec('MA', ['TEMA_{timeperiod}'], fixed={'matype': 4}, timeperiod=30),
+    "TRIMA": _spec('MA', ['TRIMA_{timeperiod}'], fixed={'matype': 5}, timeperiod=30),
+    "KAMA": _spec('MA', ['KAMA_{timeperiod}'], fixed={'matype': 6}, timeperiod=30),
+    "BBANDS": _spec('BBANDS', [('upperband', 'BBANDS_Upper'), ('middleband', 'BBANDS_Middle'),
+                               ('lowerband', 'BBANDS_Lower')], timeperiod=20),
+    "SAR": _spec('SAR', ['SAR'], acceleration=0.02, maximum=0.2),
+    "MIDPOINT": _spec('MIDPOINT', ['MIDPOINT'], timeperiod=14),
+    "MIDPRICE": _spec('MIDPRICE', ['MIDPRICE'], timeperiod=14),
+    # Momentum Indicators
+    "RSI": _spec('RSI', ['RSI_{timeperiod}'], timeperiod=14),
+    "STOCH": _spec('STOCH', [('slowk', 'STOCH_%K'), ('slowd', 'STOCH_%D')]),
+    "STOCHF": _spec('STOCHF', [('fastk', 'STOCHF_%K'), ('fastd', 'STOCHF_%D')]),
+    "STOCHRSI": _spec('STOCHRSI', [('fastk', 'STOCHRSI_%K'), ('fastd', 'STOCHRSI_%D')], timeperiod=14),
+    "MACD": _spec('MACD', [('macd', 'MACD'), ('macdsignal', 'MACD_Signal'), ('macdhist', 'MACD_Hist')],
+                  fastperiod=12, slowperiod=26, signalperiod=9),
+    "TRIX": _spec('TRIX', ['TRIX'], timeperiod=30),
+    "WILLR": _spec('WILLR', ['WILLR'], timeperiod=14),
+    "ADX": _spec('ADX', ['ADX'], timeperiod=14),
+    "ADXR": _spec('ADXR', ['ADXR'], timeperiod=14),
+    "APO": _spec('APO', ['APO'], fastperiod=12, slowperiod=26),
+    "AROON": _spec('AROON', [('aroonup', 'AROON_Up'), ('aroondown', 'AROON_Down')], timeperiod=14),
+    "AROONOSC": _spec('AROONOSC', ['AROONOSC'], timeperiod=14),
+    "CCI": _spec('CCI', ['CCI'], timeperiod=14),
+    "CMO": _spec('CMO', ['CMO'], timeperiod=14),
+    "MFI": _spec('MFI', ['MFI'], timeperiod=14),
+    "MOM": _spec('MOM', ['MOM'], timeperiod=10),
+    "PPO": _spec('PPO', ['PPO'], fastperiod=12, slowperiod=26),
+    "ROC": _spec('ROC', ['ROC'], timeperiod=10),
+    "ULTOSC": _spec('ULTOSC', ['ULTOSC']),
+    # Volume Indicators
+    "AD": _spec('AD', ['AD']),
+    "ADOSC": _spec('ADOSC', ['ADOSC']),
+    "OBV": _spec('OBV', ['OBV']),
+    # Volatility Indicators
+    "TRANGE": _spec('TRANGE', ['TRANGE']),
+    "ATR": _spec('ATR', ['ATR'], timeperiod=14),
+    "NATR": _spec('NATR', ['NATR'], timeperiod=14),
+    # Price Transform
+    "AVGPRICE": _spec('AVGPRICE', ['AVGPRICE']),
+    "MEDPRICE": _spec('MEDPRICE', ['MEDPRICE']),
+    "TYPPRICE": _spec('TYPPRICE', ['TYPPRICE']),
+    "WCLPRICE": _spec('WCLPRICE', ['WCLPRICE']),
+}
+
+# TA-Lib 函式的輸入、參數預設值與輸出名稱 (第一次用到時讀取)
+_TALIB_INFO = {}
+
+
+def _talib_info(function):
+    if function not in _TALIB_INFO:
+        info = talib.abstract.Function(function).info
+        inputs = []
+        for names in info['input_names'].values():
+            inputs += [names] if isinstance(names, str) else list(names)
+        _TALIB_INFO[function] = (inputs, dict(info['parameters']), list(info['output_names']))
+    return _TALIB_INFO[function]
+
+
+def indicator_parameters(name):
+    """可調整的參數 (依 TA-Lib 的順序) 與預設值"""
+    spec = INDICATOR_REGISTRY[name]
+    _, defaults, _ = _talib_info(spec['function'])
+    params = {k: v for k, v in defaults.items() if k not in spec['fixed']}
+    params.update(spec['params'])
+    return params
+
+
+def _parse_value(text):
+    value = float(text)
+    return int(value) if value.is_integer() and '.' not in text else value
+
+
+def parse_indicator(entry):
+    """
+    'SMA' / 'SMA(5)' / 'MACD(8,21,5)' / 'SMA(5/20/60/120)' (以 / 分隔多組參數) /
+    ('SMA', {'timeperiod': 5}) -> [(指標名稱, 參數), ...]
+    """
+    if isinstance(entry, (tuple, list)):
+        name, params = entry
+        rest = ''
+    else:
+        text = str(entry).strip()
+        name, _, rest = text.partition('(')
+        params = {}
+    name = str(name).strip().upper()
+    if name not in INDICATOR_REGISTRY:
+        raise ValueError(f"未知的技術指標：{name}")
+    allowed = indicator_parameters(name)
+
+    groups = [dict(params)]
+    if rest:
+        if not rest.endswith(')'):
+            raise ValueError(f"指標參數格式錯誤：{text}")
+        values = [v.strip() for v in rest[:-1].split(',') if v.strip()]
+        if len(values) > len(allowed):
+            raise ValueError(f"{name} 最多只有 {len(allowed)} 個參數：{text}")
+        for key, value in zip(allowed, values):
+            groups = [dict(g, **{key: _parse_value(v)}) for g in groups for v in value.split('/')]
+    unknown = [k for group in groups for k in group if k not in allowed]
+    if unknown:
+        raise ValueError(f"{name} 沒有參數：{', '.join(unknown)}")
+    return [(name, group) for group in groups]
+
+
+def split_indicator_text(text):
+    """'SMA(5/20/60), RSI(6)' -> ['SMA(5/20/60)', 'RSI(6)'] (括號內的逗號不切開)"""
+    return re.findall(r'[A-Za-z]+(?:\([^)]*\))?', text or '')
+
+
+def indicator_columns(name, params):
+    """指標在這組參數下的輸出欄名 (依登錄表的欄位順序)"""
+    spec = INDICATOR_REGISTRY[name]
+    defaults = indicator_parameters(name)
+    changed = [k for k in defaults if params[k] != defaults[k]]
+    names = []
+    for column in spec['columns']:
+        template = column if isinstance(column, str) else column[1]
+        label = template.format(**params)
+        extra = [str(params[k]) for k in changed if '{' + k + '}' not in template]
+        names.append('_'.join([label] + extra))
+    return names
+
+
+# ------------------------------------------------------
+# 3) 計算圖：每個 (TA-Lib 函式, 參數) 節點在同一次計算中只算一次。
+#   下列函式可由其他節點組出。預設參數下結果與直接呼叫 TA-Lib 逐位元一致；
+#   其他參數在浮點誤差內一致 (例如 BBANDS 的 nbdev 不是 1 或 2 時約差 1e-14)：
+#     SMA/EMA…       = MA(matype)，與 BBANDS 中線、APO/PPO 的快慢均線共用
+#     BBANDS         = MA ± nbdev × STDDEV                (matype 為 SMA / EMA 時)
+#     APO / PPO      = 快慢 MA 相減 (PPO 再除以慢線)      (matype 為 SMA / EMA 時)
+#     STOCH          = STOCHF 的 %D (= 慢速 %K) 再平均
+#     STOCHRSI       = 對 RSI 做 STOCHF
+#     ADXR           = ADX 與 timeperiod - 1 根前的 ADX 平均
+#     NATR           = ATR / Close × 100
+# ------------------------------------------------------
+class IndicatorGraph:
+    def __init__(self, data):
+        self.data = data
+        self._values = {}
+        # 依計算順序記錄實際算過的節點
+        self.computed = []
+
+    def price(self, field):
+        """價格欄位 (TA-Lib 只接受 float64)；沒有該欄位 (例如 Volume) 時回傳 None"""
+        key = ('price', field)
+        if key not in self._values:
+            column = field.capitalize()
+            self._values[key] = np.asarray(self.data[column], dtype='float64') if column in self.data.columns else None
+        return self._values[key]
+
+    def get(self, function, **params):
+        """節點的輸出 (單一陣列或 TA-Lib 輸出順序的 tuple)；缺少輸入欄位時為 None"""
+        key = (function, tuple(sorted(params.items())))
+        if key not in self._values:
+            compute = _COMPOSITE_NODES.get(function, _talib_node)
+            self._values[key] = compute(self, function, params)
+            self.computed.append(key)
+        return self._values[key]
+
+
+def _talib_node(graph, function, params):
+    inputs, _, _ = _talib_info(function)
+    arrays = [graph.price(field) for field in inputs]
+    if any(a is None for a in arrays):
+        return None
+    return getattr(talib, function)(*arrays, **params)
+
+
+def _bbands_node(graph, function, params):
+    if params['matype'] not in (0, 1):
+        return _talib_node(graph, function, params)
+    middle = graph.get('MA', timeperiod=params['timeperiod'], matype=params['matype'])
+    std = graph.get('STDDEV', timeperiod=params['timeperiod'], nbdev=1.0)
+    return middle + std * params['nbdevup'], middle, middle - std * params['nbdevdn']
+
+
+def _oscillator_node(graph, function, params):
+    if params['matype'] not in (0, 1):
+        return _talib_node(graph, function, params)
+    fast = graph.get('MA', timeperiod=params['fastperiod'], matype=params['matype'])
+    slow = graph.get('MA', timeperiod=params['slowperiod'], matype=params['matype'])
+    if function == 'APO':
+        return fast - slow
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(slow != 0, (fast - slow) / slow * 100, 0.0)
+
+
+def _stoch_node(graph, function, params):
+    _, fastd = graph.get('STOCHF', fastk_period=params['fastk_period'], fastd_period=params['slowk_period'],
+                         fastd_matype=params['slowk_matype'])
+    slowd = talib.MA(fastd, timeperiod=params['slowd_period'], matype=params['slowd_matype'])
+    return np.where(np.isnan(slowd), np.nan, fastd), slowd
+
+
+def _stochrsi_node(graph, function, params):
+    rsi = graph.get('RSI', timeperiod=params['timeperiod'])
+    return talib.STOCHF(rsi, rsi, rsi, fastk_period=params['fastk_period'], fastd_period=params['fastd_period'],
+                        fastd_matype=params['fastd_matype'])
+
+
+def _adxr_node(graph, function, params):
+    adx = graph.get('ADX', timeperiod=params['timeperiod'])
+    shift = params['timeperiod'] - 1
+    adxr = np.full(len(adx), np.nan)
+    if len(adx) > shift:
+        adxr[shift:] = (adx[shift:] + adx[:len(adx) - shift]) / 2
+    return adxr
+
+
+def _natr_node(graph, function, params):
+    atr = graph.get('ATR', timeperiod=params['timeperiod'])
+    return atr / graph.price('close') * 100
+
+
+_COMPOSITE_NODES = {
+    'BBANDS': _bbands_node,
+    'APO': _oscillator_node,
+    'PPO': _oscillator_node,
+    'STOCH': _stoch_node,
+    'STOCHRSI': _stochrsi_node,
+    'ADXR': _adxr_node,
+    'NATR': _natr_node,
+}
+
+
+def calculate_selected_indicators(data, selected_indicators):
+    """
+    根據使用者勾選，動態計算各種技術指標並回傳 DataFrame。
+    selected_indicators 可為指標名稱或含參數的寫法 (見 parse_indicator)，例如 ['SMA(5/20/60/120)', 'RSI']；
+    共用的中間量 (均線、RSI、ADX、ATR…) 在同一次計算中只算一次
+    """
+    # data 可以是 DataFrame 或 universe_store.UniverseBars
+    graph = IndicatorGraph(data)
+    indicators = {}
+    for entry in selected_indicators or []:
+        for name, overrides in parse_indicator(entry):
+            spec = INDICATOR_REGISTRY[name]
+            params = dict(indicator_parameters(name), **overrides)
+            outputs = graph.get(spec['function'], **params, **spec['fixed'])
+            if outputs is None:
+                continue
+            _, _, output_names = _talib_info(spec['function'])
+            for column, label in zip(spec['columns'], indicator_columns(name, params)):
+                indicators[label] = outputs if isinstance(column, str) else outputs[output_names.index(column[0])]
+
+    # 各欄直接引用計算結果 (不合併成 2-D block 再複製一份)
+    return pd.DataFrame(indicators, index=data.index, copy=False)
@@ -0,0 +1,875 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+import pandas as pd
+import yfinance as yf
+
+from time_utils import localize_like
+
+# ------------------------------------------------------
+# 設定
+# ------------------------------------------------------
+CACHE_DIR = os.environ.get("KLINE_CACHE_DIR", "cache")
+# 同一檔股票在此秒數內重複查詢時，直接使用本地 K 線，不再向 Yahoo 補抓
+CACHE_REFRESH_SECONDS = int(os.environ.get("KLINE_CACHE_REFRESH_SECONDS", "300"))
+BAR_STORE_ENABLED = os.environ.get("KLINE_BAR_STORE", "1") != "0"
+# 行程內記憶體快取：最多保留幾組 (ticker, period, interval)、每組保留幾秒
+MEMORY_CACHE_SIZE = int(os.environ.get("KLINE_MEMORY_CACHE_SIZE", "256"))
+MEMORY_CACHE_TTL = float(os.environ.get("KLINE_MEMORY_CACHE_TTL", "60"))
+
+REQUIRED_COLUMNS = ['Open', 'High', 'Low', 'Close']
+BAR_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+EPOCH_START = pd.Timestamp('1970-01-01')
+
+# Yahoo 分鐘線限制：可回溯的天數與單次請求最多涵蓋的天數
+INTRADAY_LIMITS = {
+    '1m': {'lookback_days': 30, 'chunk_days': 7},
+    '2m': {'lookback_days': 60, 'chunk_days': 30},
+    '5m': {'lookback_days': 60, 'chunk_days': 30},
+    '15m': {'lookback_days': 60, 'chunk_days': 30},
+    '30m': {'lookback_days': 60, 'chunk_days': 30},
+    '90m': {'lookback_days': 60, 'chunk_days': 30},
+    '60m': {'lookback_days': 730, 'chunk_days': 180},
+    '1h': {'lookback_days': 730, 'chunk_days': 180},
+}
+INTRADAY_FETCH_WORKERS = int(os.environ.get("KLINE_INTRADAY_FETCH_WORKERS", "4"))
+
+# 補抓尾段時往前重疊的 K 線：用來比對已存資料，偵測除權息 / 分割造成的還原價變動
+ADJUST_OVERLAP_DAYS = 7
+ADJUST_OVERLAP_BARS = 3
+ADJUST_TOLERANCE = float(os.environ.get("KLINE_ADJUST_TOLERANCE", "1e-4"))
+
+
+# ------------------------------------------------------
+# 1) 共用工具
+# ------------------------------------------------------
+def normalize_ticker(ticker):
+    return str(ticker).strip().upper()
+
+
+def period_to_start(period, now=None):
+    """
+    將 yfinance 的 period 字串 (5d / 1mo / 1y / ytd / max ...) 轉成起始時間，
+    period='max' 時回傳 None
+    """
+    now = pd.Timestamp.now().normalize() if now is None else pd.Timestamp(now)
+    period = str(period).strip().lower()
+    if period == 'max':
+        return None
+    if period == 'ytd':
+        return pd.Timestamp(year=now.year, month=1, day=1)
+    units = [
+        ('mo', lambda n: pd.DateOffset(months=n)),
+        ('wk', lambda n: pd.DateOffset(weeks=n)),
+        ('y', lambda n: pd.DateOffset(years=n)),
+        ('d', lambda n: pd.DateOffset(days=n)),
+    ]
+    for suffix, offset in units:
+        if period.endswith(suffix) and period[:-len(suffix)].isdigit():
+            return now - offset(int(period[:-len(suffix)]))
+    raise ValueError(f"不支援的時間區間：{period}")
+
+
+def is_intraday(interval):
+    return interval in INTRADAY_LIMITS
+
+
+def interval_to_timedelta(interval):
+    """'5m' / '1h' / '1d' / '1wk' 轉成 Timedelta"""
+    interval = str(interval).strip().lower()
+    if interval.endswith('wk'):
+        return pd.Timedelta(weeks=int(interval[:-2]))
+    if interval.endswith('mo'):
+        return pd.Timedelta(days=30 * int(interval[:-2]))
+    units = {'m': 'minutes', 'h': 'hours', 'd': 'days'}
+    return pd.Timedelta(**{units[interval[-1]]: int(interval[:-1])})
+
+
+def plan_intraday_chunks(interval, start, end=None, now=None):
+    """
+    依 Yahoo 分鐘線限制規劃抓取：起點早於可回溯範圍時往後截，
+    再把區間切成每段不超過 chunk_days 的小段。回傳 [(start, end), ...]
+    """
+    limits = INTRADAY_LIMITS[interval]
+    now = pd.Timestamp.now(tz='UTC') if now is None else pd.Timestamp(now)
+    now = now.tz_localize('UTC') if now.tz is None else now
+    start = pd.Timestamp(start) if start is not None else now - pd.Timedelta(days=limits['lookback_days'])
+    end = pd.Timestamp(end) if end is not None else now
+    start = start.tz_localize('UTC') if start.tz is None else start
+    end = end.tz_localize('UTC') if end.tz is None else end
+    # 留一天緩衝，避免剛好落在上限邊界被 Yahoo 拒絕
+    earliest = now - pd.Timedelta(days=limits['lookback_days'] - 1)
+    start = max(start, earliest)
+    chunks = []
+    step = pd.Timedelta(days=limits['chunk_days'])
+    while start < end:
+        chunks.append((start, min(start + step, end)))
+        start += step
+    return chunks
+
+
+def stitch_bars(frames):
+    """合併分段抓回的 K 線：依時間排序，重複的時間只保留最後抓到的那一根"""
+    frames = [f for f in frames if f is not None and not f.empty]
+    if not frames:
+        return None
+    data = pd.concat(frames).sort_index()
+    return data[~data.index.duplicated(keep='last')]
+
+
+def normalize_download(data, ticker):
+    """
+    整理 yf.download 的結果：攤平 MultiIndex 欄位、檢查必要欄位並移除缺值列
+    """
+    if data is None or data.empty:
+        raise ValueError(f"{ticker} 在所選時間內無資料。")
+    if isinstance(data.columns, pd.MultiIndex):
+        level0 = data.columns.get_level_values(0)
+        level1 = data.columns.get_level_values(1)
+        if 'Close' in level0 or 'Open' in level0:
+            data.columns = level0
+        elif 'Close' in level1 or 'Open' in level1:
+            data.columns = level1
+        else:
+            data.columns = level0
+    return _validate_bars(data, ticker)
+
+
+def _validate_bars(data, ticker):
+    missing = [col for col in REQUIRED_COLUMNS if col not in data.columns]
+    if missing:
+        raise ValueError(f"資料缺少必要欄位：{missing}")
+    data = data.dropna(subset=REQUIRED_COLUMNS)
+    if data.empty:
+        raise ValueError(f"{ticker} 在所選時間內無資料。")
+    return data
+
+
+def split_download(data, tickers):
+    """
+    將多檔股票一次下載的 (欄位, ticker) MultiIndex 結果拆成每檔一個 DataFrame，
+    套用與單檔相同的欄位檢查與 dropna 規則。
+    回傳 (frames, errors)：frames 為 ticker -> DataFrame，errors 為 ticker -> 錯誤訊息
+    """
+    frames, errors = {}, {}
+    if data is None or data.empty:
+        return frames, {ticker: f"{ticker} 在所選時間內無資料。" for ticker in tickers}
+    if not isinstance(data.columns, pd.MultiIndex):
+        # 只有一檔時 yfinance 可能直接回傳單層欄位
+        if len(tickers) == 1:
+            try:
+                frames[tickers[0]] = _validate_bars(data, tickers[0])
+            except ValueError as e:
+                errors[tickers[0]] = str(e)
+            return frames, errors
+        raise ValueError("批次下載結果缺少 ticker 欄位層級。")
+
+    level0 = data.columns.get_level_values(0)
+    ticker_level = 1 if ('Close' in level0 or 'Open' in level0) else 0
+    available = set(data.columns.get_level_values(ticker_level))
+    for ticker in tickers:
+        if ticker not in available:
+            errors[ticker] = f"{ticker} 在所選時間內無資料。"
+            continue
+        try:
+            frame = data.xs(ticker, axis=1, level=ticker_level)
+            frame.columns.name = None
+            frames[ticker] = _validate_bars(frame, ticker)
+        except ValueError as e:
+            errors[ticker] = str(e)
+    return frames, errors
+
+
+def _to_epoch_seconds(index):
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    return ((index - pd.Timestamp('1970-01-01')) // pd.Timedelta(seconds=1)).astype('int64')
+
+
+def _from_epoch_seconds(seconds, tz):
+    index = pd.DatetimeIndex(pd.to_datetime(pd.Index(seconds), unit='s'))
+    if tz:
+        index = index.tz_localize('UTC').tz_convert(tz)
+    index.name = 'Datetime' if tz else 'Date'
+    return pd.DatetimeIndex(index)
+
+
+def _from_epoch(seconds, tz=None):
+    """epoch 秒轉回時間點：有 tz 時回傳該時區時間，否則為不含時區的 UTC 時間"""
+    ts = pd.Timestamp(int(seconds), unit='s')
+    return ts.tz_localize('UTC').tz_convert(tz) if tz else ts
+
+
+def _epoch(ts, tz=None):
+    """單一時間點轉成 epoch 秒；不含時區的時間視為 tz 當地時間"""
+    ts = pd.Timestamp(ts)
+    if ts.tz is None and tz:
+        ts = ts.tz_localize(tz)
+    return int(_to_epoch_seconds(pd.DatetimeIndex([ts]))[0])
+
+
+# ------------------------------------------------------
+# 2) 本地 K 線儲存 (SQLite，依 ticker / interval 分開)
+# ------------------------------------------------------
+class BarStore:
+    """
+    以 SQLite 保存每檔股票、每種週期的 OHLCV。
+    ranges 表記錄已向資料來源抓過的時間區段 (重疊或相連的區段會合併)，
+    區段內沒有 K 線代表當時本來就沒有交易，不需要重抓
+    """
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, 'bars.sqlite')
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        with closing(self._connect()) as conn, conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != self.SCHEMA_VERSION:
+                # 快取格式變更時直接重建
+                for table in ('bars', 'meta', 'ranges'):
+                    conn.execute(f"DROP TABLE IF EXISTS {table}")
+                conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bars ("
+                " ticker TEXT, interval TEXT, ts INTEGER,"
+                " open REAL, high REAL, low REAL, close REAL, volume REAL,"
+                " PRIMARY KEY (ticker, interval, ts))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta ("
+                " ticker TEXT, interval TEXT, tz TEXT, updated_at REAL,"
+                " PRIMARY KEY (ticker, interval))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ranges ("
+                " ticker TEXT, interval TEXT, start INTEGER, end INTEGER)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_meta(self, ticker, interval):
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT tz, updated_at FROM meta WHERE ticker=? AND interval=?",
+                (ticker, interval)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'tz': row[0], 'updated_at': row[1]}
+
+    def load(self, ticker, interval, start=None, end=None):
+        meta = self.get_meta(ticker, interval)
+        if meta is None:
+            return None
+        sql = "SELECT ts, open, high, low, close, volume FROM bars WHERE ticker=? AND interval=?"
+        params = [ticker, interval]
+        if start is not None:
+            sql += " AND ts >= ?"
+            params.append(_epoch(start, meta['tz']))
+        if end is not None:
+            sql += " AND ts < ?"
+            params.append(_epoch(end, meta['tz']))
+        sql += " ORDER BY ts"
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql, params).fetchall()
+        if not rows:
+            return None
+        frame = pd.DataFrame(rows, columns=['ts'] + BAR_COLUMNS)
+        frame.index = _from_epoch_seconds(frame.pop('ts'), meta['tz'])
+        if frame['Volume'].notna().all():
+            frame['Volume'] = frame['Volume'].astype('int64')
+        return frame
+
+    def save(self, ticker, interval, data):
+        """寫入 (覆蓋同時間戳) K 線，並更新 meta"""
+        tz = str(data.index.tz) if data.index.tz is not None else None
+        bars = data.reindex(columns=BAR_COLUMNS)
+        rows = list(zip(
+            _to_epoch_seconds(bars.index).tolist(),
+            *[bars[col].astype('float64').where(bars[col].notna(), None).tolist() for col in BAR_COLUMNS]
+        ))
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO bars VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(ticker, interval) + row for row in rows]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?, ?, ?)",
+                (ticker, interval, tz, time.time())
+            )
+
+    def touch(self, ticker, interval):
+        """只更新最後嘗試抓取的時間 (沒有抓到新 K 線時使用)"""
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE meta SET updated_at=? WHERE ticker=? AND interval=?",
+                (time.time(), ticker, interval)
+            )
+
+    def delete_ticker(self, ticker):
+        """刪除某檔股票所有週期的 K 線與區段 (還原價失效時使用)"""
+        with self._lock, closing(self._connect()) as conn, conn:
+            for table in ('bars', 'meta', 'ranges'):
+                conn.execute(f"DELETE FROM {table} WHERE ticker=?", (ticker,))
+
+    def get_ranges(self, ticker, interval):
+        """已涵蓋的時間區段 [(start, end), ...]，epoch 秒、依時間排序"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT start, end FROM ranges WHERE ticker=? AND interval=? ORDER BY start",
+                (ticker, interval)
+            ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def add_range(self, ticker, interval, start, end):
+        """登記一段已抓取的區段，並與既有的重疊 / 相連區段合併"""
+        if end <= start:
+            return
+        with self._lock, closing(self._connect()) as conn, conn:
+            rows = conn.execute(
+                "SELECT start, end FROM ranges WHERE ticker=? AND interval=? AND start<=? AND end>=?",
+                (ticker, interval, end, start)
+            ).fetchall()
+            for row_start, row_end in rows:
+                start, end = min(start, row_start), max(end, row_end)
+            conn.execute(
+                "DELETE FROM ranges WHERE ticker=? AND interval=? AND start>=? AND end<=?",
+                (ticker, interval, start, end)
+            )
+            conn.execute("INSERT INTO ranges VALUES (?, ?, ?, ?)", (ticker, interval, start, end))
+
+
+def missing_ranges(ranges, start, end):
+    """回傳 [start, end) 中尚未被 ranges 涵蓋的區段"""
+    gaps = []
+    cursor = start
+    for range_start, range_end in ranges:
+        if range_end <= cursor:
+            continue
+        if range_start >= end:
+            break
+        if range_start > cursor:
+            gaps.append((cursor, range_start))
+        cursor = max(cursor, range_end)
+        if cursor >= end:
+            break
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+_bar_store = None
+_bar_store_lock = threading.Lock()
+
+
+def get_bar_store():
+    global _bar_store
+    with _bar_store_lock:
+        if _bar_store is None:
+            _bar_store = BarStore()
+        return _bar_store
+
+
+# ------------------------------------------------------
+# 3) 記憶體快取 (TTL + LRU) 與 single-flight 合併請求
+# ------------------------------------------------------
+class _InFlight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MemoryCache:
+    """
+    有容量上限與存活時間的 LRU 快取；
+    同一個 key 同時有多個請求時只執行一次 loader，其餘請求等待並共用結果
+    """
+
+    def __init__(self, maxsize=MEMORY_CACHE_SIZE, ttl=MEMORY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            call = self._inflight.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                self.misses += 1
+                call = self._inflight[key] = _InFlight()
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = loader()
+        except Exception as e:
+            call.error = e
+            raise
+        else:
+            self.put(key, call.result)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.event.set()
+        return call.result
+
+    def put(self, key, value):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def invalidate(self, predicate):
+        """移除 key 符合 predicate 的項目"""
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'inflight': len(self._inflight),
+            }
+
+
+memory_cache = MemoryCache()
+
+
+def memory_cache_stats():
+    return memory_cache.stats()
+
+
+# ------------------------------------------------------
+# 4) 資料來源 (provider)：yfinance 或本地檔案重播
+# ------------------------------------------------------
+class MarketDataProvider:
+    """
+    資料來源介面：download 回傳單檔已整理好的 OHLCV，
+    download_batch 回傳 (frames, errors)
+    """
+    name = 'base'
+    # 是否經過本地 K 線快取 (本地檔案來源不需要再快取一次)
+    use_bar_store = True
+    # 分鐘線是否依 Yahoo 的回溯上限以「現在」為基準切段抓取
+    chunk_intraday = True
+
+    def download(self, ticker, period=None, interval='1d', start=None, end=None):
+        raise NotImplementedError
+
+    def period_start(self, ticker, period, interval='1d'):
+        """period 對應的起始時間 (以現在為基準)；period='max' 時為 None"""
+        return period_to_start(period)
+
+    def download_batch(self, tickers, period=None, interval='1d', start=None, end=None):
+        frames, errors = {}, {}
+        for ticker in tickers:
+            try:
+                frames[ticker] = self.download(ticker, period=period, interval=interval, start=start, end=end)
+            except ValueError as e:
+                errors[ticker] = str(e)
+        return frames, errors
+
+    def download_chunks(self, ticker, interval, chunks):
+        """抓取多個 (start, end) 區段，回傳 DataFrame 清單 (沒有資料的區段略過)"""
+        frames = []
+        for chunk_start, chunk_end in chunks:
+            try:
+                frames.append(self.download(ticker, interval=interval, start=chunk_start, end=chunk_end))
+            except ValueError:
+                continue
+        return frames
+
+
+def _range_kwargs(period, start, end):
+    if start is None and end is None:
+        return {'period': period}
+    return {'start': start if start is not None else EPOCH_START, 'end': end}
+
+
+class YFinanceProvider(MarketDataProvider):
+    name = 'yfinance'
+
+    def download(self, ticker, period=None, interval='1d', start=None, end=None):
+        kwargs = _range_kwargs(period, start, end)
+        data = yf.download(ticker, interval=interval, progress=False, **kwargs)
+        return normalize_download(data, ticker)
+
+    def download_batch(self, tickers, period=None, interval='1d', start=None, end=None):
+        kwargs = _range_kwargs(period, start, end)
+        data = yf.download(tickers, interval=interval, group_by='column',
+                           threads=True, progress=False, **kwargs)
+        return split_download(data, tickers)
+
+    def download_chunks(self, ticker, interval, chunks):
+        # yf.download 共用模組層級的暫存，不能同時呼叫；分段並行改用各自獨立的 Ticker.history
+        def fetch(chunk):
+            data = yf.Ticker(ticker).history(start=chunk[0], end=chunk[1], interval=interval,
+                                             auto_adjust=True, actions=False)
+            try:
+                return normalize_download(data, ticker)
+            except ValueError:
+                return None
+
+        with ThreadPoolExecutor(max_workers=max(1, min(INTRADAY_FETCH_WORKERS, len(chunks)))) as pool:
+            return [f for f in pool.map(fetch, chunks) if f is not None]
+
+
+class ReplayProvider(MarketDataProvider):
+    """
+    從目錄中預先錄好的 K 線檔重播資料 (壓力測試、離線部署用)。
+    檔名格式為 <TICKER>_<interval>.parquet 或 <TICKER>_<interval>.csv (.parquet 需另裝 pyarrow)，
+    日線也接受 <TICKER>.csv。period 以檔案中最後一根 K 線為基準往前推，結果固定可重現
+    """
+    name = 'replay'
+    use_bar_store = False
+    # 檔案內的 K 線可能是很久以前錄的：分鐘線也整段讀取，period 以最後一根 K 線為基準
+    chunk_intraday = False
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.environ.get("KLINE_REPLAY_DIR", os.path.join(CACHE_DIR, 'replay'))
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def _candidates(self, ticker, interval):
+        names = [f"{ticker}_{interval}.parquet", f"{ticker}_{interval}.csv"]
+        if interval == '1d':
+            names += [f"{ticker}.parquet", f"{ticker}.csv"]
+        return [os.path.join(self.directory, name) for name in names]
+
+    def _read(self, path):
+        if path.endswith('.parquet'):
+            frame = pd.read_parquet(path)
+        else:
+            frame = pd.read_csv(path, index_col=0)
+            try:
+                frame.index = pd.DatetimeIndex(pd.to_datetime(frame.index))
+            except (ValueError, TypeError):
+                # 夏令時間造成時差不一致時，統一轉成 UTC
+                frame.index = pd.DatetimeIndex(pd.to_datetime(frame.index, utc=True))
+        frame.index.name = 'Datetime' if frame.index.tz is not None else 'Date'
+        return frame.sort_index()
+
+    def _load(self, ticker, interval):
+        key = (ticker, interval)
+        with self._lock:
+            if key in self._frames:
+                return self._frames[key]
+        for path in self._candidates(ticker, interval):
+            if os.path.exists(path):
+                frame = self._read(path)
+                with self._lock:
+                    self._frames[key] = frame
+                return frame
+        raise ValueError(f"{ticker} 在所選時間內無資料。")
+
+    def download(self, ticker, period=None, interval='1d', start=None, end=None):
+        data = self._load(ticker, interval)
+        if data.empty:
+            raise ValueError(f"{ticker} 在所選時間內無資料。")
+        if start is None and period is not None:
+            start = self.period_start(ticker, period, interval)
+        if start is not None:
+            data = data[data.index >= localize_like(start, data.index)]
+        if end is not None:
+            data = data[data.index < localize_like(end, data.index)]
+        return _validate_bars(data.copy(), ticker)
+
+    def period_start(self, ticker, period, interval='1d'):
+        """以檔案中最後一根 K 線為基準往前推，而不是現在"""
+        data = self._load(ticker, interval)
+        if data.empty:
+            return period_to_start(period)
+        last = data.index[-1]
+        return period_to_start(period, now=last.tz_localize(None) if last.tz is not None else last)
+
+    def write(self, ticker, data, interval='1d'):
+        """把 K 線寫成重播檔 (CSV)，例如夜間快照"""
+        os.makedirs(self.directory, exist_ok=True)
+        ticker = normalize_ticker(ticker)
+        data.to_csv(os.path.join(self.directory, f"{ticker}_{interval}.csv"))
+        with self._lock:
+            self._frames.pop((ticker, interval), None)
+
+
+PROVIDERS = {
+    'yfinance': YFinanceProvider,
+    'replay': ReplayProvider,
+}
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_provider():
+    """依環境變數 KLINE_DATA_PROVIDER (yfinance / replay / async) 建立資料來源"""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            name = os.environ.get("KLINE_DATA_PROVIDER", "yfinance").strip().lower()
+            if name == 'async':
+                # 非同步引擎需要 aiohttp，選用時才載入
+                from fetch_engine import AsyncYahooProvider
+                _provider = AsyncYahooProvider()
+            elif name in PROVIDERS:
+                _provider = PROVIDERS[name]()
+            else:
+                raise ValueError(f"不支援的資料來源：{name}")
+        return _provider
+
+
+def set_provider(provider):
+    """切換資料來源 (測試 / 壓測用)，並清空記憶體快取"""
+    global _provider
+    with _provider_lock:
+        _provider = provider
+    memory_cache.clear()
+
+
+# ------------------------------------------------------
+# 5) 除權息 / 分割：還原價變動時只重建受影響的股票
+# ------------------------------------------------------
+_invalidation_listeners = []
+
+
+def add_invalidation_listener(callback):
+    """註冊 callback(ticker)：某檔股票的還原價失效時呼叫 (例如清掉預先計算的形態 / 指標)"""
+    _invalidation_listeners.append(callback)
+
+
+def adjustment_changed(stored, fresh):
+    """
+    比對已存與新抓 K 線重疊的部分 (不含已存的最後一根，可能是盤中未收的 K 線)，
+    任一根收盤價相對差異超過 ADJUST_TOLERANCE 即視為還原價已變動
+    """
+    if stored is None or fresh is None or len(stored) < 2:
+        return False
+    stored = stored.iloc[:-1]
+    common = stored.index.intersection(fresh.index)
+    if common.empty:
+        return False
+    old = stored.loc[common, 'Close'].to_numpy(dtype='float64')
+    new = fresh.loc[common, 'Close'].to_numpy(dtype='float64')
+    diff = abs(new - old) / abs(old).clip(min=1e-12)
+    return bool((diff > ADJUST_TOLERANCE).any())
+
+
+def invalidate_ticker(ticker, store=None):
+    """刪除某檔股票的本地 K 線 (所有週期) 與記憶體快取，並通知預先計算的結果"""
+    ticker = normalize_ticker(ticker)
+    (store or get_bar_store()).delete_ticker(ticker)
+    memory_cache.invalidate(lambda key: key[0] == ticker)
+    for callback in _invalidation_listeners:
+        callback(ticker)
+
+
+def _stored_overlap(store, ticker, interval, data):
+    return store.load(ticker, interval, start=data.index[0])
+
+
+# ------------------------------------------------------
+# 6) 資料抓取：本地有資料時只補抓最後一根之後的 K 線
+# ------------------------------------------------------
+def period_start(ticker, period, interval='1d'):
+    """period 的起始時間，基準由資料來源決定 (重播資料以檔案中最後一根 K 線為準)"""
+    return get_provider().period_start(normalize_ticker(ticker), period, interval)
+
+
+def download_bars(ticker, period=None, interval='1d', start=None, end=None):
+    ticker = normalize_ticker(ticker)
+    provider = get_provider()
+    if not is_intraday(interval) or not provider.chunk_intraday:
+        return provider.download(ticker, period=period, interval=interval, start=start, end=end)
+
+    # 分鐘線：依 Yahoo 限制切段並行抓取後再接起來
+    if start is None and period is not None:
+        start = provider.period_start(ticker, period, interval)
+    data = stitch_bars(provider.download_chunks(ticker, interval, plan_intraday_chunks(interval, start, end)))
+    if data is None:
+        raise ValueError(f"{ticker} 在所選時間內無資料。")
+    return data
+
+
+def download_bars_batch(tickers, period=None, interval='1d', start=None, end=None):
+    """一次抓多檔股票，回傳 (frames, errors)"""
+    tickers = list(dict.fromkeys(normalize_ticker(t) for t in tickers))
+    if not tickers:
+        return {}, {}
+    return get_provider().download_batch(tickers, period=period, interval=interval, start=start, end=end)
+
+
+def fetch_bars_batch(tickers, period='6mo', interval='1d', chunk_size=200, store=None):
+    """
+    批次抓取大量股票 (例如夜間排程)：每 chunk_size 檔合併成一次下載，
+    結果同步寫入本地 K 線快取。回傳 (frames, errors)
+    """
+    tickers = list(dict.fromkeys(normalize_ticker(t) for t in tickers))
+    start = period_to_start(period)
+    if BAR_STORE_ENABLED and get_provider().use_bar_store:
+        store = store or get_bar_store()
+    frames, errors = {}, {}
+    for i in range(0, len(tickers), chunk_size):
+        chunk = tickers[i:i + chunk_size]
+        fetched_at = time.time()
+        try:
+            chunk_frames, chunk_errors = download_bars_batch(chunk, period=period, interval=interval)
+        except Exception as e:
+            errors.update({ticker: str(e) for ticker in chunk})
+            continue
+        errors.update(chunk_errors)
+        for ticker, frame in chunk_frames.items():
+            if store is not None:
+                if adjustment_changed(_stored_overlap(store, ticker, interval, frame), frame):
+                    invalidate_ticker(ticker, store)
+                store.save(ticker, interval, frame)
+                tz = str(frame.index.tz) if frame.index.tz is not None else None
+                store.add_range(ticker, interval, _epoch(start if start is not None else EPOCH_START, tz),
+                                int(fetched_at))
+            frames[ticker] = frame
+    return frames, errors
+
+
+def fetch_bars(ticker, period='6mo', interval='1d', start=None, end=None):
+    """
+    前端統一入口：先查記憶體快取，同時間相同的請求只會觸發一次 load_bars；
+    回傳複本，避免呼叫端修改到快取內容
+    """
+    ticker = normalize_ticker(ticker)
+    start = pd.Timestamp(start) if start not in (None, '') else None
+    end = pd.Timestamp(end) if end not in (None, '') else None
+    key = (ticker, str(period).strip().lower(), str(interval).strip().lower(), start, end)
+    data = memory_cache.get_or_load(key, lambda: load_bars(ticker, period, interval, start=start, end=end))
+    return data.copy()
+
+
+def load_bars(ticker, period='6mo', interval='1d', start=None, end=None, store=None, _retry=True):
+    """
+    依快取已涵蓋的區段規劃抓取：請求區間已涵蓋時直接從本地切片，
+    否則只補抓缺少的區段 (包含最後一根 K 線之後的尾段)。
+    補抓時與已存 K 線重疊比對，還原價有變動 (除權息 / 分割) 就清掉這檔股票重新抓取。
+    有指定 start 時忽略 period；end 不含當天
+    """
+    ticker = normalize_ticker(ticker)
+    by_period = start is None and end is None
+    if start is None:
+        start = period_to_start(period)
+    if not BAR_STORE_ENABLED or not get_provider().use_bar_store:
+        if by_period:
+            return download_bars(ticker, period=period, interval=interval)
+        return download_bars(ticker, interval=interval, start=start, end=end)
+
+    store = store or get_bar_store()
+    meta = store.get_meta(ticker, interval)
+    # 請求區間與登記的區段都以資料的時區換算：已有 K 線時取自 meta，
+    # 第一次抓取時還不知道，抓到資料後再以 K 線的時區重新換算 (見下方)
+    tz = meta['tz'] if meta is not None else None
+    now = time.time()
+
+    def request_range(tz):
+        return (_epoch(start if start is not None else EPOCH_START, tz),
+                _epoch(end, tz) if end is not None else int(now))
+
+    req_start, req_end = request_range(tz)
+    # 還沒有任何 K 線時，先前登記的 (空) 區段時區不明，整段重新規劃
+    ranges = store.get_ranges(ticker, interval) if meta is not None else []
+    gaps = missing_ranges(ranges, req_start, req_end) if req_end > req_start else []
+    range_ends = {range_end for _, range_end in ranges}
+
+    for gap_start, gap_end in gaps:
+        open_ended = end is None and gap_end >= req_end
+        if (open_ended and meta is not None and gap_start in range_ends
+                and now - max(gap_start, meta['updated_at']) < CACHE_REFRESH_SECONDS):
+            # 接在既有區段之後的尾段剛更新過，視為最新
+            continue
+        fetch_start = _from_epoch(gap_start, tz)
+        overlap = gap_start in range_ends
+        if is_intraday(interval):
+            # 分鐘線只往前重疊幾根 (含可能尚未收完的最後一根)，其餘直接附加在後面
+            fetch_start = fetch_start - interval_to_timedelta(interval) * (ADJUST_OVERLAP_BARS if overlap else 1)
+        else:
+            fetch_start = fetch_start.normalize()
+            if overlap:
+                fetch_start = fetch_start - pd.Timedelta(days=ADJUST_OVERLAP_DAYS)
+        fetch_end = None if open_ended else _from_epoch(gap_end, tz)
+        try:
+            if not ranges and by_period:
+                data = download_bars(ticker, period=period, interval=interval)
+                fetch_start = start if start is not None else EPOCH_START
+            else:
+                data = download_bars(ticker, interval=interval, start=fetch_start, end=fetch_end)
+        except ValueError:
+            # 該區段沒有任何 K 線
+            data = None
+        except Exception:
+            # 抓取失敗時，若本地已有資料就先沿用
+            if ranges:
+                continue
+            raise
+
+        if data is not None:
+            if adjustment_changed(_stored_overlap(store, ticker, interval, data), data):
+                invalidate_ticker(ticker, store)
+                if _retry:
+                    return load_bars(ticker, period, interval, start=None if by_period else start,
+                                     end=end, store=store, _retry=False)
+            store.save(ticker, interval, data)
+            if tz is None and data.index.tz is not None:
+                # 第一次抓到分鐘線：缺口就是整個請求區間，改以交易所時區重新換算後再登記
+                tz = str(data.index.tz)
+                req_start, req_end = request_range(tz)
+                gap_start, gap_end = req_start, req_end
+        elif open_ended:
+            # 尾段沒有新 K 線 (休市或上游暫時無回應)：不登記區段，只記錄嘗試時間
+            if meta is not None:
+                store.touch(ticker, interval)
+            continue
+        store.add_range(ticker, interval, min(_epoch(fetch_start, tz), gap_start),
+                        int(now) if open_ended else gap_end)
+
+    data = store.load(ticker, interval, start=start, end=end)
+    if data is None or data.empty:
+        raise ValueError(f"{ticker} 在所選時間內無資料。")
+    return data
@@ -0,0 +1,202 @@
+import numpy as np
+import pandas as pd
+
+from patterns import PATTERN_DIRECTIONS, PATTERN_FUNCTIONS, resolve_patterns
+from time_utils import localize_like
+
+# ------------------------------------------------------
+# 稀疏形態事件：只保存有訊號的 (K 線位置, 形態編號, 帶正負號的強度)。
+# 形態矩陣幾乎全是 0，密集的 61 欄 int 表格每根 K 線要 244 bytes，
+# 事件每筆只要 8 bytes (int32 + int16 + int16)
+# ------------------------------------------------------
+PATTERN_NAMES = list(PATTERN_FUNCTIONS)
+PATTERN_IDS = {name: i for i, name in enumerate(PATTERN_NAMES)}
+# 依形態編號查方向 (patterns.PATTERN_DIRECTIONS)：單向形態固定 +1 / -1，雙向形態為 0 (沿用代碼正負號)；
+# 無方向的形態 (十字、缺影線 …) 不算看漲也不算看跌
+_FIXED_SIGNS = np.array([{'bullish': 1, 'bearish': -1}.get(PATTERN_DIRECTIONS[n], 0) for n in PATTERN_NAMES],
+                        dtype='int16')
+_DIRECTIONAL = np.array([PATTERN_DIRECTIONS[n] is not None for n in PATTERN_NAMES], dtype=bool)
+
+
+class PatternEvents:
+    """
+    單一股票的形態事件，依 K 線位置排序 (同一根 K 線內保持原始欄位順序)。
+    bars 即為日期索引 (搭配 index 以 searchsorted 查詢)；形態索引 (CSR) 在第一次依形態查詢時建立
+    """
+
+    def __init__(self, index, bars, pattern_ids, strengths, columns=None):
+        self.index = index
+        self.bars = np.asarray(bars, dtype='int32')
+        self.pattern_ids = np.asarray(pattern_ids, dtype='int16')
+        self.strengths = np.asarray(strengths, dtype='int16')
+        # 轉回密集表格時的欄位 (偵測了哪些形態)，沒有訊號的形態也要保留成全 0 欄
+        self.columns = list(columns) if columns is not None else PATTERN_NAMES
+        self._by_pattern = None
+
+    @classmethod
+    def from_matrix(cls, index, matrix, columns):
+        """由 (K 線數 × 形態數) 的代碼矩陣建立"""
+        matrix = np.asarray(matrix)
+        bars, cols = np.nonzero(matrix)
+        ids = np.array([PATTERN_IDS[name] for name in columns], dtype='int16')
+        return cls(index, bars, ids[cols], matrix[bars, cols], columns)
+
+    @classmethod
+    def from_frame(cls, frame):
+        """由 detect_candlestick_patterns 的密集 DataFrame 建立"""
+        return cls.from_matrix(frame.index, frame.to_numpy(), list(frame.columns))
+
+    def __len__(self):
+        return len(self.bars)
+
+    @property
+    def nbytes(self):
+        return self.bars.nbytes + self.pattern_ids.nbytes + self.strengths.nbytes
+
+    @property
+    def signals(self):
+        """帶方向的強度 (與 patterns.pattern_signal 相同)：正值看漲、負值看跌、無方向的形態為 0"""
+        fixed = _FIXED_SIGNS[self.pattern_ids]
+        signals = np.where(fixed != 0, fixed * np.abs(self.strengths), self.strengths)
+        return np.where(_DIRECTIONAL[self.pattern_ids], signals, 0).astype('int16')
+
+    @property
+    def names(self):
+        return [PATTERN_NAMES[i] for i in self.pattern_ids]
+
+    def _subset(self, positions):
+        return PatternEvents(self.index, self.bars[positions], self.pattern_ids[positions],
+                             self.strengths[positions], self.columns)
+
+    def _pattern_positions(self, names):
+        if self._by_pattern is None:
+            order = np.argsort(self.pattern_ids, kind='stable')
+            offsets = np.searchsorted(self.pattern_ids[order], np.arange(len(PATTERN_NAMES) + 1))
+            self._by_pattern = (order, offsets)
+        order, offsets = self._by_pattern
+        ids = [PATTERN_IDS[name] for name in names]
+        if not ids:
+            return np.empty(0, dtype='int64')
+        return np.sort(np.concatenate([order[offsets[i]:offsets[i + 1]] for i in ids]))
+
+    def query(self, patterns=None, direction=None, min_strength=0, last_n=None, start=None, end=None):
+        """
+        篩選事件：patterns 為形態群組或 CDL 名稱；direction 為 'bullish' 或 'bearish' (依 PATTERN_DIRECTIONS)；
+        min_strength 為 |強度| 下限；last_n 只取最後 N 根 K 線；start / end 為日期區間 (含端點)
+        """
+        first, last = 0, len(self.index)
+        if last_n is not None:
+            first = max(first, len(self.index) - int(last_n))
+        if start is not None:
+            first = max(first, int(self.index.searchsorted(self._as_index_time(start), side='left')))
+        if end is not None:
+            last = min(last, int(self.index.searchsorted(self._as_index_time(end), side='right')))
+        lo, hi = np.searchsorted(self.bars, [first, last])
+
+        if patterns:
+            positions = self._pattern_positions(resolve_patterns(patterns))
+            positions = positions[(positions >= lo) & (positions < hi)]
+        else:
+            positions = np.arange(lo, hi)
+        strengths = self.strengths[positions]
+        mask = np.ones(len(positions), dtype=bool)
+        if direction in ('bullish', 'bearish'):
+            # 方向依形態方向表判斷，而不是 TA-Lib 代碼的正負號 (十字等無方向形態兩邊都不算)
+            signals = self._subset(positions).signals
+            mask &= signals > 0 if direction == 'bullish' else signals < 0
+        elif direction is not None:
+            raise ValueError(f"未知的訊號方向：{direction}")
+        if min_strength:
+            mask &= np.abs(strengths) >= min_strength
+        return self._subset(positions[mask])
+
+    def _as_index_time(self, ts):
+        """start / end 轉成與時間索引相同的時區 (分鐘線索引帶交易所時區，輸入的日期通常不帶)"""
+        if isinstance(self.index, pd.DatetimeIndex):
+            return localize_like(ts, self.index)
+        return pd.Timestamp(ts)
+
+    def to_dense(self, columns=None):
+        """轉回與 detect_candlestick_patterns 相同的密集表格"""
+        columns = list(columns) if columns is not None else self.columns
+        col_of = np.full(len(PATTERN_NAMES), -1, dtype='int64')
+        col_of[[PATTERN_IDS[name] for name in columns]] = np.arange(len(columns))
+        cols = col_of[self.pattern_ids]
+        keep = cols >= 0
+        matrix = np.zeros((len(self.index), len(columns)), dtype='int32')
+        matrix[self.bars[keep], cols[keep]] = self.strengths[keep]
+        return pd.DataFrame(matrix, index=self.index, columns=columns)
+
+    def to_frame(self):
+        """長表格：每筆事件一列 (日期, 形態, 強度)"""
+        return pd.DataFrame({
+            'Date': self.index[self.bars],
+            'Pattern': self.names,
+            'Strength': self.strengths.astype('int32'),
+        })
+
+    def bar_labels(self, descriptions=None):
+        """
+        依 K 線彙整：回傳 (有訊號的 K 線位置, 每根 K 線的形態名稱清單)，
+        descriptions 有給時換成中文名稱
+        """
+        if not len(self.bars):
+            return np.empty(0, dtype='int32'), []
+        bars, starts = np.unique(self.bars, return_index=True)
+        names = self.names
+        if descriptions is not None:
+            names = [descriptions.get(name, name) for name in names]
+        bounds = list(starts[1:]) + [len(names)]
+        return bars, [names[s:e] for s, e in zip(starts, bounds)]
+
+
+# ------------------------------------------------------
+# 多檔股票的事件庫 (例如全市場、多年的歷史)
+# ------------------------------------------------------
+class PatternEventStore:
+    def __init__(self):
+        self._events = {}
+
+    def __contains__(self, ticker):
+        return ticker in self._events
+
+    def __getitem__(self, ticker):
+        return self._events[ticker]
+
+    @property
+    def tickers(self):
+        return list(self._events)
+
+    def put(self, ticker, events):
+        self._events[ticker] = events
+
+    @classmethod
+    def from_patterns_2d(cls, tickers, dates, results):
+        """由 candle_engine.detect_patterns_2d 的 {CDL 名稱: (ticker 數 × K 線數)} 結果建立"""
+        store = cls()
+        columns = list(results)
+        for row, ticker in enumerate(tickers):
+            matrix = np.zeros((len(dates), len(columns)), dtype='int32')
+            for col, name in enumerate(columns):
+                matrix[:, col] = results[name][row]
+            store.put(ticker, PatternEvents.from_matrix(dates, matrix, columns))
+        return store
+
+    @property
+    def nbytes(self):
+        return sum(events.nbytes for events in self._events.values())
+
+    def query(self, tickers=None, **filters):
+        """對每檔股票套用 PatternEvents.query，合併成長表格 (Ticker, Date, Pattern, Strength)"""
+        frames = []
+        for ticker in (tickers if tickers is not None else self._events):
+            events = self._events.get(ticker)
+            if events is None:
+                continue
+            frame = events.query(**filters).to_frame()
+            if not frame.empty:
+                frame.insert(0, 'Ticker', ticker)
+                frames.append(frame)
+        if not frames:
+            return pd.DataFrame(columns=['Ticker', 'Date', 'Pattern', 'Strength'])
+        return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,197 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from market_data import (BAR_STORE_ENABLED, _from_epoch, add_invalidation_listener, get_bar_store,
+                         get_provider, normalize_ticker)
+from patterns import PATTERN_DIRECTIONS, IncrementalPatternDetector, pattern_descriptions, resolve_patterns
+from resample import RESAMPLE_BASE, is_resampled, resample_bars
+from result_cache import content_fingerprint
+
+# ------------------------------------------------------
+# 設定
+# ------------------------------------------------------
+# 形態出現後持有幾根 K 線 (逗號分隔)
+PERFORMANCE_HORIZONS = tuple(
+    int(h) for h in os.environ.get("KLINE_PERFORMANCE_HORIZONS", "1,5,20").split(',') if h.strip()
+)
+MAX_PERFORMANCE_STATES = 256
+
+
+# ------------------------------------------------------
+# 1) 形態出現後的未來報酬
+# ------------------------------------------------------
+def event_returns(close, bars, horizons):
+    """
+    (事件數 × 週期數)：第 bar 根收盤買進、持有 h 根後的報酬；
+    未來 K 線還不夠時為 NaN (之後有新 K 線進來再補上)
+    """
+    close = np.asarray(close, dtype='float64')
+    targets = np.asarray(bars)[:, np.newaxis] + np.asarray(horizons)[np.newaxis, :]
+    valid = targets < len(close)
+    future = close[np.minimum(targets, len(close) - 1)]
+    return np.where(valid, future / close[bars][:, np.newaxis] - 1, np.nan)
+
+
+def summarize_performance(names, cols, signs, returns, horizons):
+    """
+    依 (形態, 方向) 彙整：次數，以及各持有週期的勝率 (朝訊號方向變動的比例)、平均與中位數報酬 (%)。
+    所有形態一次以 groupby 計算
+    """
+    frame = pd.DataFrame({'col': cols, 'sign': signs})
+    for j, h in enumerate(horizons):
+        frame[f'r{h}'] = returns[:, j] * 100
+        frame[f'w{h}'] = np.where(np.isnan(returns[:, j]), np.nan, (returns[:, j] * signs) > 0)
+
+    columns = ['形態', '方向', '次數']
+    for h in horizons:
+        columns += [f'{h}根勝率(%)', f'{h}根平均報酬(%)', f'{h}根中位數報酬(%)']
+    if frame.empty:
+        return pd.DataFrame(columns=columns)
+
+    grouped = frame.groupby(['col', 'sign'], sort=False)
+    summary = pd.DataFrame({'次數': grouped.size()})
+    for h in horizons:
+        summary[f'{h}根勝率(%)'] = grouped[f'w{h}'].mean() * 100
+        summary[f'{h}根平均報酬(%)'] = grouped[f'r{h}'].mean()
+        summary[f'{h}根中位數報酬(%)'] = grouped[f'r{h}'].median()
+    summary = summary.reset_index()
+    summary.insert(0, '形態', [names[c] for c in summary.pop('col')])
+    summary.insert(1, '方向', np.where(summary.pop('sign') > 0, '看漲', '看跌'))
+    summary = summary.sort_values(['次數', '形態'], ascending=[False, True]).reset_index(drop=True)
+    return summary[columns].round(2)
+
+
+# ------------------------------------------------------
+# 2) 增量更新：新 K 線進來時只重算尾端的形態，以及未來報酬尚未完整的事件
+# ------------------------------------------------------
+class PatternPerformance:
+    """
+    保存整段歷史的形態事件 (K 線位置, 形態欄, 方向) 與其未來報酬；方向依 patterns.PATTERN_DIRECTIONS，
+    十字、紡錘等無方向的形態沒有勝率可言，不列入統計。
+    尾端新增 K 線時，形態交給 IncrementalPatternDetector 只重算 lookback 視窗；
+    持有期間已完全落在舊資料內的事件 (已成熟) 直接沿用，不再重算
+    """
+
+    def __init__(self, horizons=PERFORMANCE_HORIZONS, patterns=None):
+        self.horizons = tuple(sorted({int(h) for h in horizons}))
+        if not self.horizons or self.horizons[0] < 1:
+            raise ValueError("持有週期必須是正整數。")
+        self.detector = IncrementalPatternDetector(patterns)
+        self.names = self.detector.names
+        # 每個形態欄的方向：單向形態固定 +1 / -1，雙向形態為 0 (依代碼正負號)；無方向的形態不統計
+        self._directional = np.array([PATTERN_DIRECTIONS[n] is not None for n in self.names], dtype=bool)
+        self._fixed_sign = np.array([{'bullish': 1, 'bearish': -1}.get(PATTERN_DIRECTIONS[n], 0)
+                                     for n in self.names], dtype='int8')
+        self.fingerprint = None
+        self.bars = None
+        self.cols = None
+        self.signs = None
+        self.returns = None
+        self.summary = None
+        self.last_update_events = 0
+        self._lock = threading.Lock()
+
+    def update(self, data):
+        fingerprint = content_fingerprint(data)
+        if fingerprint == self.fingerprint:
+            return self.summary
+        matrix = self.detector.update(data).to_numpy()
+        start = len(data) - self.detector.last_update_rows
+        close = np.asarray(data['Close'], dtype='float64')
+
+        bars, cols = np.nonzero(matrix[start:])
+        keep = self._directional[cols]
+        bars, cols = bars[keep] + start, cols[keep]
+        fixed = self._fixed_sign[cols]
+        signs = np.where(fixed != 0, fixed, np.sign(matrix[bars, cols])).astype('int8')
+        returns = event_returns(close, bars, self.horizons)
+        self.last_update_events = len(bars)
+        if start and self.bars is not None:
+            keep = self.bars < start
+            old_bars, old_cols, old_signs = self.bars[keep], self.cols[keep], self.signs[keep]
+            old_returns = self.returns[keep]
+            pending = old_bars + self.horizons[-1] >= start
+            old_returns[pending] = event_returns(close, old_bars[pending], self.horizons)
+            self.last_update_events += int(pending.sum())
+            bars = np.concatenate([old_bars, bars])
+            cols = np.concatenate([old_cols, cols])
+            signs = np.concatenate([old_signs, signs])
+            returns = np.concatenate([old_returns, returns])
+
+        self.bars, self.cols, self.signs, self.returns = bars, cols, signs, returns
+        self.summary = summarize_performance(self.names, cols, signs, returns, self.horizons)
+        self.fingerprint = fingerprint
+        return self.summary
+
+
+_states = OrderedDict()
+_states_lock = threading.Lock()
+
+
+def pattern_performance(key, data, horizons=PERFORMANCE_HORIZONS):
+    """依 key (例如 (ticker, interval)) 保留狀態，回傳全部形態的績效表；資料沒變時直接回傳上次結果"""
+    state_key = (key, tuple(sorted({int(h) for h in horizons})))
+    with _states_lock:
+        state = _states.get(state_key)
+        if state is None:
+            state = _states[state_key] = PatternPerformance(horizons)
+            while len(_states) > MAX_PERFORMANCE_STATES:
+                _states.popitem(last=False)
+        else:
+            _states.move_to_end(state_key)
+    with state._lock:
+        return state.update(data)
+
+
+def _drop_ticker(ticker):
+    with _states_lock:
+        for state_key in [k for k in _states if k[0][0] == ticker]:
+            del _states[state_key]
+
+
+add_invalidation_listener(_drop_ticker)
+
+
+# ------------------------------------------------------
+# 3) 以本地快取的完整歷史計算單一股票的形態績效
+# ------------------------------------------------------
+def cached_history(ticker, interval='1d', store=None):
+    """
+    本地 K 線快取中包含最新一根 K 線的連續區段 (中間有缺口的舊區段不納入)；
+    未使用 K 線快取 (KLINE_BAR_STORE=0 或重播資料來源) 時回傳 None
+    """
+    if not BAR_STORE_ENABLED or not get_provider().use_bar_store:
+        return None
+    if is_resampled(interval):
+        # 週 K / 月 K / 4h 等合成週期：由基礎週期的完整歷史合成
+        base = cached_history(ticker, RESAMPLE_BASE[interval], store)
+        return None if base is None else resample_bars(base, interval)
+    store = store or get_bar_store()
+    ranges = store.get_ranges(ticker, interval)
+    if not ranges:
+        return None
+    meta = store.get_meta(ticker, interval)
+    tz = meta['tz'] if meta is not None else None
+    return store.load(ticker, interval, start=_from_epoch(ranges[-1][0], tz))
+
+
+def ticker_performance(ticker, interval='1d', patterns=None, horizons=PERFORMANCE_HORIZONS, data=None):
+    """
+    形態歷史績效表 (只列出 patterns 指定的形態)。
+    優先使用本地快取的完整歷史，快取沒有時才用傳入的 data
+    """
+    ticker = normalize_ticker(ticker)
+    history = cached_history(ticker, interval)
+    if history is None or (data is not None and len(data) > len(history)):
+        history = data
+    if history is None or history.empty:
+        raise ValueError(f"{ticker} 沒有可計算績效的歷史資料。")
+    summary = pattern_performance((ticker, interval), history, horizons)
+    selected = set(resolve_patterns(patterns))
+    summary = summary[summary['形態'].isin(selected)].reset_index(drop=True)
+    summary.insert(1, '名稱', [pattern_descriptions.get(n, n) for n in summary['形態']])
+    return summary
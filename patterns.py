@@ -0,0 +1,350 @@
+import threading
+from collections import OrderedDict
+
+import talib
+import talib.abstract
+import numpy as np
+import pandas as pd
+
+# ------------------------------------------------------
+# 1) 蠟燭形態對照表（中文） + 偵測函式
+# ------------------------------------------------------
+pattern_descriptions = {
+    "CDL2CROWS": "雙鴉（CDL2CROWS）",
+    "CDL3BLACKCROWS": "三烏鴉（CDL3BLACKCROWS）",
+    "CDL3INSIDE": "內困三日上升 / 下降（CDL3INSIDE）",
+    "CDL3LINESTRIKE": "三線打擊（CDL3LINESTRIKE）",
+    "CDL3OUTSIDE": "外側三日上升 / 下降（CDL3OUTSIDE）",
+    "CDL3STARSINSOUTH": "南方三星（CDL3STARSINSOUTH）",
+    "CDL3WHITESOLDIERS": "三白兵（CDL3WHITESOLDIERS）",
+    "CDLABANDONEDBABY": "棄嬰（CDLABANDONEDBABY）",
+    "CDLADVANCEBLOCK": "大敵當前（CDLADVANCEBLOCK）",
+    "CDLBELTHOLD": "捉腰帶線（CDLBELTHOLD）",
+    "CDLBREAKAWAY": "脫離（CDLBREAKAWAY）",
+    "CDLCLOSINGMARUBOZU": "收盤缺影線（CDLCLOSINGMARUBOZU）",
+    "CDLCONCEALBABYSWALL": "藏嬰吞沒（CDLCONCEALBABYSWALL）",
+    "CDLCOUNTERATTACK": "反擊線（CDLCOUNTERATTACK）",
+    "CDLDARKCLOUDCOVER": "烏雲壓頂（CDLDARKCLOUDCOVER）",
+    "CDLDOJI": "十字（CDLDOJI）",
+    "CDLDOJISTAR": "十字星（CDLDOJISTAR）",
+    "CDLDRAGONFLYDOJI": "蜻蜓十字（CDLDRAGONFLYDOJI）",
+    "CDLENGULFING": "吞噬模式（CDLENGULFING）",
+    "CDLEVENINGDOJISTAR": "十字暮星（CDLEVENINGDOJISTAR）",
+    "CDLEVENINGSTAR": "暮星（CDLEVENINGSTAR）",
+    "CDLGAPSIDESIDEWHITE": "向上 / 下跳空並列陽線（CDLGAPSIDESIDEWHITE）",
+    "CDLGRAVESTONEDOJI": "墓碑十字（CDLGRAVESTONEDOJI）",
+    "CDLHAMMER": "錘頭（CDLHAMMER）",
+    "CDLHANGINGMAN": "上吊線（CDLHANGINGMAN）",
+    "CDLHARAMI": "母子線（CDLHARAMI）",
+    "CDLHARAMICROSS": "十字孕線（CDLHARAMICROSS）",
+    "CDLHIGHWAVE": "風高浪大線（CDLHIGHWAVE）",
+    "CDLHIKKAKE": "陷阱（CDLHIKKAKE）",
+    "CDLHIKKAKEMOD": "修正陷阱（CDLHIKKAKEMOD）",
+    "CDLHOMINGPIGEON": "家鴿（CDLHOMINGPIGEON）",
+    "CDLIDENTICAL3CROWS": "三胞胎烏鴉（CDLIDENTICAL3CROWS）",
+    "CDLINNECK": "頸內線（CDLINNECK）",
+    "CDLINVERTEDHAMMER": "倒錘頭（CDLINVERTEDHAMMER）",
+    "CDLKICKING": "反衝型態（CDLKICKING）",
+    "CDLKICKINGBYLENGTH": "由較長缺影線決定的反衝型態（CDLKICKINGBYLENGTH）",
+    "CDLLADDERBOTTOM": "梯底（CDLLADDERBOTTOM）",
+    "CDLLONGLEGGEDDOJI": "長腳十字（CDLLONGLEGGEDDOJI）",
+    "CDLLONGLINE": "長蠟燭（CDLLONGLINE）",
+    "CDLMARUBOZU": "光頭光腳 / 缺影線（CDLMARUBOZU）",
+    "CDLMATCHINGLOW": "相同低價（CDLMATCHINGLOW）",
+    "CDLMATHOLD": "鋪墊（CDLMATHOLD）",
+    "CDLMORNINGDOJISTAR": "十字晨星（CDLMORNINGDOJISTAR）",
+    "CDLMORNINGSTAR": "晨星（CDLMORNINGSTAR）",
+    "CDLONNECK": "頸上線（CDLONNECK）",
+    "CDLPIERCING": "刺透（CDLPIERCING）",
+    "CDLRICKSHAWMAN": "黃包車伕（CDLRICKSHAWMAN）",
+    "CDLRISEFALL3METHODS": "上升 / 下降三法（CDLRISEFALL3METHODS）",
+    "CDLSEPARATINGLINES": "分離線（CDLSEPARATINGLINES）",
+    "CDLSHOOTINGSTAR": "射擊之星（CDLSHOOTINGSTAR）",
+    "CDLSHORTLINE": "短蠟燭（CDLSHORTLINE）",
+    "CDLSPINNINGTOP": "紡錘（CDLSPINNINGTOP）",
+    "CDLSTALLEDPATTERN": "停頓（CDLSTALLEDPATTERN）",
+    "CDLSTICKSANDWICH": "條形三明治（CDLSTICKSANDWICH）",
+    "CDLTAKURI": "探水竿（CDLTAKURI）",
+    "CDLTASUKIGAP": "跳空並列陰陽線（CDLTASUKIGAP）",
+    "CDLTHRUSTING": "插入（CDLTHRUSTING）",
+    "CDLTRISTAR": "三星（CDLTRISTAR）",
+    "CDLUNIQUE3RIVER": "奇特三河床（CDLUNIQUE3RIVER）",
+    "CDLUPSIDEGAP2CROWS": "向上跳空雙烏鴉（CDLUPSIDEGAP2CROWS）",
+    "CDLXSIDEGAP3METHODS": "上升 / 下降跳空三法（CDLXSIDEGAP3METHODS）"
+}
+
+# 形態名稱 -> TA-Lib 函式 (模組載入時建立一次)
+PATTERN_FUNCTIONS = {
+    "CDL2CROWS": talib.CDL2CROWS,
+    "CDL3BLACKCROWS": talib.CDL3BLACKCROWS,
+    "CDL3INSIDE": talib.CDL3INSIDE,
+    "CDL3LINESTRIKE": talib.CDL3LINESTRIKE,
+    "CDL3OUTSIDE": talib.CDL3OUTSIDE,
+    "CDL3STARSINSOUTH": talib.CDL3STARSINSOUTH,
+    "CDL3WHITESOLDIERS": talib.CDL3WHITESOLDIERS,
+    "CDLABANDONEDBABY": talib.CDLABANDONEDBABY,
+    "CDLADVANCEBLOCK": talib.CDLADVANCEBLOCK,
+    "CDLBELTHOLD": talib.CDLBELTHOLD,
+    "CDLBREAKAWAY": talib.CDLBREAKAWAY,
+    "CDLCLOSINGMARUBOZU": talib.CDLCLOSINGMARUBOZU,
+    "CDLCONCEALBABYSWALL": talib.CDLCONCEALBABYSWALL,
+    "CDLCOUNTERATTACK": talib.CDLCOUNTERATTACK,
+    "CDLDARKCLOUDCOVER": talib.CDLDARKCLOUDCOVER,
+    "CDLDOJI": talib.CDLDOJI,
+    "CDLDOJISTAR": talib.CDLDOJISTAR,
+    "CDLDRAGONFLYDOJI": talib.CDLDRAGONFLYDOJI,
+    "CDLENGULFING": talib.CDLENGULFING,
+    "CDLEVENINGDOJISTAR": talib.CDLEVENINGDOJISTAR,
+    "CDLEVENINGSTAR": talib.CDLEVENINGSTAR,
+    "CDLGAPSIDESIDEWHITE": talib.CDLGAPSIDESIDEWHITE,
+    "CDLGRAVESTONEDOJI": talib.CDLGRAVESTONEDOJI,
+    "CDLHAMMER": talib.CDLHAMMER,
+    "CDLHANGINGMAN": talib.CDLHANGINGMAN,
+    "CDLHARAMI": talib.CDLHARAMI,
+    "CDLHARAMICROSS": talib.CDLHARAMICROSS,
+    "CDLHIGHWAVE": talib.CDLHIGHWAVE,
+    "CDLHIKKAKE": talib.CDLHIKKAKE,
+    "CDLHIKKAKEMOD": talib.CDLHIKKAKEMOD,
+    "CDLHOMINGPIGEON": talib.CDLHOMINGPIGEON,
+    "CDLIDENTICAL3CROWS": talib.CDLIDENTICAL3CROWS,
+    "CDLINNECK": talib.CDLINNECK,
+    "CDLINVERTEDHAMMER": talib.CDLINVERTEDHAMMER,
+    "CDLKICKING": talib.CDLKICKING,
+    "CDLKICKINGBYLENGTH": talib.CDLKICKINGBYLENGTH,
+    "CDLLADDERBOTTOM": talib.CDLLADDERBOTTOM,
+    "CDLLONGLEGGEDDOJI": talib.CDLLONGLEGGEDDOJI,
+    "CDLLONGLINE": talib.CDLLONGLINE,
+    "CDLMARUBOZU": talib.CDLMARUBOZU,
+    "CDLMATCHINGLOW": talib.CDLMATCHINGLOW,
+    "CDLMATHOLD": talib.CDLMATHOLD,
+    "CDLMORNINGDOJISTAR": talib.CDLMORNINGDOJISTAR,
+    "CDLMORNINGSTAR": talib.CDLMORNINGSTAR,
+    "CDLONNECK": talib.CDLONNECK,
+    "CDLPIERCING": talib.CDLPIERCING,
+    "CDLRICKSHAWMAN": talib.CDLRICKSHAWMAN,
+    "CDLRISEFALL3METHODS": talib.CDLRISEFALL3METHODS,
+    "CDLSEPARATINGLINES": talib.CDLSEPARATINGLINES,
+    "CDLSHOOTINGSTAR": talib.CDLSHOOTINGSTAR,
+    "CDLSHORTLINE": talib.CDLSHORTLINE,
+    "CDLSPINNINGTOP": talib.CDLSPINNINGTOP,
+    "CDLSTALLEDPATTERN": talib.CDLSTALLEDPATTERN,
+    "CDLSTICKSANDWICH": talib.CDLSTICKSANDWICH,
+    "CDLTAKURI": talib.CDLTAKURI,
+    "CDLTASUKIGAP": talib.CDLTASUKIGAP,
+    "CDLTHRUSTING": talib.CDLTHRUSTING,
+    "CDLTRISTAR": talib.CDLTRISTAR,
+    "CDLUNIQUE3RIVER": talib.CDLUNIQUE3RIVER,
+    "CDLUPSIDEGAP2CROWS": talib.CDLUPSIDEGAP2CROWS,
+    "CDLXSIDEGAP3METHODS": talib.CDLXSIDEGAP3METHODS,
+}
+
+
+# 每個形態需要往前看幾根 K 線 (含 TA-Lib 蠟燭平均的期間)
+PATTERN_LOOKBACK = {name: talib.abstract.Function(name).lookback for name in PATTERN_FUNCTIONS}
+
+
+def detect_candlestick_patterns(data, patterns=None):
+    """
+    偵測蠟燭形態；patterns 可指定形態群組名稱 (COMMON_PATTERNS) 或 CDL 名稱，
+    只計算指定的形態，未指定時計算全部
+    """
+    # data 可以是 DataFrame 或 universe_store.UniverseBars (mmap 上的零複製 view)
+    open_prices = np.asarray(data['Open'], dtype='float64')
+    high_prices = np.asarray(data['High'], dtype='float64')
+    low_prices = np.asarray(data['Low'], dtype='float64')
+    close_prices = np.asarray(data['Close'], dtype='float64')
+
+    results = {}
+    for name in resolve_patterns(patterns):
+        results[name] = PATTERN_FUNCTIONS[name](open_prices, high_prices, low_prices, close_prices)
+    return pd.DataFrame(results, index=data.index)
+
+
+# ------------------------------------------------------
+# 2) 常用形態分類
+# ------------------------------------------------------
+COMMON_PATTERNS = {
+    "看漲形態": [
+        "CDLMORNINGSTAR",
+        "CDLMORNINGDOJISTAR",
+        "CDLHAMMER",
+        "CDLINVERTEDHAMMER",
+        "CDLENGULFING",
+        "CDLPIERCING",
+        "CDL3WHITESOLDIERS",
+        "CDLHARAMI",
+        "CDLINNECK",
+        "CDLONNECK",
+        "CDLBELTHOLD",
+        "CDLHOMINGPIGEON",
+        "CDLMATCHINGLOW",
+        "CDLTHRUSTING",
+        "CDLUNIQUE3RIVER",
+        "CDLLADDERBOTTOM",
+        "CDLMARUBOZU"
+    ],
+    "看跌形態": [
+        "CDLEVENINGSTAR",
+        "CDLEVENINGDOJISTAR",
+        "CDLHANGINGMAN",
+        "CDLSHOOTINGSTAR",
+        "CDLDARKCLOUDCOVER",
+        "CDL3BLACKCROWS",
+        "CDL2CROWS",
+        "CDL3STARSINSOUTH",
+        "CDLIDENTICAL3CROWS",
+        "CDLADVANCEBLOCK",
+        "CDLBREAKAWAY",
+        "CDLCOUNTERATTACK",
+        "CDLGAPSIDESIDEWHITE",
+        "CDLGRAVESTONEDOJI",
+        "CDLHIGHWAVE",
+        "CDLSTALLEDPATTERN",
+        "CDLUPSIDEGAP2CROWS",
+        "CDLXSIDEGAP3METHODS"
+    ]
+}
+
+# 形態方向 (形態績效、共振分數用)：
+#   'signed'  TA-Lib 以正負號區分看漲 / 看跌 (吞噬、母子、捉腰帶線 …)
+#   'bullish' / 'bearish'  只輸出單一代碼的形態，方向依 COMMON_PATTERNS 的分類
+#   None      無方向：十字、紡錘、長短蠟燭、缺影線等，代碼正負號只代表 K 線顏色 (或固定為 +100)
+# 不在分類中、也不是無方向的形態沿用 TA-Lib 的正負號
+TWO_SIDED_PATTERNS = {
+    "CDL3INSIDE", "CDL3LINESTRIKE", "CDL3OUTSIDE", "CDLABANDONEDBABY", "CDLBELTHOLD", "CDLBREAKAWAY",
+    "CDLCOUNTERATTACK", "CDLDOJISTAR", "CDLENGULFING", "CDLGAPSIDESIDEWHITE", "CDLHARAMI", "CDLHARAMICROSS",
+    "CDLHIKKAKE", "CDLHIKKAKEMOD", "CDLKICKING", "CDLKICKINGBYLENGTH", "CDLRISEFALL3METHODS",
+    "CDLSEPARATINGLINES", "CDLTASUKIGAP", "CDLTRISTAR", "CDLXSIDEGAP3METHODS",
+}
+NON_DIRECTIONAL_PATTERNS = {
+    "CDLDOJI", "CDLDRAGONFLYDOJI", "CDLLONGLEGGEDDOJI", "CDLRICKSHAWMAN", "CDLSPINNINGTOP", "CDLHIGHWAVE",
+    "CDLLONGLINE", "CDLSHORTLINE", "CDLMARUBOZU", "CDLCLOSINGMARUBOZU", "CDLTAKURI",
+}
+
+
+def _pattern_direction(name):
+    if name in NON_DIRECTIONAL_PATTERNS:
+        return None
+    if name in TWO_SIDED_PATTERNS:
+        return 'signed'
+    if name in COMMON_PATTERNS["看漲形態"]:
+        return 'bullish'
+    if name in COMMON_PATTERNS["看跌形態"]:
+        return 'bearish'
+    return 'signed'
+
+
+PATTERN_DIRECTIONS = {name: _pattern_direction(name) for name in PATTERN_FUNCTIONS}
+
+
+def pattern_signal(name, codes):
+    """
+    形態代碼轉成帶方向的強度：正值看漲、負值看跌；無方向的形態全為 0。
+    codes 可為任意形狀的陣列
+    """
+    codes = np.asarray(codes)
+    direction = PATTERN_DIRECTIONS[name]
+    if direction is None:
+        return np.zeros_like(codes)
+    if direction == 'bullish':
+        return np.abs(codes)
+    if direction == 'bearish':
+        return -np.abs(codes)
+    return codes
+
+
+def resolve_patterns(selection=None):
+    """
+    將形態群組名稱 (如「看漲形態」) 或 CDL 名稱展開成不重複的 CDL 名稱清單；
+    未指定時回傳全部形態
+    """
+    if not selection:
+        return list(PATTERN_FUNCTIONS)
+    if isinstance(selection, str):
+        selection = [selection]
+    names = []
+    for item in selection:
+        if item in COMMON_PATTERNS:
+            names.extend(COMMON_PATTERNS[item])
+        elif item in PATTERN_FUNCTIONS:
+            names.append(item)
+        else:
+            raise ValueError(f"未知的蠟燭形態：{item}")
+    return list(dict.fromkeys(names))
+
+
+# ------------------------------------------------------
+# 3) 增量偵測：新 K 線進來時只重算尾端的 lookback 視窗
+# ------------------------------------------------------
+class IncrementalPatternDetector:
+    """
+    保存上一次的 OHLC 與形態矩陣。新資料只是在尾端多了 K 線 (最後一根舊 K 線可能被更新) 時，
+    從「最後一根舊 K 線 - 最大 lookback」開始重算並接回去，結果與整段重算完全相同；
+    其他情況 (起點改變、歷史被修正) 則整段重算
+    """
+
+    def __init__(self, patterns=None):
+        self.names = resolve_patterns(patterns)
+        self.lookback = max(PATTERN_LOOKBACK[name] for name in self.names)
+        self.index = None
+        self.prices = None
+        self.matrix = None
+        self.last_update_rows = 0
+        self._lock = threading.Lock()
+
+    def update(self, data):
+        prices = np.column_stack([
+            np.asarray(data[col], dtype='float64') for col in ('Open', 'High', 'Low', 'Close')
+        ])
+        index = data.index
+        start = self._recompute_from(index, prices)
+        window_start = max(0, start - self.lookback)
+        window = prices[window_start:]
+        tail = np.column_stack([
+            PATTERN_FUNCTIONS[name](window[:, 0], window[:, 1], window[:, 2], window[:, 3])
+            for name in self.names
+        ]) if len(window) else np.empty((0, len(self.names)), dtype='int32')
+
+        matrix = np.empty((len(index), len(self.names)), dtype='int32')
+        if start:
+            matrix[:start] = self.matrix[:start]
+        matrix[start:] = tail[start - window_start:]
+        self.index, self.prices, self.matrix = index, prices, matrix
+        self.last_update_rows = len(index) - start
+        return pd.DataFrame(matrix, index=index, columns=self.names, copy=True)
+
+    def _recompute_from(self, index, prices):
+        """回傳需要重算的第一列；無法增量時回傳 0"""
+        if self.index is None or len(self.index) == 0 or len(index) < len(self.index):
+            return 0
+        prev = len(self.index)
+        if index[0] != self.index[0] or index[prev - 1] != self.index[-1]:
+            return 0
+        # 視窗內的舊 K 線 (最後一根除外) 必須完全相同，否則代表歷史被修正過
+        check_from = max(0, prev - 1 - self.lookback)
+        if not np.array_equal(prices[check_from:prev - 1], self.prices[check_from:prev - 1]):
+            return 0
+        return prev - 1
+
+
+_detectors = OrderedDict()
+_detectors_lock = threading.Lock()
+MAX_INCREMENTAL_DETECTORS = 512
+
+
+def detect_candlestick_patterns_incremental(key, data, patterns=None):
+    """
+    依 key (例如 (ticker, period, interval)) 保留偵測狀態，
+    同一組資料再次更新時只重算尾端視窗
+    """
+    names = tuple(resolve_patterns(patterns))
+    with _detectors_lock:
+        detector = _detectors.get((key, names))
+        if detector is None:
+            detector = _detectors[(key, names)] = IncrementalPatternDetector(list(names))
+            while len(_detectors) > MAX_INCREMENTAL_DETECTORS:
+                _detectors.popitem(last=False)
+        else:
+            _detectors.move_to_end((key, names))
+    with detector._lock:
+        return detector.update(data)
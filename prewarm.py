@@ -0,0 +1,268 @@
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from compact import COMPACT_DTYPES, compact_indicators, frame_nbytes
+from indicators import DEFAULT_INDICATORS, calculate_selected_indicators
+from market_data import (add_invalidation_listener, fetch_bars_batch, load_bars, normalize_ticker,
+                         period_to_start)
+from pattern_events import PatternEvents
+from patterns import detect_candlestick_patterns
+from result_cache import content_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------
+# 設定
+# ------------------------------------------------------
+# 觀察清單：檔案 (一行一檔，# 開頭為註解) 或逗號分隔字串
+WATCHLIST_FILE = os.environ.get("KLINE_WATCHLIST", "watchlist.txt")
+WATCHLIST_TICKERS = os.environ.get("KLINE_WATCHLIST_TICKERS", "")
+# 收盤後延遲多少分鐘再更新 (等 Yahoo 收盤資料就緒)
+PREWARM_DELAY_MINUTES = int(os.environ.get("KLINE_PREWARM_DELAY_MINUTES", "20"))
+# 介面可選的時間區間，每一個都預先計算
+PREWARM_PERIODS = ["1mo", "3mo", "6mo", "1y"]
+
+# 各交易所時區與收盤時間
+EXCHANGE_SESSIONS = {
+    'TW': {'tz': 'Asia/Taipei', 'close': (13, 30)},
+    'US': {'tz': 'America/New_York', 'close': (16, 0)},
+}
+
+
+def exchange_of(ticker):
+    return 'TW' if ticker.endswith(('.TW', '.TWO')) else 'US'
+
+
+def load_watchlist(path=WATCHLIST_FILE, tickers=WATCHLIST_TICKERS):
+    items = [t for t in tickers.split(',') if t.strip()]
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            items += [line.split('#', 1)[0] for line in f]
+    return list(dict.fromkeys(normalize_ticker(t) for t in items if t.strip()))
+
+
+def next_refresh_time(exchange, now=None):
+    """下一次收盤後的更新時間 (週一至週五)，回傳該交易所時區的時間"""
+    session = EXCHANGE_SESSIONS[exchange]
+    now = pd.Timestamp.now(tz=session['tz']) if now is None else pd.Timestamp(now).tz_convert(session['tz'])
+    hour, minute = session['close']
+    candidate = now.normalize() + timedelta(hours=hour, minutes=minute + PREWARM_DELAY_MINUTES)
+    while candidate <= now or candidate.weekday() >= 5:
+        candidate = (candidate + timedelta(days=1)).normalize() + timedelta(hours=hour, minutes=minute + PREWARM_DELAY_MINUTES)
+    return candidate
+
+
+# ------------------------------------------------------
+# 1) 預先計算的形態 / 指標結果
+# ------------------------------------------------------
+class PrecomputedResults:
+    """
+    (ticker, period, interval) -> 預熱時的 K 線內容指紋 (result_cache.content_fingerprint)、
+    形態事件 (稀疏儲存) 與預設指標。查詢時指紋不同 (補進新 K 線、任一欄被修正) 就視為未命中；
+    呼叫端已算過指紋時可直接傳入 fingerprint
+    """
+
+    def __init__(self):
+        self._results = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(ticker, period, interval):
+        return normalize_ticker(ticker), str(period).strip().lower(), str(interval or '1d').strip().lower()
+
+    def put(self, ticker, period, data, patterns, indicators, interval='1d'):
+        with self._lock:
+            if COMPACT_DTYPES:
+                indicators = compact_indicators(indicators)
+            self._results[self._key(ticker, period, interval)] = (
+                content_fingerprint(data), PatternEvents.from_frame(patterns), indicators)
+
+    def get_patterns(self, ticker, period, data, interval='1d', fingerprint=None):
+        entry = self._lookup(ticker, period, data, interval, fingerprint)
+        return None if entry is None else entry[1].to_dense()
+
+    def get_indicators(self, ticker, period, data, selected_indicators, interval='1d', fingerprint=None):
+        entry = self._lookup(ticker, period, data, interval, fingerprint)
+        if entry is None or set(selected_indicators or []) != set(DEFAULT_INDICATORS):
+            return None
+        return entry[2].copy()
+
+    @property
+    def nbytes(self):
+        """目前常駐的形態事件與指標表格佔用的 bytes"""
+        with self._lock:
+            entries = list(self._results.values())
+        return sum(events.nbytes + frame_nbytes(indicators) for _, events, indicators in entries)
+
+    def invalidate(self, ticker):
+        ticker = normalize_ticker(ticker)
+        with self._lock:
+            for key in [k for k in self._results if k[0] == ticker]:
+                del self._results[key]
+
+    def _lookup(self, ticker, period, data, interval, fingerprint=None):
+        with self._lock:
+            entry = self._results.get(self._key(ticker, period, interval))
+        if entry is None or entry[0] != (fingerprint or content_fingerprint(data)):
+            return None
+        return entry
+
+
+precomputed = PrecomputedResults()
+add_invalidation_listener(precomputed.invalidate)
+
+
+# ------------------------------------------------------
+# 2) 更新觀察清單
+# ------------------------------------------------------
+def refresh_tickers(tickers, periods=PREWARM_PERIODS, precompute=True):
+    """
+    以一次批次下載更新最長區間的日 K，再依各區間預先計算形態與預設指標。
+    precompute=False 時只更新磁碟上的 K 線快取 (sidecar 用)。回傳這次更新的統計
+    """
+    started = time.perf_counter()
+    longest = min(periods, key=period_to_start)
+    _, errors = fetch_bars_batch(tickers, period=longest)
+    fetched = time.perf_counter()
+
+    computed = 0
+    for ticker in tickers:
+        if ticker in errors or not precompute:
+            continue
+        for period in periods:
+            try:
+                data = load_bars(ticker, period)
+            except Exception as e:
+                errors[ticker] = str(e)
+                break
+            precomputed.put(ticker, period, data,
+                            detect_candlestick_patterns(data),
+                            calculate_selected_indicators(data, DEFAULT_INDICATORS), interval='1d')
+            computed += 1
+
+    finished = time.perf_counter()
+    return {
+        'tickers': len(tickers),
+        'errors': errors,
+        'computed': computed,
+        'fetch_seconds': round(fetched - started, 3),
+        'compute_seconds': round(finished - fetched, 3),
+        'total_seconds': round(finished - started, 3),
+        'resident_bytes': precomputed.nbytes,
+        'finished_at': datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+# ------------------------------------------------------
+# 3) 背景排程：各交易所收盤後更新各自的股票
+# ------------------------------------------------------
+class PrewarmScheduler:
+    def __init__(self, watchlist=None, precompute=True):
+        watchlist = watchlist if watchlist is not None else load_watchlist()
+        self.watchlist = list(dict.fromkeys(normalize_ticker(t) for t in watchlist))
+        self.precompute = precompute
+        self.history = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+        add_invalidation_listener(self._on_invalidate)
+
+    def _on_invalidate(self, ticker):
+        """觀察清單內的股票還原價失效時，只在背景重建這一檔"""
+        with self._refreshing_lock:
+            if ticker not in self.watchlist or ticker in self._refreshing:
+                return
+        threading.Thread(target=self._refresh_group, args=(exchange_of(ticker), [ticker]),
+                         name='kline-prewarm-invalidate', daemon=True).start()
+
+    def _refresh_group(self, exchange, tickers):
+        with self._refreshing_lock:
+            self._refreshing.update(tickers)
+        try:
+            stats = refresh_tickers(tickers, precompute=self.precompute)
+        finally:
+            with self._refreshing_lock:
+                self._refreshing.difference_update(tickers)
+        stats['exchange'] = exchange
+        self.history.append(stats)
+        del self.history[:-50]
+        logger.info("預熱 %s：%d 檔，抓取 %.2fs，計算 %.2fs，失敗 %d 檔",
+                    exchange, stats['tickers'], stats['fetch_seconds'], stats['compute_seconds'],
+                    len(stats['errors']))
+        return stats
+
+    def groups(self):
+        groups = {}
+        for ticker in self.watchlist:
+            groups.setdefault(exchange_of(ticker), []).append(ticker)
+        return groups
+
+    def refresh(self, exchange=None):
+        """立即更新 (不指定交易所時全部更新)，並記錄耗時"""
+        results = {}
+        for name, tickers in self.groups().items():
+            if exchange is not None and name != exchange:
+                continue
+            results[name] = self._refresh_group(name, tickers)
+        return results
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            groups = self.groups()
+            if not groups:
+                logger.warning("觀察清單為空，預熱排程停止")
+                return
+            due = {name: next_refresh_time(name) for name in groups}
+            exchange = min(due, key=lambda name: due[name])
+            wait = (due[exchange] - pd.Timestamp.now(tz=due[exchange].tz)).total_seconds()
+            if self._stop.wait(max(wait, 0)):
+                return
+            try:
+                self.refresh(exchange)
+            except Exception:
+                logger.exception("預熱 %s 失敗", exchange)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run_forever, name='kline-prewarm', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+def start_prewarm_scheduler(watchlist=None, refresh_now=False):
+    """在 app 行程內啟動背景預熱；refresh_now=True 時先在背景更新一次"""
+    scheduler = PrewarmScheduler(watchlist)
+    if refresh_now:
+        threading.Thread(target=scheduler.refresh, name='kline-prewarm-initial', daemon=True).start()
+    return scheduler.start()
+
+
+# ------------------------------------------------------
+# 4) 獨立執行 (sidecar)：只需共用同一個 KLINE_CACHE_DIR。
+#    sidecar 只預熱 K 線：K 線快取寫在磁碟上，app 行程即可直接讀取；
+#    形態 / 指標結果只存在行程記憶體內，app 行程讀不到，因此不在 sidecar 計算
+#    (app 端改由內容快取在第一次開圖時計算；要預先算好請在 app 內以 KLINE_PREWARM=1 啟動)
+# ------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="觀察清單背景預熱 (只更新 K 線快取)")
+    parser.add_argument('--watchlist', default=WATCHLIST_FILE, help="觀察清單檔案")
+    parser.add_argument('--once', action='store_true', help="立即更新一次後結束")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    scheduler = PrewarmScheduler(load_watchlist(args.watchlist), precompute=False)
+    if args.once:
+        for name, stats in scheduler.refresh().items():
+            print(name, stats)
+    else:
+        scheduler.run_forever()
@@ -0,0 +1,249 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from market_data import add_invalidation_listener, fetch_bars, interval_to_timedelta, normalize_ticker, period_start
+
+# ------------------------------------------------------
+# 多週期分析：由本地快取的基礎 K 線合成較長週期，不另外向 Yahoo 下載
+#   週 K / 月 K    <- 日 K
+#   15m           <- 5m
+#   1h / 4h       <- 60m (Yahoo 的 60m 保留約 730 天，5m 只有 60 天)
+# 聚合規則：開盤取第一根、最高取最大、最低取最小、收盤取最後一根、成交量加總。
+# 分組一律以交易所當地時間判斷 (分鐘線的時間索引本身就是交易所時區)：
+#   週 K 以週一 ~ 週日、月 K 以曆月分組，標記為區間內第一個實際交易日 (週一休市時為週二)；
+#   分鐘線以開盤時間為起點每 N 分鐘一段 (台股 09:00、美股 09:30)，不跨越交易日
+# ------------------------------------------------------
+
+# 目標週期: 基礎週期
+RESAMPLE_BASE = {
+    '1wk': '1d',
+    '1mo': '1d',
+    '15m': '5m',
+    '1h': '60m',
+    '4h': '60m',
+}
+
+NS_PER_DAY = 86_400 * 10 ** 9
+# 1970-01-01 為週四：(天數 + 3) % 7 即週一為 0 的星期
+_EPOCH_WEEKDAY = 3
+
+
+def is_resampled(interval):
+    return str(interval).strip().lower() in RESAMPLE_BASE
+
+
+def _is_intraday_target(target):
+    return not (target.endswith('wk') or target.endswith('mo'))
+
+
+def _wall_ns(index):
+    """時間索引的交易所當地時間 (去掉時區後的 ns)"""
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.as_unit('ns').asi8
+
+
+def session_open(index):
+    """分鐘線每個交易日第一根 K 線最常見的時間 (當日 ns 偏移)，即交易所的開盤時間"""
+    wall = _wall_ns(index)
+    if not len(wall):
+        return 0
+    days = wall // NS_PER_DAY
+    first = np.r_[True, days[1:] != days[:-1]]
+    offsets, counts = np.unique(wall[first] - days[first] * NS_PER_DAY, return_counts=True)
+    return int(offsets[counts.argmax()])
+
+
+def bucket_keys(index, target, anchor=0):
+    """每根基礎 K 線所屬區段的鍵 (遞增的 int64)；anchor 為分鐘線的開盤時間偏移"""
+    wall = _wall_ns(index)
+    days = wall // NS_PER_DAY
+    if target.endswith('wk'):
+        return days - (days + _EPOCH_WEEKDAY) % 7
+    if target.endswith('mo'):
+        return wall.astype('datetime64[ns]').astype('datetime64[M]').astype('int64')
+    length = interval_to_timedelta(target).value
+    day_start = days * NS_PER_DAY
+    slot = (wall - day_start - anchor) // length
+    # 開盤前的 K 線不往前跨到前一個交易日
+    return np.maximum(day_start + anchor + slot * length, day_start)
+
+
+def aggregate_bars(data, keys):
+    """依 bucket_keys 分組聚合 OHLCV；回傳 (合成後的 K 線, 每段第一根基礎 K 線的位置)"""
+    n = len(data)
+    if not n:
+        return data.iloc[:0].copy(), np.empty(0, dtype='int64')
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    columns = {}
+    if 'Open' in data.columns:
+        columns['Open'] = np.asarray(data['Open'])[starts]
+    if 'High' in data.columns:
+        columns['High'] = np.maximum.reduceat(np.asarray(data['High']), starts)
+    if 'Low' in data.columns:
+        columns['Low'] = np.minimum.reduceat(np.asarray(data['Low']), starts)
+    if 'Close' in data.columns:
+        columns['Close'] = np.asarray(data['Close'])[ends]
+    if 'Volume' in data.columns:
+        columns['Volume'] = np.add.reduceat(np.asarray(data['Volume']), starts)
+    return pd.DataFrame(columns, index=data.index[starts], copy=False), starts
+
+
+def resample_bars(data, target, anchor=None):
+    """將基礎 K 線合成為 target 週期 (一次性計算，不保留狀態)"""
+    target = str(target).strip().lower()
+    if target not in RESAMPLE_BASE:
+        raise ValueError(f"不支援合成的週期：{target}")
+    if anchor is None:
+        anchor = session_open(data.index) if _is_intraday_target(target) else 0
+    resampled, _ = aggregate_bars(data, bucket_keys(data.index, target, anchor))
+    return resampled
+
+
+# ------------------------------------------------------
+# 1) 增量合成：新的基礎 K 線只影響最後一段 (可能尚未完成的週 / 月 / 小時)
+# ------------------------------------------------------
+class IncrementalResampler:
+    """
+    保存上一次的基礎 K 線與合成結果。新資料只是在尾端多了 K 線 (最後一根舊 K 線可能被更新) 時，
+    丟掉最後一段、從該段第一根基礎 K 線開始重新聚合再接回去，結果與整段重算完全相同；
+    其他情況 (起點改變、歷史被修正) 則整段重算
+    """
+
+    def __init__(self, target):
+        self.target = str(target).strip().lower()
+        if self.target not in RESAMPLE_BASE:
+            raise ValueError(f"不支援合成的週期：{self.target}")
+        self.anchor = None
+        self.index = None
+        self.prices = None
+        self.result = None
+        self.starts = None
+        self.columns = None
+        self.last_update_rows = 0
+        self._lock = threading.Lock()
+
+    def update(self, data):
+        prices = np.column_stack([np.asarray(data[col], dtype='float64') for col in data.columns])
+        index = data.index
+        start = self._recompute_from(index, prices, list(data.columns))
+        if start is None:
+            self.anchor = session_open(index) if _is_intraday_target(self.target) else 0
+            result, starts = aggregate_bars(data, bucket_keys(index, self.target, self.anchor))
+            self.last_update_rows = len(index)
+        else:
+            tail = data.iloc[start:]
+            tail_result, tail_starts = aggregate_bars(tail, bucket_keys(tail.index, self.target, self.anchor))
+            result = pd.concat([self.result.iloc[:-1], tail_result])
+            starts = np.r_[self.starts[:-1], tail_starts + start]
+            self.last_update_rows = len(index) - start
+        self.index, self.prices, self.result, self.starts = index, prices, result, starts
+        self.columns = list(data.columns)
+        return result.copy()
+
+    def _recompute_from(self, index, prices, columns):
+        """回傳需要重新聚合的第一根基礎 K 線 (最後一段的起點)；無法增量時回傳 None"""
+        if self.index is None or not len(self.index) or len(index) < len(self.index) or columns != self.columns:
+            return None
+        prev = len(self.index)
+        if index[0] != self.index[0] or index[prev - 1] != self.index[-1]:
+            return None
+        # 舊 K 線 (最後一根除外) 必須完全相同，否則代表歷史被修正過 (比對成本遠低於重新分組聚合)
+        if not np.array_equal(prices[:prev - 1], self.prices[:prev - 1], equal_nan=True):
+            return None
+        return int(self.starts[-1])
+
+
+_resamplers = OrderedDict()
+_resamplers_lock = threading.Lock()
+MAX_RESAMPLERS = 512
+
+
+def resample_incremental(key, data, target):
+    """依 key (例如 (ticker, target, start, end)) 保留合成狀態，同一組資料再次更新時只重算最後一段"""
+    target = str(target).strip().lower()
+    with _resamplers_lock:
+        resampler = _resamplers.get((key, target))
+        if resampler is None:
+            resampler = _resamplers[(key, target)] = IncrementalResampler(target)
+            while len(_resamplers) > MAX_RESAMPLERS:
+                _resamplers.popitem(last=False)
+        else:
+            _resamplers.move_to_end((key, target))
+    with resampler._lock:
+        return resampler.update(data)
+
+
+def _drop_ticker(ticker):
+    """還原價變動 (除權息 / 分割) 時清掉該檔的合成狀態"""
+    ticker = normalize_ticker(ticker)
+    with _resamplers_lock:
+        for key in [key for key in _resamplers if key[0][0] == ticker]:
+            del _resamplers[key]
+
+
+add_invalidation_listener(_drop_ticker)
+
+
+# ------------------------------------------------------
+# 2) 資料抓取入口
+# ------------------------------------------------------
+def bucket_floor(ts, target):
+    """起始時間往前對齊到所屬區段的開頭 (週一 / 月初 / 當天 00:00)，避免第一段只含部分 K 線"""
+    ts = pd.Timestamp(ts).normalize()
+    if target.endswith('wk'):
+        return ts - pd.Timedelta(days=ts.weekday())
+    if target.endswith('mo'):
+        return ts.replace(day=1)
+    return ts
+
+
+def fetch_resampled(ticker, period='6mo', interval='1wk', start=None, end=None, loader=fetch_bars):
+    """
+    以 loader 取得基礎週期的 K 線 (預設 fetch_bars，走本地 K 線快取) 再合成 interval 週期。
+    有指定 start / end 時忽略 period
+    """
+    ticker = normalize_ticker(ticker)
+    target = str(interval).strip().lower()
+    if target not in RESAMPLE_BASE:
+        raise ValueError(f"不支援合成的週期：{target}")
+    start = pd.Timestamp(start) if start not in (None, '') else period_start(ticker, period, RESAMPLE_BASE[target])
+    end = pd.Timestamp(end) if end not in (None, '') else None
+    if start is not None:
+        start = bucket_floor(start, target)
+    base = loader(ticker, period=period, interval=RESAMPLE_BASE[target], start=start, end=end)
+    if base is None or base.empty:
+        raise ValueError(f"{ticker} 在所選時間內無資料。")
+    return resample_incremental((ticker, start, end), base, target)
+
+
+def fetch_any_interval(ticker, period='6mo', interval='1d', start=None, end=None, loader=fetch_bars):
+    """Yahoo 直接提供的週期用 loader 抓取；RESAMPLE_BASE 內的週期由基礎 K 線合成"""
+    if is_resampled(interval):
+        return fetch_resampled(ticker, period, interval, start=start, end=end, loader=loader)
+    return loader(ticker, period=period, interval=interval, start=start, end=end)
+
+
+# ------------------------------------------------------
+# 命令列：python resample.py 2330.TW --interval 1wk --period 1y
+# ------------------------------------------------------
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="由本地快取的基礎 K 線合成多週期 K 線")
+    parser.add_argument('ticker')
+    parser.add_argument('--interval', choices=list(RESAMPLE_BASE), default='1wk')
+    parser.add_argument('--period', default='1y')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    bars = fetch_resampled(args.ticker, args.period, args.interval)
+    with pd.option_context('display.width', 200):
+        print(bars.tail(20))
+    print(f"{len(bars)} 根 {args.interval} K 線，{time.perf_counter() - started:.3f}s")
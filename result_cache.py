@@ -0,0 +1,162 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from indicators import calculate_selected_indicators, indicator_columns, indicator_parameters, parse_indicator
+from patterns import detect_candlestick_patterns, resolve_patterns
+
+# ------------------------------------------------------
+# 以內容定址的指標 / 形態結果快取：
+#   key = (OHLCV 與時間索引的雜湊, 種類, 名稱, 參數)，每個指標 (或形態) 的輸出欄分開保存。
+#   同一份 K 線換一組勾選時只計算還沒快取的欄位；資料一變 (新 K 線、還原價調整) 雜湊就不同，不需另外失效
+# ------------------------------------------------------
+RESULT_CACHE_MB = float(os.environ.get("KLINE_RESULT_CACHE_MB", "256"))
+
+FINGERPRINT_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+def content_fingerprint(data):
+    """K 線內容的 128-bit 雜湊 (時間索引 + OHLCV 的原始 bytes)，5 萬根約 1 ms"""
+    digest = hashlib.blake2b(digest_size=16)
+    index = pd.DatetimeIndex(data.index)
+    digest.update(str(index.dtype).encode())
+    digest.update(np.ascontiguousarray(index.asi8).data)
+    for col in FINGERPRINT_COLUMNS:
+        if col in data.columns:
+            values = np.ascontiguousarray(data[col])
+            digest.update(f"{col}:{values.dtype}".encode())
+            digest.update(values.data)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """以佔用 bytes 為上限的 LRU；值為 {欄名: 唯讀陣列}"""
+
+    def __init__(self, max_bytes=int(RESULT_CACHE_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, columns):
+        size = sum(values.nbytes for values in columns.values())
+        if size > self.max_bytes:
+            return
+        for values in columns.values():
+            # 快取的陣列會被多個結果表格共用，禁止就地修改
+            values.flags.writeable = False
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[0]
+            self._data[key] = (size, columns)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (evicted, _) = self._data.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+            }
+
+
+result_cache = ResultCache()
+
+
+def result_cache_stats():
+    return result_cache.stats()
+
+
+def _frozen(frame, col):
+    """複製成獨立的陣列 (不引用整個 2-D block)，快取的 bytes 才是實際佔用"""
+    return np.array(frame[col], copy=True)
+
+
+# ------------------------------------------------------
+# 1) 技術指標
+# ------------------------------------------------------
+def cached_indicators(data, selected_indicators, fingerprint=None, cache=None):
+    """
+    與 calculate_selected_indicators 相同的結果；每個 (指標, 參數) 分別快取，
+    沒快取到的指標一起交給 calculate_selected_indicators 計算 (仍共用中間量)
+    """
+    cache = cache or result_cache
+    fingerprint = fingerprint or content_fingerprint(data)
+    entries = []
+    for entry in selected_indicators or []:
+        for name, overrides in parse_indicator(entry):
+            params = dict(indicator_parameters(name), **overrides)
+            entries.append((name, params, (fingerprint, 'indicator', name, tuple(sorted(params.items())))))
+
+    found = {}
+    missing = []
+    for name, params, key in entries:
+        if key not in found:
+            found[key] = cache.get(key)
+            if found[key] is None:
+                missing.append((name, params, key))
+    if missing:
+        computed = calculate_selected_indicators(data, [(name, params) for name, params, _ in missing])
+        for name, params, key in missing:
+            columns = {col: _frozen(computed, col) for col in indicator_columns(name, params) if col in computed}
+            cache.put(key, columns)
+            found[key] = columns
+
+    indicators = {}
+    for _, _, key in entries:
+        indicators.update(found[key])
+    return pd.DataFrame(indicators, index=data.index, copy=False)
+
+
+# ------------------------------------------------------
+# 2) 蠟燭形態
+# ------------------------------------------------------
+def cached_patterns(data, patterns=None, fingerprint=None, cache=None, compute=detect_candlestick_patterns):
+    """
+    與 detect_candlestick_patterns 相同的結果；每個形態分別快取。
+    compute(data, 形態清單) 用來計算沒快取到的形態 (例如改用增量偵測)
+    """
+    cache = cache or result_cache
+    fingerprint = fingerprint or content_fingerprint(data)
+    names = resolve_patterns(patterns)
+    found = {name: cache.get((fingerprint, 'pattern', name)) for name in names}
+    missing = [name for name in names if found[name] is None]
+    if missing:
+        computed = compute(data, missing)
+        for name in missing:
+            columns = {name: _frozen(computed, name)}
+            cache.put((fingerprint, 'pattern', name), columns)
+            found[name] = columns
+    return pd.DataFrame({name: found[name][name] for name in names}, index=data.index, copy=False)
@@ -0,0 +1,188 @@
+import atexit
+import multiprocessing
+import os
+import signal
+import threading
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+from indicators import calculate_selected_indicators
+from market_data import fetch_bars_batch, is_intraday, load_bars
+from pattern_events import PatternEvents
+from patterns import detect_candlestick_patterns, pattern_descriptions, resolve_patterns
+from resample import RESAMPLE_BASE, fetch_any_interval
+
+# ------------------------------------------------------
+# 掃描用的行程池與 worker 進入點。
+# worker 以 spawn 啟動，只會 import 本模組需要的計算模組 (不含 Gradio / 預熱排程)；
+# scanner.py、sweep.py 的工作都送進這裡的共用行程池
+# ------------------------------------------------------
+SCAN_WORKERS = int(os.environ.get("KLINE_SCAN_WORKERS", "0")) or os.cpu_count() or 1
+# 單一股票 (抓取 + 形態 + 指標) 的時間上限，超過就記為逾時，不影響其他股票
+SCAN_TICKER_TIMEOUT = float(os.environ.get("KLINE_SCAN_TIMEOUT", "30"))
+# 只看最近幾根 K 線的訊號
+SCAN_LOOKBACK_BARS = int(os.environ.get("KLINE_SCAN_LOOKBACK_BARS", "3"))
+# worker 卡在 SIGALRM 無法中斷的地方 (例如 C 擴充內) 時，主行程最多多等幾秒就放棄
+SCAN_GRACE_SECONDS = float(os.environ.get("KLINE_SCAN_GRACE", "10"))
+
+
+# ------------------------------------------------------
+# 1) 單一股票的掃描 (在 worker 行程內執行)
+# ------------------------------------------------------
+class ScanTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise ScanTimeout()
+
+
+def scan_ticker(ticker, period='6mo', interval='1d', patterns=None, signal_strength=0,
+                indicators=None, lookback_bars=SCAN_LOOKBACK_BARS):
+    """回傳最近 lookback_bars 根 K 線內符合條件的形態摘要；沒有訊號時回傳 None"""
+    data = fetch_any_interval(ticker, period, interval=interval, loader=load_bars)
+    names = resolve_patterns(patterns)
+    events = PatternEvents.from_frame(detect_candlestick_patterns(data, names)).query(
+        min_strength=signal_strength, last_n=lookback_bars)
+    if not len(events):
+        return None
+
+    # 看漲 / 看跌依形態方向表 (patterns.PATTERN_DIRECTIONS)，無方向的形態只計入訊號數
+    signals = events.signals.astype('int64')
+    row = {
+        '代碼': ticker,
+        '最新日期': data.index[-1],
+        '收盤價': float(data['Close'].iloc[-1]),
+        '訊號數': len(events),
+        '看漲': int((signals > 0).sum()),
+        '看跌': int((signals < 0).sum()),
+        '淨強度': int(signals.sum()),
+        '最近訊號': data.index[events.bars[-1]],
+        '形態': '、'.join(dict.fromkeys(pattern_descriptions.get(n, n) for n in events.names)),
+    }
+    if indicators:
+        tech_df = calculate_selected_indicators(data, indicators)
+        for col in tech_df.columns:
+            value = tech_df[col].iloc[-1]
+            row[col] = None if pd.isna(value) else round(float(value), 4)
+    return row
+
+
+def run_with_timeout(ticker, timeout, func, *args, **kwargs):
+    """
+    在 worker 行程內執行 func，以 SIGALRM 限制單一股票的執行時間。
+    回傳 (ticker, 'ok' / 'timeout' / 'error', 結果或錯誤訊息, 耗時秒數)
+    """
+    use_alarm = timeout and hasattr(signal, 'setitimer')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    started = time.perf_counter()
+    try:
+        return ticker, 'ok', func(*args, **kwargs), time.perf_counter() - started
+    except ScanTimeout:
+        return ticker, 'timeout', f"超過 {timeout:g} 秒", time.perf_counter() - started
+    except Exception as e:
+        return ticker, 'error', str(e), time.perf_counter() - started
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _scan_worker(ticker, timeout, kwargs):
+    """worker 行程的進入點"""
+    return run_with_timeout(ticker, timeout, scan_ticker, ticker, **kwargs)
+
+
+# ------------------------------------------------------
+# 2) 共用行程池
+# ------------------------------------------------------
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def get_scan_pool(workers=SCAN_WORKERS):
+    """
+    共用的行程池 (第一次使用時建立，之後每次掃描重複使用，不必每次重新啟動 worker)。
+    以 spawn 啟動：Gradio / 預熱排程的執行緒不會被 fork 進子行程
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _pool_workers = workers
+        return _pool
+
+
+def _reset_scan_pool(terminate=False):
+    """丟掉目前的行程池 (下次使用時重建)；terminate=True 時一併結束還卡在工作中的 worker"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            processes = list((_pool._processes or {}).values()) if terminate else []
+            _pool.shutdown(wait=False, cancel_futures=True)
+            for process in processes:
+                process.terminate()
+            _pool = None
+
+
+atexit.register(_reset_scan_pool)
+
+
+# ------------------------------------------------------
+# 3) 主行程端：批次預抓與等待結果
+# ------------------------------------------------------
+def prefetch_bars(tickers, period, interval):
+    """
+    先以批次下載更新本地 K 線快取，worker 只需讀快取 (不會 N 個行程同時打 Yahoo / SQLite)。
+    合成週期預先抓基礎週期；分鐘線受 Yahoo 分段限制不批次抓取。回傳失敗清單
+    """
+    base_interval = RESAMPLE_BASE.get(interval, interval)
+    if is_intraday(base_interval):
+        return {}
+    _, errors = fetch_bars_batch(tickers, period=period, interval=base_interval)
+    return errors
+
+
+def gather_results(futures, workers, timeout):
+    """
+    等待 {future: ticker} 全部完成，
+    回傳 ({ticker: worker 回傳值}, 行程異常結束的股票, 逾時未回應的股票)。
+    主行程端的總時限為每批 (workers 檔) timeout 秒再加上寬限時間：
+    worker 內的 SIGALRM 無法中斷時，超過時限仍未回來的股票記為逾時並結束卡住的 worker；
+    有異常時行程池在下次使用時重建
+    """
+    results, broken, stragglers = {}, [], []
+    collected = set()
+
+    def collect(future):
+        collected.add(future)
+        try:
+            results[futures[future]] = future.result()
+        except BrokenProcessPool:
+            # worker 行程異常結束 (例如記憶體不足被砍)
+            broken.append(futures[future])
+
+    deadline = timeout * math.ceil(len(futures) / workers) + SCAN_GRACE_SECONDS if timeout else None
+    try:
+        for future in as_completed(futures, timeout=deadline):
+            collect(future)
+    except TimeoutError:
+        for future, ticker in futures.items():
+            if future in collected:
+                continue
+            if future.done():
+                collect(future)
+            else:
+                future.cancel()
+                stragglers.append(ticker)
+    if broken or stragglers:
+        _reset_scan_pool(terminate=bool(stragglers))
+    return results, broken, stragglers
@@ -0,0 +1,132 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from market_data import normalize_ticker
+from prewarm import load_watchlist
+from scan_worker import (SCAN_GRACE_SECONDS, SCAN_LOOKBACK_BARS, SCAN_TICKER_TIMEOUT, SCAN_WORKERS, _scan_worker,
+                         gather_results, get_scan_pool, prefetch_bars, scan_ticker)
+
+# ------------------------------------------------------
+# 設定
+# ------------------------------------------------------
+# 指數成分股預設清單 (其他市場請用股票清單檔)
+UNIVERSE_PRESETS = {
+    'DOW30': [
+        'AAPL', 'AMGN', 'AMZN', 'AXP', 'BA', 'CAT', 'CRM', 'CSCO', 'CVX', 'DIS',
+        'GS', 'HD', 'HON', 'IBM', 'JNJ', 'JPM', 'KO', 'MCD', 'MMM', 'MRK',
+        'MSFT', 'NKE', 'NVDA', 'PG', 'SHW', 'TRV', 'UNH', 'V', 'VZ', 'WMT',
+    ],
+}
+
+
+def load_universe(spec):
+    """
+    掃描範圍：預設清單名稱 (如 DOW30)、watchlist (觀察清單)、
+    股票清單檔 (一行一檔) 或逗號分隔的股票代碼
+    """
+    spec = (spec or '').strip()
+    if spec.upper() in UNIVERSE_PRESETS:
+        return list(UNIVERSE_PRESETS[spec.upper()])
+    if spec.lower() == 'watchlist':
+        return load_watchlist()
+    if os.path.exists(spec):
+        return load_watchlist(path=spec, tickers='')
+    tickers = load_watchlist(path=None, tickers=spec)
+    if not tickers:
+        raise ValueError("請輸入股票清單檔、預設清單名稱或股票代碼。")
+    return tickers
+
+
+# ------------------------------------------------------
+# 1) 全市場掃描 (單一股票的掃描與行程池在 scan_worker.py)
+# ------------------------------------------------------
+def scan_market(tickers, period='6mo', interval='1d', patterns=None, signal_strength=0, indicators=None,
+                lookback_bars=SCAN_LOOKBACK_BARS, workers=SCAN_WORKERS, timeout=SCAN_TICKER_TIMEOUT,
+                prefetch=True):
+    """
+    以行程池同時掃描多檔股票，回傳 (排行表, 失敗清單, 統計)。
+    prefetch=True 時先以批次下載更新本地 K 線快取，worker 只需讀快取；
+    個別股票失敗或逾時只會出現在失敗清單，其餘結果照常回傳
+    """
+    tickers = list(dict.fromkeys(normalize_ticker(t) for t in tickers))
+    started = time.perf_counter()
+    errors = prefetch_bars(tickers, period, interval) if prefetch else {}
+    fetched = time.perf_counter()
+
+    kwargs = dict(period=period, interval=interval, patterns=patterns, signal_strength=signal_strength,
+                  indicators=indicators, lookback_bars=lookback_bars)
+    rows, timeouts, ticker_seconds = [], [], []
+    pending = [t for t in tickers if t not in errors]
+    pool = get_scan_pool(workers)
+    futures = {pool.submit(_scan_worker, t, timeout, kwargs): t for t in pending}
+
+    results, broken, stragglers = gather_results(futures, workers, timeout)
+    for ticker in broken:
+        errors[ticker] = "掃描行程異常結束"
+    for ticker in stragglers:
+        errors[ticker] = f"超過 {timeout:g} 秒 (worker 未回應)"
+        timeouts.append(ticker)
+    for ticker, status, result, seconds in results.values():
+        ticker_seconds.append(seconds)
+        if status == 'ok':
+            if result is not None:
+                rows.append(result)
+        else:
+            errors[ticker] = result
+            if status == 'timeout':
+                timeouts.append(ticker)
+
+    finished = time.perf_counter()
+    table = pd.DataFrame(rows)
+    if not table.empty:
+        table['_abs'] = table['淨強度'].abs()
+        table = table.sort_values(['訊號數', '_abs', '代碼'], ascending=[False, False, True])
+        table = table.drop(columns='_abs').reset_index(drop=True)
+    stats = {
+        'tickers': len(tickers),
+        'matched': len(rows),
+        'failed': len(errors),
+        'timeouts': len(timeouts),
+        'workers': workers,
+        'ticker_seconds_avg': round(float(np.mean(ticker_seconds)), 3) if ticker_seconds else 0.0,
+        'fetch_seconds': round(fetched - started, 3),
+        'scan_seconds': round(finished - fetched, 3),
+        'total_seconds': round(finished - started, 3),
+        'tickers_per_sec': round(len(tickers) / (finished - started), 2) if finished > started else 0.0,
+        'ticker_seconds_max': round(float(np.max(ticker_seconds)), 3) if ticker_seconds else 0.0,
+    }
+    return table, errors, stats
+
+
+# ------------------------------------------------------
+# 命令列：python scanner.py DOW30 --patterns 看漲形態 --strength 100
+# ------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="全市場蠟燭形態掃描")
+    parser.add_argument('universe', help="預設清單名稱 (DOW30)、watchlist、股票清單檔或逗號分隔代碼")
+    parser.add_argument('--period', default='6mo')
+    parser.add_argument('--interval', default='1d')
+    parser.add_argument('--patterns', nargs='*', help="形態群組或 CDL 名稱 (預設全部)")
+    parser.add_argument('--strength', type=int, default=0, help="訊號強度門檻")
+    parser.add_argument('--indicators', nargs='*', help="附上最新一根的技術指標")
+    parser.add_argument('--lookback', type=int, default=SCAN_LOOKBACK_BARS, help="只看最近幾根 K 線")
+    parser.add_argument('--workers', type=int, default=SCAN_WORKERS)
+    parser.add_argument('--timeout', type=float, default=SCAN_TICKER_TIMEOUT)
+    parser.add_argument('--out', help="輸出 CSV")
+    args = parser.parse_args()
+
+    table, errors, stats = scan_market(load_universe(args.universe), period=args.period, interval=args.interval,
+                                       patterns=args.patterns, signal_strength=args.strength,
+                                       indicators=args.indicators, lookback_bars=args.lookback,
+                                       workers=args.workers, timeout=args.timeout)
+    with pd.option_context('display.max_rows', 200, 'display.width', 200):
+        print(table)
+    for ticker, error in errors.items():
+        print(f"失敗 {ticker}：{error}")
+    print(stats)
+    if args.out:
+        table.to_csv(args.out, index=False)
@@ -0,0 +1,255 @@
+import argparse
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from market_data import normalize_ticker
+from pattern_stats import cached_history
+from universe_store import INDEX_FILE, UniverseStore
+
+# ------------------------------------------------------
+# K 線形狀相似度搜尋 (MASS：以 FFT 計算 z-normalized 滑動歐氏距離)
+#   距離 d = sqrt(2m (1 - (QT - m μq μt) / (m σq σt)))
+#   QT 為查詢與每個視窗的內積，以 FFT 一次算出整條序列 (且一次處理所有股票)
+# ------------------------------------------------------
+SIMILARITY_MAX_WINDOW = int(os.environ.get("KLINE_SIMILARITY_MAX_WINDOW", "120"))
+# 全市場搜尋使用的 universe_store 目錄 (python universe_store.py 建立)
+UNIVERSE_DIR = os.environ.get("KLINE_UNIVERSE_DIR", "")
+SIMILARITY_HORIZONS = (1, 5, 20)
+# 視窗標準差低於此值 (相對於價格) 視為一直線，不參與比對
+FLAT_TOLERANCE = 1e-8
+
+
+def _rolling_sum(values, m):
+    """沿最後一軸的長度 m 滑動加總，輸出長度 n - m + 1"""
+    cumsum = np.cumsum(values, axis=-1)
+    out = cumsum[..., m - 1:].copy()
+    out[..., 1:] -= cumsum[..., :-m]
+    return out
+
+
+class SimilarityIndex:
+    """
+    (股票數 × K 線數) 的價格序列與預先算好的 FFT，可重複查詢。
+    每種視窗長度的滑動平均 / 標準差在第一次用到時計算並保留。
+    缺值 (上市前、停牌) 以 0 代入 FFT，含缺值的視窗不會被選中
+    """
+
+    def __init__(self, tickers, dates, values, max_window=SIMILARITY_MAX_WINDOW):
+        values = np.asarray(values, dtype='float64')
+        if values.ndim != 2 or values.shape[0] != len(tickers) or values.shape[1] != len(dates):
+            raise ValueError("相似度索引的資料形狀不一致。")
+        self.tickers = list(tickers)
+        self.dates = dates
+        self.max_window = max_window
+        self._rows = {t: i for i, t in enumerate(self.tickers)}
+        self.values = values
+        self.valid = ~np.isnan(values)
+        # 每列先減去平均值：不影響 z-normalized 距離，但可避免平方和相減的精度損失
+        filled = np.where(self.valid, values, 0.0)
+        counts = np.maximum(self.valid.sum(axis=1, keepdims=True), 1)
+        self._centered = np.where(self.valid, filled - filled.sum(axis=1, keepdims=True) / counts, 0.0)
+        scale = np.abs(filled).max(axis=1, keepdims=True)
+        self._scale = np.where(scale > 0, scale, 1.0)
+        n = values.shape[1]
+        self._fft_size = 1 << int(np.ceil(np.log2(max(n + max_window, 2))))
+        self._series_fft = np.fft.rfft(self._centered, n=self._fft_size, axis=1)
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_frames(cls, frames, field='Close', **kwargs):
+        """由 ticker -> OHLCV DataFrame 建立 (日期取聯集對齊)"""
+        frames = {normalize_ticker(t): f for t, f in frames.items() if f is not None and not f.empty}
+        if not frames:
+            raise ValueError("沒有可建立相似度索引的 K 線資料。")
+        table = pd.DataFrame({t: f[field] for t, f in frames.items()}).sort_index()
+        return cls(list(table.columns), table.index, table.to_numpy().T, **kwargs)
+
+    @classmethod
+    def from_universe(cls, universe, field='Close', **kwargs):
+        """由 universe_store.UniverseStore 建立 (直接使用 mmap 上的欄位陣列)"""
+        return cls(universe.tickers, universe.dates, universe.field(field), **kwargs)
+
+    def __contains__(self, ticker):
+        return normalize_ticker(ticker) in self._rows
+
+    def _window_stats(self, m):
+        """長度 m 的滑動平均、標準差與視窗是否可用 (不含缺值、不是一直線)"""
+        with self._lock:
+            if m not in self._stats:
+                mean = _rolling_sum(self._centered, m) / m
+                var = _rolling_sum(self._centered ** 2, m) / m - mean ** 2
+                std = np.sqrt(np.maximum(var, 0))
+                complete = _rolling_sum(self.valid.astype('int32'), m) == m
+                usable = complete & (std > FLAT_TOLERANCE * self._scale)
+                self._stats[m] = (mean, std, usable)
+            return self._stats[m]
+
+    def distance_profile(self, query, rows=None):
+        """
+        查詢序列與每個視窗的 z-normalized 距離，(股票數 × 視窗數)，不可用的視窗為 inf；
+        rows 指定列號時只計算這些股票
+        """
+        query = np.asarray(query, dtype='float64')
+        m = len(query)
+        if m < 3 or m > self.max_window:
+            raise ValueError(f"查詢長度需介於 3 與 {self.max_window} 根之間。")
+        if m > self.values.shape[1]:
+            raise ValueError("查詢長度超過索引的 K 線數。")
+        if np.isnan(query).any():
+            raise ValueError("查詢區間含缺值。")
+        q_std = query.std()
+        if q_std <= FLAT_TOLERANCE * max(np.abs(query).max(), 1.0):
+            raise ValueError("查詢區間的價格沒有變化，無法比對形狀。")
+        q = (query - query.mean()) / q_std
+
+        _, std, usable = self._window_stats(m)
+        rows = slice(None) if rows is None else rows
+        std, usable = std[rows], usable[rows]
+        query_fft = np.fft.rfft(q[::-1], n=self._fft_size)
+        products = np.fft.irfft(self._series_fft[rows] * query_fft, n=self._fft_size, axis=1)
+        qt = products[:, m - 1:self.values.shape[1]]
+        # q 已 z-normalize (平均 0、標準差 1)，相關係數 = QT / (m σt)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = qt / (m * std)
+        corr = np.clip(corr, -1.0, 1.0)
+        distance = np.sqrt(np.maximum(2 * m * (1 - corr), 0))
+        return np.where(usable, distance, np.inf)
+
+    def search(self, query, k=10, exclude=None, tickers=None, horizons=SIMILARITY_HORIZONS):
+        """
+        回傳距離最近的 k 個歷史視窗 (同一檔股票內互相重疊的視窗只取最好的一個)，
+        附上視窗結束後持有 horizons 根 K 線的報酬。
+        exclude=(ticker, 結束位置) 用來排除查詢本身所在的區段
+        """
+        m = len(query)
+        if tickers is None:
+            rows = np.arange(len(self.tickers))
+            distance = self.distance_profile(query)
+        else:
+            rows = np.array(sorted({self._rows[t] for t in map(normalize_ticker, tickers) if t in self._rows}),
+                            dtype='int64')
+            distance = self.distance_profile(query, rows)
+        zone = max(1, m // 2)
+        if exclude is not None:
+            position = np.flatnonzero(rows == self._rows.get(normalize_ticker(exclude[0]), -1))
+            if len(position):
+                first = exclude[1] - m + 1
+                distance[position[0], max(0, first - zone):max(0, first + zone + 1)] = np.inf
+
+        flat = distance.ravel()
+        finite = np.count_nonzero(np.isfinite(flat))
+        candidates = min(finite, k * (2 * zone + 1))
+        if candidates == 0:
+            return self._frame([], m, horizons)
+        order = np.argpartition(flat, candidates - 1)[:candidates]
+        order = order[np.argsort(flat[order], kind='stable')]
+
+        chosen = []
+        taken = {}
+        width = distance.shape[1]
+        for flat_pos in order:
+            position, start = divmod(int(flat_pos), width)
+            if any(abs(start - other) <= zone for other in taken.get(position, ())):
+                continue
+            taken.setdefault(position, []).append(start)
+            chosen.append((int(rows[position]), start, float(flat[flat_pos])))
+            if len(chosen) == k:
+                break
+        return self._frame(chosen, m, horizons)
+
+    def _frame(self, matches, m, horizons):
+        rows = []
+        n = self.values.shape[1]
+        for row, start, dist in matches:
+            end = start + m - 1
+            close = self.values[row, end]
+            record = {
+                '代碼': self.tickers[row],
+                '開始': self.dates[start],
+                '結束': self.dates[end],
+                '距離': round(dist, 4),
+                '相關係數': round(1 - dist ** 2 / (2 * m), 4),
+            }
+            for h in horizons:
+                future = self.values[row, end + h] if end + h < n else np.nan
+                record[f'之後{h}根報酬(%)'] = round((future / close - 1) * 100, 2) if np.isfinite(future) else None
+            rows.append(record)
+        columns = ['代碼', '開始', '結束', '距離', '相關係數'] + [f'之後{h}根報酬(%)' for h in horizons]
+        return pd.DataFrame(rows, columns=columns)
+
+    def query_last(self, ticker, m=20, k=10, scope='universe', horizons=SIMILARITY_HORIZONS):
+        """以某檔股票最近 m 根 K 線為查詢；scope='ticker' 只搜尋同一檔的歷史"""
+        ticker = normalize_ticker(ticker)
+        row = self._rows.get(ticker)
+        if row is None:
+            raise ValueError(f"{ticker} 不在相似度索引中。")
+        valid = np.flatnonzero(self.valid[row])
+        if len(valid) < m:
+            raise ValueError(f"{ticker} 的 K 線不足 {m} 根。")
+        end = int(valid[-1])
+        query = self.values[row, end - m + 1:end + 1]
+        tickers = [ticker] if scope == 'ticker' else None
+        return self.search(query, k=k, exclude=(ticker, end), tickers=tickers, horizons=horizons)
+
+
+# ------------------------------------------------------
+# 全市場索引：依 universe_store 目錄快取，儲存重建後 (index.json 時間改變) 自動重新載入
+# ------------------------------------------------------
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_universe_index(directory=UNIVERSE_DIR, field='Close'):
+    if not directory or not os.path.exists(os.path.join(directory, INDEX_FILE)):
+        raise ValueError("尚未建立全市場儲存 (請設定 KLINE_UNIVERSE_DIR)。")
+    version = os.path.getmtime(os.path.join(directory, INDEX_FILE))
+    with _indexes_lock:
+        entry = _indexes.get((directory, field))
+        if entry is None or entry[0] != version:
+            index = SimilarityIndex.from_universe(UniverseStore(directory), field)
+            entry = _indexes[(directory, field)] = (version, index)
+        return entry[1]
+
+
+def find_similar(ticker, m=20, k=10, scope='ticker', interval='1d', data=None):
+    """
+    以最近 m 根 K 線搜尋相似走勢：scope='ticker' 搜尋本地快取的完整歷史，
+    'universe' 搜尋 KLINE_UNIVERSE_DIR 的全市場 (日 K)
+    """
+    ticker = normalize_ticker(ticker)
+    if scope == 'universe':
+        return get_universe_index().query_last(ticker, m=m, k=k, scope='universe')
+    history = cached_history(ticker, interval)
+    if history is None or (data is not None and len(data) > len(history)):
+        history = data
+    if history is None or history.empty:
+        raise ValueError(f"{ticker} 沒有可搜尋的歷史資料。")
+    return SimilarityIndex.from_frames({ticker: history}).query_last(ticker, m=m, k=k, scope='ticker')
+
+
+# ------------------------------------------------------
+# 命令列：python similarity.py 2330.TW --universe cache/universe/tw --window 20 --top 10
+# ------------------------------------------------------
+if __name__ == "__main__":
+    import time
+
+    parser = argparse.ArgumentParser(description="K 線形狀相似度搜尋")
+    parser.add_argument('ticker')
+    parser.add_argument('--universe', default=UNIVERSE_DIR, help="universe_store 目錄")
+    parser.add_argument('--window', type=int, default=20, help="查詢最近幾根 K 線")
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--scope', choices=['universe', 'ticker'], default='universe')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    index = get_universe_index(args.universe)
+    built = time.perf_counter()
+    result = index.query_last(args.ticker, m=args.window, k=args.top, scope=args.scope)
+    finished = time.perf_counter()
+    with pd.option_context('display.width', 200):
+        print(result)
+    print(f"建立索引 {built - started:.3f}s，查詢 {finished - built:.3f}s")
@@ -0,0 +1,420 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from indicators import indicator_columns, indicator_parameters, parse_indicator
+
+# ------------------------------------------------------
+# 串流指標：以歷史 K 線播種後，每根新 K 線以固定大小的狀態 O(1) 更新。
+# 更新公式與 TA-Lib 的 C 實作相同 (包含暖機期的 SMA 起始值與計算順序)，
+# 與整段重算的結果只差浮點誤差。狀態只有幾個數字，可存成 JSON 在重啟或不同行程間沿用
+# ------------------------------------------------------
+NAN = float('nan')
+
+
+def _is_zero(value):
+    # 與 TA-Lib 的 TA_IS_ZERO 相同
+    return -0.00000001 < value < 0.00000001
+
+
+class _StreamingState:
+    """各指標狀態的共同介面：fields 內的屬性即為完整狀態 (屬性本身是狀態物件時遞迴保存)"""
+    fields = ()
+
+    def snapshot(self):
+        state = {}
+        for name in self.fields:
+            value = getattr(self, name)
+            state[name] = value.snapshot() if isinstance(value, _StreamingState) else value
+        return state
+
+    def restore(self, state):
+        for name in self.fields:
+            value = getattr(self, name)
+            if isinstance(value, _StreamingState):
+                value.restore(state[name])
+            else:
+                setattr(self, name, state[name])
+
+
+class _EMA(_StreamingState):
+    """TA-Lib 的 EMA：先略過 skip 根，以前 period 根的簡單平均為起始值，之後 prev + k × (x - prev)"""
+    fields = ('skip', 'count', 'total', 'value')
+
+    def __init__(self, period, skip=0):
+        self.period = period
+        self.k = 2.0 / (period + 1)
+        self.skip = skip
+        self.count = 0
+        self.total = 0.0
+        self.value = None
+
+    def update(self, x):
+        if self.skip:
+            self.skip -= 1
+            return None
+        if self.value is None:
+            self.total += x
+            self.count += 1
+            if self.count == self.period:
+                self.value = self.total / self.period
+            return self.value
+        self.value = ((x - self.value) * self.k) + self.value
+        return self.value
+
+
+class EMAState(_StreamingState):
+    fields = ('ema',)
+
+    def __init__(self, timeperiod=30):
+        self.ema = _EMA(timeperiod)
+
+    def update(self, open_, high, low, close, volume):
+        value = self.ema.update(close)
+        return (NAN if value is None else value,)
+
+
+class MACDState(_StreamingState):
+    """
+    TA-Lib 的 MACD：快線的起始平均與慢線對齊 (都在第 slowperiod 根開始)，
+    訊號線對 MACD 做 EMA；三個輸出都從訊號線有值時才開始
+    """
+    fields = ('fast', 'slow', 'signal')
+
+    def __init__(self, fastperiod=12, slowperiod=26, signalperiod=9):
+        if slowperiod < fastperiod:
+            fastperiod, slowperiod = slowperiod, fastperiod
+        self.fast = _EMA(fastperiod, skip=slowperiod - fastperiod)
+        self.slow = _EMA(slowperiod)
+        self.signal = _EMA(signalperiod)
+
+    def update(self, open_, high, low, close, volume):
+        fast = self.fast.update(close)
+        slow = self.slow.update(close)
+        if slow is None:
+            return NAN, NAN, NAN
+        macd = fast - slow
+        signal = self.signal.update(macd)
+        if signal is None:
+            return NAN, NAN, NAN
+        return macd, signal, macd - signal
+
+
+class RSIState(_StreamingState):
+    """TA-Lib 的 RSI (Wilder 平滑)：前 period 個漲跌幅取簡單平均，之後 (prev × (n - 1) + 本次) / n"""
+    fields = ('count', 'prev_close', 'gain', 'loss')
+
+    def __init__(self, timeperiod=14):
+        self.period = timeperiod
+        self.count = 0
+        self.prev_close = None
+        self.gain = 0.0
+        self.loss = 0.0
+
+    def update(self, open_, high, low, close, volume):
+        if self.prev_close is None:
+            self.prev_close = close
+            return (NAN,)
+        diff = close - self.prev_close
+        self.prev_close = close
+        self.count += 1
+        if self.count > self.period:
+            self.loss *= (self.period - 1)
+            self.gain *= (self.period - 1)
+        if diff < 0:
+            self.loss -= diff
+        else:
+            self.gain += diff
+        if self.count < self.period:
+            return (NAN,)
+        self.loss /= self.period
+        self.gain /= self.period
+        total = self.gain + self.loss
+        return (0.0 if _is_zero(total) else 100 * (self.gain / total),)
+
+
+class ATRState(_StreamingState):
+    """TA-Lib 的 ATR：第 2 根起的 TRANGE，前 period 個取簡單平均，之後 Wilder 平滑"""
+    fields = ('count', 'prev_close', 'total', 'value')
+
+    def __init__(self, timeperiod=14):
+        self.period = timeperiod
+        self.count = 0
+        self.prev_close = None
+        self.total = 0.0
+        self.value = None
+
+    def update(self, open_, high, low, close, volume):
+        prev_close, self.prev_close = self.prev_close, close
+        if prev_close is None:
+            return (NAN,)
+        true_range = max(high - low, abs(high - prev_close), abs(low - prev_close))
+        if self.value is None:
+            self.total += true_range
+            self.count += 1
+            if self.count < self.period:
+                return (NAN,)
+            self.value = self.total / self.period
+            return (self.value,)
+        self.value = (self.value * (self.period - 1) + true_range) / self.period
+        return (self.value,)
+
+
+class OBVState(_StreamingState):
+    fields = ('prev_close', 'value')
+
+    def __init__(self):
+        self.prev_close = None
+        self.value = 0.0
+
+    def update(self, open_, high, low, close, volume):
+        if self.prev_close is None:
+            self.value = volume
+        elif close > self.prev_close:
+            self.value += volume
+        elif close < self.prev_close:
+            self.value -= volume
+        self.prev_close = close
+        return (self.value,)
+
+
+class ADState(_StreamingState):
+    fields = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def update(self, open_, high, low, close, volume):
+        span = high - low
+        if span > 0.0:
+            self.value += (((close - low) - (high - close)) / span) * volume
+        return (self.value,)
+
+
+class SARState(_StreamingState):
+    """
+    TA-Lib 的拋物線 SAR：以前兩根的 -DM 決定起始方向，
+    之後依極值 (ep) 與加速因子 (af) 逐根推進，反轉時 SAR 設為前一段的極值
+    """
+    fields = ('first', 'is_long', 'sar', 'ep', 'af', 'prev_high', 'prev_low')
+
+    def __init__(self, acceleration=0.02, maximum=0.2):
+        self.acceleration = min(acceleration, maximum)
+        self.maximum = maximum
+        self.first = True
+        self.is_long = None
+        self.sar = self.ep = None
+        self.af = self.acceleration
+        self.prev_high = self.prev_low = None
+
+    def update(self, open_, high, low, close, volume):
+        if self.prev_high is None:
+            self.prev_high, self.prev_low = high, low
+            return (NAN,)
+        prev_high, prev_low = self.prev_high, self.prev_low
+        if self.first:
+            # 第 2 根：-DM > 0 (低點下移多於高點上移) 時先視為空頭
+            up, down = high - prev_high, prev_low - low
+            self.is_long = not (down > 0 and up < down)
+            if self.is_long:
+                self.ep, self.sar = high, prev_low
+            else:
+                self.ep, self.sar = low, prev_high
+            self.first = False
+            # 與 TA-Lib 相同：第一次推進時「前一根」也用這一根的高低點
+            prev_high, prev_low = high, low
+        self.prev_high, self.prev_low = high, low
+
+        if self.is_long:
+            if low <= self.sar:
+                self.is_long = False
+                self.sar = max(self.ep, prev_high, high)
+                output = self.sar
+                self.af = self.acceleration
+                self.ep = low
+                self.sar = max(self.sar + self.af * (self.ep - self.sar), prev_high, high)
+            else:
+                output = self.sar
+                if high > self.ep:
+                    self.ep = high
+                    self.af = min(self.af + self.acceleration, self.maximum)
+                self.sar = min(self.sar + self.af * (self.ep - self.sar), prev_low, low)
+        else:
+            if high >= self.sar:
+                self.is_long = True
+                self.sar = min(self.ep, prev_low, low)
+                output = self.sar
+                self.af = self.acceleration
+                self.ep = high
+                self.sar = min(self.sar + self.af * (self.ep - self.sar), prev_low, low)
+            else:
+                output = self.sar
+                if low < self.ep:
+                    self.ep = low
+                    self.af = min(self.af + self.acceleration, self.maximum)
+                self.sar = max(self.sar + self.af * (self.ep - self.sar), prev_high, high)
+        return (output,)
+
+
+# 支援串流更新的指標 (名稱與 indicators.INDICATOR_REGISTRY 相同，輸出欄名也相同)
+STREAMING_INDICATORS = {
+    'EMA': EMAState,
+    'MACD': MACDState,
+    'RSI': RSIState,
+    'ATR': ATRState,
+    'OBV': OBVState,
+    'AD': ADState,
+    'SAR': SARState,
+}
+
+
+# ------------------------------------------------------
+# 多個指標的串流狀態
+# ------------------------------------------------------
+class StreamingIndicators:
+    """
+    seed(data) 以歷史 K 線播種並回傳與批次計算相同的表格；
+    之後 update(bar, timestamp) 每根 K 線 O(1) 回傳 {欄名: 新值}。
+    timestamp 與上一根相同時視為同一根 K 線的修正 (盤中即時更新)，會先還原上一根之前的狀態
+    """
+
+    def __init__(self, selected_indicators):
+        self.selected = list(selected_indicators)
+        self._states = []
+        for entry in self.selected:
+            for name, overrides in parse_indicator(entry):
+                if name not in STREAMING_INDICATORS:
+                    raise ValueError(f"{name} 不支援串流更新 (支援：{', '.join(STREAMING_INDICATORS)})。")
+                params = dict(indicator_parameters(name), **overrides)
+                state = STREAMING_INDICATORS[name](**{k: v for k, v in params.items() if k != 'matype'})
+                self._states.append((name, params, indicator_columns(name, params), state))
+        self.columns = [col for _, _, columns, _ in self._states for col in columns]
+        self.last_timestamp = None
+        self.bars = 0
+        self._previous = None
+
+    def update(self, bar, timestamp=None):
+        """bar 為含 Open/High/Low/Close/Volume 的 dict 或 Series"""
+        if timestamp is not None and self.last_timestamp is not None:
+            timestamp = pd.Timestamp(timestamp)
+            if timestamp < self.last_timestamp:
+                raise ValueError("串流 K 線的時間早於上一根。")
+            if timestamp == self.last_timestamp:
+                if self._previous is None:
+                    raise ValueError("無法修正上一根 K 線 (狀態是在該 K 線之後才載入的)。")
+                self._restore(self._previous)
+                self.bars -= 1
+        self._previous = self._snapshot()
+        values = self._update(float(bar['Open']), float(bar['High']), float(bar['Low']), float(bar['Close']),
+                              float(bar['Volume']) if 'Volume' in bar else NAN)
+        self.bars += 1
+        if timestamp is not None:
+            self.last_timestamp = pd.Timestamp(timestamp)
+        return dict(zip(self.columns, values))
+
+    def _update(self, open_, high, low, close, volume):
+        values = []
+        for _, _, _, state in self._states:
+            values.extend(state.update(open_, high, low, close, volume))
+        return values
+
+    def seed(self, data):
+        """以整段歷史播種 (會清除原本的狀態)，回傳每根 K 線的指標值"""
+        fresh = StreamingIndicators(self.selected)
+        self._states = fresh._states
+        fields = [np.asarray(data[col], dtype='float64').tolist() if col in data.columns else [NAN] * len(data)
+                  for col in ('Open', 'High', 'Low', 'Close', 'Volume')]
+        rows = [self._update(*bar) for bar in zip(*fields)]
+        self.bars = len(rows)
+        self.last_timestamp = pd.Timestamp(data.index[-1]) if len(data) else None
+        self._previous = None
+        matrix = np.array(rows, dtype='float64').reshape(len(rows), len(self.columns))
+        return pd.DataFrame(matrix, index=data.index, columns=self.columns)
+
+    def _snapshot(self):
+        return [state.snapshot() for _, _, _, state in self._states]
+
+    def _restore(self, snapshot):
+        for (_, _, _, state), saved in zip(self._states, snapshot):
+            state.restore(saved)
+
+    # ------------------------------------------------------
+    # 序列化：JSON (NaN / None 原樣保存)，可在重啟後或其他 worker 中還原
+    # ------------------------------------------------------
+    def to_dict(self):
+        return {
+            'selected': self.selected,
+            'bars': self.bars,
+            'last_timestamp': None if self.last_timestamp is None else self.last_timestamp.isoformat(),
+            'states': self._snapshot(),
+        }
+
+    @classmethod
+    def from_dict(cls, payload):
+        streaming = cls(payload['selected'])
+        if len(payload['states']) != len(streaming._states):
+            raise ValueError("串流指標狀態與指標設定不一致。")
+        streaming._restore(payload['states'])
+        streaming.bars = payload['bars']
+        last = payload['last_timestamp']
+        streaming.last_timestamp = None if last is None else pd.Timestamp(last)
+        return streaming
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, text):
+        return cls.from_dict(json.loads(text))
+
+    def save(self, path):
+        """先寫暫存檔再取代，避免其他行程讀到寫到一半的狀態"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_json())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls.from_json(f.read())
+
+
+# ------------------------------------------------------
+# 命令列：python streaming.py AAPL --period 5y --indicators EMA RSI MACD ATR OBV AD SAR
+#   以前段歷史播種、逐根餵入後段，與批次 TA-Lib 比較誤差並量測每根的更新時間
+# ------------------------------------------------------
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from indicators import calculate_selected_indicators
+    from market_data import load_bars
+
+    parser = argparse.ArgumentParser(description="串流指標與批次計算的一致性與速度")
+    parser.add_argument('ticker')
+    parser.add_argument('--period', default='5y')
+    parser.add_argument('--interval', default='1d')
+    parser.add_argument('--indicators', nargs='*', default=list(STREAMING_INDICATORS))
+    parser.add_argument('--stream-bars', type=int, default=250, help="逐根餵入的 K 線數")
+    args = parser.parse_args()
+
+    data = load_bars(args.ticker, args.period, interval=args.interval)
+    split = max(len(data) - args.stream_bars, 1)
+    streaming = StreamingIndicators(args.indicators)
+    streaming.seed(data.iloc[:split])
+    streaming = StreamingIndicators.from_json(streaming.to_json())
+
+    started = time.perf_counter()
+    rows = [streaming.update(bar, timestamp) for timestamp, bar in data.iloc[split:].iterrows()]
+    elapsed = time.perf_counter() - started
+    streamed = pd.DataFrame(rows, index=data.index[split:])
+    batch = calculate_selected_indicators(data, args.indicators).iloc[split:]
+    for col in streamed.columns:
+        error = np.nanmax(np.abs(streamed[col] - batch[col]), initial=0.0)
+        scale = max(np.nanmax(np.abs(batch[col]), initial=0.0), 1.0)
+        print(f"{col:<14} 最大誤差 {error:.3e} (相對 {error / scale:.3e})")
+    print(f"{len(rows)} 根，每根 {elapsed / max(len(rows), 1) * 1e6:.1f} µs")
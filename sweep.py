@@ -0,0 +1,263 @@
+import argparse
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from indicators import IndicatorGraph, _talib_info
+from market_data import load_bars, normalize_ticker
+from resample import fetch_any_interval
+from scan_worker import (SCAN_TICKER_TIMEOUT, SCAN_WORKERS, gather_results, get_scan_pool, prefetch_bars,
+                         run_with_timeout)
+
+# ------------------------------------------------------
+# 指標參數掃描：同一個指標在一組參數上一次算完，回傳 (參數數 × K 線數) 陣列
+#   SMA          所有週期共用同一條累積和：均值 = (S[t] - S[t-n]) / n
+#   MOM / ROC …  直接以位移後的陣列相減 / 相除
+# 其他 TA-Lib 函式 (EMA、RSI、ATR …) 是遞迴式，無法共用累積量，
+# 改為共用同一個 IndicatorGraph 的輸入陣列與中間節點 (例如 NATR 共用 ATR) 逐一計算。
+# STDDEV / VAR 若以平方的累積和相減，短週期的誤差會到 1e-8，因此也交給 TA-Lib。
+# 多檔股票以 scanner 的行程池平行處理
+# ------------------------------------------------------
+
+_NUMBER = r'\d+(?:\.\d+)?'
+
+
+def _number(value, kind):
+    """轉成參數型別；整數參數給了小數時拋出 ValueError，而不是默默截斷"""
+    number = float(value)
+    if kind is int:
+        if not number.is_integer():
+            raise ValueError(f"參數需為整數：{value}")
+        return int(number)
+    return number
+
+
+def parse_periods(spec, kind=int):
+    """
+    '5-250'、'2-30:2' (間隔 2)、'5,10,20' 或數值清單轉成參數清單。
+    kind=float 時可用小數，例如 '1.5,2' 或 '1-3:0.5'
+    """
+    if isinstance(spec, (list, tuple, range, np.ndarray)):
+        values = [_number(v, kind) for v in spec]
+    else:
+        values = []
+        for part in str(spec).replace(' ', '').split(','):
+            if not part:
+                continue
+            match = re.fullmatch(f'({_NUMBER})(?:-({_NUMBER})(?::({_NUMBER}))?)?', part)
+            if match is None:
+                raise ValueError(f"無法解析的參數範圍：{part}")
+            first, last, step = (None if g is None else _number(g, kind) for g in match.groups())
+            if last is None:
+                values.append(first)
+                continue
+            step = kind(1) if step is None else step
+            if step <= 0:
+                raise ValueError(f"參數間隔需大於 0：{part}")
+            # 小數範圍以 first + i * step 產生 (不累加，避免誤差)，包含終點
+            count = int(np.floor((last - first) / step + 1e-9)) + 1
+            values.extend(kind(round(first + i * step, 10)) for i in range(max(count, 0)))
+    if not values:
+        raise ValueError("參數範圍不可為空。")
+    return values
+
+
+def parse_values(function, values, param='timeperiod'):
+    """依 TA-Lib 預設值的型別解析 function 的 param：timeperiod 等為整數，nbdevup、acceleration 等為小數"""
+    try:
+        _, defaults, _ = _talib_info(str(function).strip().upper())
+    except Exception:
+        raise ValueError(f"未知的指標：{function}")
+    if param not in defaults:
+        raise ValueError(f"{function} 沒有參數 {param}。")
+    return parse_periods(values, kind=float if isinstance(defaults[param], float) else int)
+
+
+def _windows(periods):
+    periods = np.asarray(periods, dtype='int64')
+    if (periods < 1).any():
+        raise ValueError("週期需大於 0。")
+    return periods
+
+
+# ------------------------------------------------------
+# 1) 可共用累積量 / 位移的指標 (週期超過 K 線數時與 TA-Lib 相同，整列為 NaN)
+# ------------------------------------------------------
+def _sweep_sma(graph, periods):
+    close = graph.price('close')
+    periods = _windows(periods)
+    # 先減去平均值：累積和不會隨價格水準放大，避免長序列相減的精度損失
+    shift = close.mean() if len(close) else 0.0
+    cumsum = np.concatenate([[0.0], np.cumsum(close - shift)])
+    out = np.full((len(periods), len(close)), np.nan)
+    for row, n in enumerate(periods):
+        if n > len(close):
+            continue
+        window = out[row, n - 1:]
+        np.subtract(cumsum[n:], cumsum[:-n], out=window)
+        window /= n
+        window += shift
+    return out
+
+
+def _shifted(graph, periods, combine):
+    close = graph.price('close')
+    periods = _windows(periods)
+    out = np.full((len(periods), len(close)), np.nan)
+    for row, n in enumerate(periods):
+        if n < len(close):
+            out[row, n:] = combine(close[n:], close[:len(close) - n])
+    return out
+
+
+def _ratio(current, previous, scale, offset):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # TA-Lib 在前值為 0 時輸出 0
+        return np.where(previous != 0, (current / previous - offset) * scale, 0.0)
+
+
+SWEEP_FAMILIES = {
+    'SMA': _sweep_sma,
+    'MOM': lambda graph, periods: _shifted(graph, periods, lambda cur, prev: cur - prev),
+    'ROC': lambda graph, periods: _shifted(graph, periods, lambda cur, prev: _ratio(cur, prev, 100.0, 1.0)),
+    'ROCP': lambda graph, periods: _shifted(graph, periods, lambda cur, prev: _ratio(cur, prev, 1.0, 1.0)),
+    'ROCR': lambda graph, periods: _shifted(graph, periods, lambda cur, prev: _ratio(cur, prev, 1.0, 0.0)),
+    'ROCR100': lambda graph, periods: _shifted(graph, periods, lambda cur, prev: _ratio(cur, prev, 100.0, 0.0)),
+}
+
+
+# ------------------------------------------------------
+# 2) 單一股票
+# ------------------------------------------------------
+def sweep_indicator(data, function, values, param='timeperiod', output=None, graph=None, **fixed):
+    """
+    function 在 param 的每個值上的輸出，回傳 (參數數 × K 線數) 陣列 (暖機期間為 NaN)。
+    fixed 為其他參數的覆寫值；output 為多輸出函式 (如 MACD) 要取的 TA-Lib 輸出名稱，預設第一個。
+    傳入同一個 graph 可讓多次掃描共用輸入陣列與中間節點
+    """
+    function = str(function).strip().upper()
+    values = parse_values(function, values, param)
+    graph = graph or IndicatorGraph(data)
+    _, defaults, output_names = _talib_info(function)
+    unknown = set(fixed) - set(defaults)
+    if unknown:
+        raise ValueError(f"{function} 沒有參數 {'、'.join(sorted(unknown))}。")
+    if output is not None and output not in output_names:
+        raise ValueError(f"{function} 沒有輸出 {output}。")
+
+    if function in SWEEP_FAMILIES and param == 'timeperiod' and not fixed and output in (None, output_names[0]):
+        return SWEEP_FAMILIES[function](graph, values)
+
+    position = output_names.index(output) if output is not None else 0
+    out = np.full((len(values), len(data)), np.nan)
+    for row, value in enumerate(values):
+        params = dict(defaults, **fixed)
+        params[param] = value
+        try:
+            result = graph.get(function, **params)
+        except Exception as e:
+            # TA-Lib 參數錯誤 (例如 RSI timeperiod=1 的 TA_BAD_PARAM) 只會拋出一般 Exception
+            raise ValueError(f"{function}({param}={value:g}) 計算失敗：{e}")
+        if result is None:
+            raise ValueError(f"{function} 需要的價格欄位不存在。")
+        out[row] = result[position] if isinstance(result, tuple) else result
+    return out
+
+
+def sweep_frame(data, function, values, param='timeperiod', output=None, **fixed):
+    """與 sweep_indicator 相同，包成 DataFrame (欄名如 SMA_5、SMA_6 …)"""
+    values = parse_values(function, values, param)
+    array = sweep_indicator(data, function, values, param=param, output=output, **fixed)
+    label = str(function).strip().upper() if output is None else f"{str(function).strip().upper()}_{output}"
+    return pd.DataFrame({f"{label}_{v}": array[row] for row, v in enumerate(values)}, index=data.index, copy=False)
+
+
+# ------------------------------------------------------
+# 3) 多檔股票：以 scanner 的共用行程池平行計算
+# ------------------------------------------------------
+def _sweep_ticker(ticker, period, interval, function, values, param, output, fixed):
+    """由本地 K 線快取讀取後計算"""
+    data = fetch_any_interval(ticker, period, interval=interval, loader=load_bars)
+    return data.index, sweep_indicator(data, function, values, param=param, output=output, **fixed)
+
+
+def _sweep_worker(ticker, timeout, args):
+    """worker 行程的進入點 (與掃描相同，以 SIGALRM 限制單一股票的執行時間)"""
+    return run_with_timeout(ticker, timeout, _sweep_ticker, ticker, *args)
+
+
+def sweep_tickers(tickers, function, values, period='1y', interval='1d', param='timeperiod', output=None,
+                  workers=SCAN_WORKERS, timeout=SCAN_TICKER_TIMEOUT, prefetch=True, **fixed):
+    """
+    多檔股票的參數掃描，回傳 ({ticker: (時間索引, (參數數 × K 線數) 陣列)}, 失敗清單, 統計)。
+    參數在主行程先解析，格式錯誤時直接拋出 ValueError。
+    與 scanner.scan_market 相同：prefetch=True 時先批次更新本地 K 線快取，
+    單檔逾時 (timeout 秒) 或 worker 卡住時記為失敗，不會讓整批掃描一直等下去
+    """
+    tickers = list(dict.fromkeys(normalize_ticker(t) for t in tickers))
+    values = parse_values(function, values, param)
+    started = time.perf_counter()
+    errors = prefetch_bars(tickers, period, interval) if prefetch else {}
+    results, ticker_seconds, timeouts = {}, [], []
+    pool = get_scan_pool(workers)
+    args = (period, interval, function, values, param, output, fixed)
+    futures = {pool.submit(_sweep_worker, t, timeout, args): t for t in tickers if t not in errors}
+
+    finished_results, broken, stragglers = gather_results(futures, workers, timeout)
+    for ticker in broken:
+        errors[ticker] = "計算行程異常結束"
+    for ticker in stragglers:
+        errors[ticker] = f"超過 {timeout:g} 秒 (worker 未回應)"
+        timeouts.append(ticker)
+    for ticker, status, result, seconds in finished_results.values():
+        ticker_seconds.append(seconds)
+        if status == 'ok':
+            results[ticker] = result
+        else:
+            errors[ticker] = result
+            if status == 'timeout':
+                timeouts.append(ticker)
+    finished = time.perf_counter()
+    stats = {
+        'tickers': len(tickers),
+        'succeeded': len(results),
+        'failed': len(errors),
+        'timeouts': len(timeouts),
+        'parameters': len(values),
+        'workers': workers,
+        'ticker_seconds_avg': round(float(np.mean(ticker_seconds)), 4) if ticker_seconds else 0.0,
+        'total_seconds': round(finished - started, 3),
+    }
+    return results, errors, stats
+
+
+# ------------------------------------------------------
+# 命令列：python sweep.py 2330.TW,2317.TW --function SMA --values 5-250
+# ------------------------------------------------------
+if __name__ == "__main__":
+    from scanner import load_universe
+
+    parser = argparse.ArgumentParser(description="指標參數掃描")
+    parser.add_argument('universe', help="預設清單名稱 (DOW30)、watchlist、股票清單檔或逗號分隔代碼")
+    parser.add_argument('--function', default='SMA')
+    parser.add_argument('--values', default='5-250', help="參數範圍，例如 5-250、2-30:2、5,10,20、1.5-3:0.5")
+    parser.add_argument('--param', default='timeperiod')
+    parser.add_argument('--output', help="多輸出指標要取的輸出名稱")
+    parser.add_argument('--period', default='1y')
+    parser.add_argument('--interval', default='1d')
+    parser.add_argument('--workers', type=int, default=SCAN_WORKERS)
+    parser.add_argument('--timeout', type=float, default=SCAN_TICKER_TIMEOUT)
+    args = parser.parse_args()
+
+    results, errors, stats = sweep_tickers(load_universe(args.universe), args.function, args.values,
+                                           period=args.period, interval=args.interval, param=args.param,
+                                           output=args.output, workers=args.workers, timeout=args.timeout)
+    values = parse_values(args.function, args.values, args.param)
+    for ticker, (index, array) in sorted(results.items()):
+        latest = pd.Series(array[:, -1], index=values).dropna()
+        print(ticker, index[-1], latest.round(4).to_dict() if len(latest) <= 10 else latest.describe().round(4).to_dict())
+    for ticker, error in errors.items():
+        print(f"失敗 {ticker}：{error}")
+    print(stats)
@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from candle_engine import VECTORIZED_PATTERNS, compare_with_talib, detect_patterns_2d, detect_universe_patterns, \
+    synthetic_ohlc
+from patterns import detect_candlestick_patterns
+from universe_store import build_universe_store
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+# 固定的合成資料 (價格取到 0.01、每檔 K 線數不同)，不是實際行情
+SYNTHETIC_FIXTURE = os.path.join(FIXTURES, 'synthetic_ohlc.csv')
+# 以 python candle_engine.py --universe DIR --record 錄下的實際行情 (存在時才測)
+RECORDED_FIXTURE = os.path.join(FIXTURES, 'recorded_ohlc.csv')
+PORTED = sorted(VECTORIZED_PATTERNS)
+
+
+def _fixture_arrays(path):
+    """每檔 K 線數不同，以 NaN 補在前面對齊成 (ticker 數 × K 線數)"""
+    frame = pd.read_csv(path)
+    groups = [g for _, g in frame.groupby('Ticker', sort=True)]
+    width = max(len(g) for g in groups)
+    arrays = []
+    for col in ('Open', 'High', 'Low', 'Close'):
+        array = np.full((len(groups), width), np.nan)
+        for row, group in enumerate(groups):
+            array[row, width - len(group):] = group[col].to_numpy(dtype='float64')
+        arrays.append(array)
+    return arrays
+
+
+@pytest.fixture(scope='module')
+def synthetic_reports():
+    return [compare_with_talib(*synthetic_ohlc(seed=seed)) for seed in (7, 11, 23)]
+
+
+@pytest.mark.parametrize('name', PORTED)
+def test_matches_talib_on_synthetic_data(synthetic_reports, name):
+    for report in synthetic_reports:
+        mismatches, _ = report[name]
+        assert mismatches == 0
+
+
+def test_synthetic_data_exercises_every_ported_pattern(synthetic_reports):
+    silent = [name for name in PORTED if not any(report[name][1] for report in synthetic_reports)]
+    assert silent == []
+
+
+@pytest.mark.parametrize('name', PORTED)
+def test_matches_talib_on_synthetic_fixture(name):
+    mismatches, _ = compare_with_talib(*_fixture_arrays(SYNTHETIC_FIXTURE), patterns=[name])[name]
+    assert mismatches == 0
+
+
+@pytest.mark.skipif(not os.path.exists(RECORDED_FIXTURE), reason="尚未錄製實際行情 (candle_engine.py --record)")
+@pytest.mark.parametrize('name', PORTED)
+def test_matches_talib_on_recorded_data(name):
+    mismatches, _ = compare_with_talib(*_fixture_arrays(RECORDED_FIXTURE), patterns=[name])[name]
+    assert mismatches == 0
+
+
+def test_single_row_input_matches_talib():
+    arrays = [values[0] for values in synthetic_ohlc(tickers=1, bars=300)]
+    ours = detect_patterns_2d(*arrays, PORTED, engine='numpy')
+    reference = detect_patterns_2d(*arrays, PORTED, engine='talib')
+    for name in PORTED:
+        np.testing.assert_array_equal(ours[name], reference[name])
+
+
+def test_unknown_engine_rejected():
+    with pytest.raises(ValueError):
+        detect_patterns_2d(*synthetic_ohlc(tickers=1, bars=50), engine='gpu')
+
+
+@pytest.mark.parametrize('engine', ['numpy', 'talib'])
+def test_universe_detection_with_gaps_matches_per_ticker(tmp_path, engine):
+    open_, high, low, close = synthetic_ohlc(tickers=4, bars=300, seed=3)
+    dates = pd.bdate_range('2024-01-01', periods=300)
+    frames = {}
+    for row, ticker in enumerate(['AAA', 'BBB', 'CCC', 'DDD']):
+        frame = pd.DataFrame({'Open': open_[row], 'High': high[row], 'Low': low[row], 'Close': close[row],
+                              'Volume': 1000.0}, index=dates)
+        if ticker in ('BBB', 'DDD'):
+            frame = frame.drop(frame.index[[40, 41, 150]])
+        frames[ticker] = frame
+    universe = build_universe_store(str(tmp_path / 'universe'), frames)
+    assert not universe.is_dense('BBB') and universe.is_dense('AAA')
+
+    results = detect_universe_patterns(universe, engine=engine)
+    for row, ticker in enumerate(universe.tickers):
+        bars = universe.bars(ticker)
+        expected = detect_candlestick_patterns(bars)
+        positions = universe.dates.get_indexer(bars.index)
+        for name in expected.columns:
+            np.testing.assert_array_equal(results[name][row, positions], expected[name].to_numpy())
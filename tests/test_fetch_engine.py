@@ -0,0 +1,189 @@
+import asyncio
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from fetch_engine import AsyncFetchEngine, AsyncYahooProvider, FetchError, TokenBucket, parse_chart
+
+# 2024-01-02 ~ 2024-01-04 美東 09:30 (UTC 14:30)
+DAILY_TIMESTAMPS = [1704205800, 1704292200, 1704378600]
+
+
+def _payload(timestamps=DAILY_TIMESTAMPS, adjclose=None, tz='America/New_York'):
+    n = len(timestamps)
+    close = [100.0 + i for i in range(n)]
+    quote = {'open': [c - 1 for c in close], 'high': [c + 1 for c in close], 'low': [c - 2 for c in close],
+             'close': close, 'volume': [1000 * (i + 1) for i in range(n)]}
+    indicators = {'quote': [quote]}
+    if adjclose is not None:
+        indicators['adjclose'] = [{'adjclose': adjclose}]
+    return {'chart': {'result': [{'meta': {'exchangeTimezoneName': tz}, 'timestamp': timestamps,
+                                  'indicators': indicators}], 'error': None}}
+
+
+@pytest.fixture
+def stub():
+    """
+    本地的 Yahoo chart API 替身，跑在引擎自己的 event loop 上。
+    state['script'][ticker] 為依序回應的 HTTP 狀態碼 (用完後回 200)；
+    state['delay'] 為每個請求的處理時間，state['peak'] 記錄同時處理中的請求數上限
+    """
+    state = {'script': {}, 'headers': {}, 'delay': 0.0, 'hits': [], 'active': 0, 'peak': 0}
+
+    async def chart(request):
+        ticker = request.match_info['ticker']
+        state['hits'].append((ticker, time.monotonic()))
+        state['active'] += 1
+        state['peak'] = max(state['peak'], state['active'])
+        try:
+            if state['delay']:
+                await asyncio.sleep(state['delay'])
+            script = state['script'].get(ticker) or []
+            status = script.pop(0) if script else 200
+            if status != 200:
+                return web.Response(status=status, headers=state['headers'].get(ticker, {}))
+            return web.json_response(_payload())
+        finally:
+            state['active'] -= 1
+
+    app = web.Application()
+    app.router.add_get('/v8/finance/chart/{ticker}', chart)
+    engines = []
+
+    def make_engine(**kwargs):
+        options = dict(max_concurrency=4, rate_per_host=1000, burst=1000, max_retries=3, timeout=5)
+        options.update(kwargs)
+        engine = AsyncFetchEngine(base_url='http://127.0.0.1', **options)
+        server = TestServer(app)
+        engine.run(server.start_server())
+        engine.base_url = str(server.make_url('')).rstrip('/')
+        # 退避時間改為 0 並記錄 Retry-After，測試不必真的等待
+        engine.backoffs = []
+        engine._backoff = lambda attempt, retry_after=None: engine.backoffs.append((attempt, retry_after)) or 0
+        engines.append((engine, server))
+        return engine
+
+    yield make_engine, state
+    for engine, server in engines:
+        engine.run(server.close())
+        engine.close()
+
+
+# ------------------------------------------------------
+# 1) parse_chart
+# ------------------------------------------------------
+def test_parse_chart_daily_applies_adjclose():
+    data = parse_chart(_payload(adjclose=[50.0, 50.5, 51.0]), 'AAPL', '1d')
+    assert data.index.name == 'Date' and data.index.tz is None
+    assert list(data.index) == list(pd.to_datetime(['2024-01-02', '2024-01-03', '2024-01-04']))
+    np.testing.assert_allclose(data['Close'], [50.0, 50.5, 51.0])
+    np.testing.assert_allclose(data['Open'], np.array([99.0, 100.0, 101.0]) * 0.5)
+    assert data['Volume'].dtype == 'int64'
+
+
+def test_parse_chart_intraday_keeps_exchange_time_zone():
+    data = parse_chart(_payload([1704205800, 1704206100]), 'AAPL', '5m')
+    assert data.index.name == 'Datetime'
+    assert str(data.index.tz) == 'America/New_York'
+    assert data.index[0] == pd.Timestamp('2024-01-02 09:30', tz='America/New_York')
+
+
+@pytest.mark.parametrize('payload', [{'chart': {'error': {'code': 'Not Found'}}}, {'chart': {'result': []}}, None])
+def test_parse_chart_without_data_raises(payload):
+    with pytest.raises(ValueError):
+        parse_chart(payload, 'NONE', '1d')
+
+
+# ------------------------------------------------------
+# 2) 重試與退避
+# ------------------------------------------------------
+def test_retries_429_and_5xx_then_succeeds(stub):
+    make_engine, state = stub
+    engine = make_engine()
+    state['script']['AAPL'] = [429, 503]
+    state['headers']['AAPL'] = {'Retry-After': '2'}
+
+    data = engine.run(engine.fetch_chart('AAPL', period='5d'))
+    assert len(data) == 3
+    stats = engine.stats()
+    assert stats['requests'] == 3 and stats['retries'] == 2 and stats['errors'] == 0
+    # Retry-After 交給退避計算
+    assert engine.backoffs == [(0, '2'), (1, '2')]
+
+
+def test_gives_up_after_max_retries(stub):
+    make_engine, state = stub
+    engine = make_engine(max_retries=2)
+    state['script']['AAPL'] = [500] * 10
+
+    with pytest.raises(FetchError) as info:
+        engine.run(engine.fetch_chart('AAPL', period='5d'))
+    assert info.value.status == 500
+    stats = engine.stats()
+    assert stats['requests'] == 3 and stats['retries'] == 2 and stats['errors'] == 1
+
+
+def test_client_errors_are_not_retried(stub):
+    make_engine, state = stub
+    engine = make_engine()
+    state['script']['NONE'] = [404]
+    state['script']['BAD'] = [400]
+
+    with pytest.raises(ValueError):
+        engine.run(engine.fetch_chart('NONE', period='5d'))
+    with pytest.raises(FetchError):
+        engine.run(engine.fetch_chart('BAD', period='5d'))
+    stats = engine.stats()
+    assert stats['requests'] == 2 and stats['retries'] == 0
+
+
+def test_backoff_uses_retry_after_or_capped_jitter():
+    engine = AsyncFetchEngine()
+    assert engine._backoff(0, '1.5') == 1.5
+    for attempt in range(12):
+        assert 0 <= engine._backoff(attempt, 'soon') <= min(30.0, 0.5 * 2 ** attempt)
+
+
+# ------------------------------------------------------
+# 3) 同時連線數上限、限流與統計
+# ------------------------------------------------------
+def test_concurrency_cap_and_stats(stub):
+    make_engine, state = stub
+    engine = make_engine(max_concurrency=2)
+    state['delay'] = 0.05
+    state['script']['MISSING'] = [404]
+    tickers = ['A', 'B', 'C', 'D', 'E', 'F', 'MISSING']
+
+    frames, errors = AsyncYahooProvider(engine).download_batch(tickers, period='5d')
+    assert sorted(frames) == ['A', 'B', 'C', 'D', 'E', 'F'] and list(errors) == ['MISSING']
+    assert state['peak'] == 2
+    stats = engine.stats()
+    assert stats['requests'] == 7
+    assert stats['inflight'] == 0 and stats['queue_depth'] == 0
+    assert stats['max_queue_depth'] >= 5
+    assert stats['max_wait'] > 0 and stats['avg_wait'] > 0
+
+
+def test_token_bucket_limits_rate():
+    async def acquire_all():
+        bucket = TokenBucket(rate=20, capacity=2)
+        started = time.monotonic()
+        for _ in range(6):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # 前 2 個用掉瞬間額度，其餘 4 個每 1/20 秒補一個
+    assert asyncio.run(acquire_all()) >= 4 / 20 * 0.9
+
+
+def test_engine_rate_limits_per_host(stub):
+    make_engine, state = stub
+    engine = make_engine(rate_per_host=20, burst=1)
+
+    AsyncYahooProvider(engine).download_batch(['A', 'B', 'C', 'D', 'E'], period='5d')
+    times = sorted(t for _, t in state['hits'])
+    assert times[-1] - times[0] >= 4 / 20 * 0.9
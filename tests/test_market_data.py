@@ -0,0 +1,57 @@
+import pandas as pd
+import pytest
+
+import market_data
+from market_data import BarStore, MarketDataProvider, load_bars, set_provider
+
+TZ = 'America/New_York'
+
+
+class StubIntradayProvider(MarketDataProvider):
+    """依請求區間產生交易所時區的 5 分鐘 K 線，並記錄每次下載"""
+    name = 'stub'
+    chunk_intraday = False
+
+    def __init__(self):
+        self.calls = []
+
+    def download(self, ticker, period=None, interval='1d', start=None, end=None):
+        self.calls.append((start, end))
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        start = start.tz_localize(TZ) if start.tz is None else start.tz_convert(TZ)
+        end = end.tz_localize(TZ) if end.tz is None else end.tz_convert(TZ)
+        index = pd.date_range(start.ceil('5min'), end, freq='5min', inclusive='left', name='Datetime')
+        index = index[(index.hour >= 10) & (index.hour < 16)]
+        if index.empty:
+            raise ValueError(f"{ticker} 在所選時間內無資料。")
+        close = pd.Series(range(len(index)), index=index, dtype='float64') + 100
+        return pd.DataFrame({'Open': close, 'High': close + 1, 'Low': close - 1, 'Close': close,
+                             'Volume': 1000.0}, index=index)
+
+
+@pytest.fixture
+def provider(tmp_path, monkeypatch):
+    monkeypatch.setattr(market_data, 'BAR_STORE_ENABLED', True)
+    previous = market_data.get_provider()
+    provider = StubIntradayProvider()
+    set_provider(provider)
+    yield provider, BarStore(str(tmp_path / 'bars.sqlite'))
+    set_provider(previous)
+
+
+def test_first_intraday_fetch_registers_range_in_exchange_time_zone(provider):
+    provider, store = provider
+    start, end = pd.Timestamp('2024-03-04'), pd.Timestamp('2024-03-06')
+
+    data = load_bars('AAPL', interval='5m', start=start, end=end, store=store)
+    assert str(data.index.tz) == TZ
+    assert data.index[-1] < end.tz_localize(TZ)
+    # 登記的區段以交易所時區換算，涵蓋整個請求區間
+    (range_start, range_end), = store.get_ranges('AAPL', '5m')
+    assert range_start <= market_data._epoch(start, TZ)
+    assert range_end == market_data._epoch(end, TZ)
+
+    # 同一區間再查一次直接從本地切片，不會再抓
+    again = load_bars('AAPL', interval='5m', start=start, end=end, store=store)
+    assert len(provider.calls) == 1
+    pd.testing.assert_frame_equal(again, data, check_freq=False)
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+import scan_worker
+from pattern_events import PatternEvents
+from patterns import PATTERN_DIRECTIONS, pattern_signal
+
+
+def _events():
+    """CDLDOJI、CDLMARUBOZU 無方向 (正負號只代表顏色)；CDLHAMMER 看漲；CDLENGULFING 雙向"""
+    index = pd.date_range('2024-01-01', periods=6)
+    frame = pd.DataFrame({
+        'CDLDOJI': [100, 0, 0, 0, 0, 100],
+        'CDLMARUBOZU': [0, 100, -100, 0, 0, 0],
+        'CDLHAMMER': [0, 0, 100, 0, 0, 0],
+        'CDLENGULFING': [0, 0, 0, 100, -100, 0],
+    }, index=index)
+    return PatternEvents.from_frame(frame)
+
+
+def test_direction_table_marks_doji_and_marubozu_non_directional():
+    assert PATTERN_DIRECTIONS['CDLDOJI'] is None
+    assert PATTERN_DIRECTIONS['CDLMARUBOZU'] is None
+
+
+def test_signals_match_pattern_signal():
+    events = _events()
+    expected = [int(pattern_signal(name, code)) for name, code in zip(events.names, events.strengths)]
+    np.testing.assert_array_equal(events.signals, expected)
+
+
+def test_non_directional_patterns_are_not_bullish_or_bearish():
+    events = _events()
+    bullish = events.query(direction='bullish')
+    bearish = events.query(direction='bearish')
+    assert sorted(bullish.names) == ['CDLENGULFING', 'CDLHAMMER']
+    assert bearish.names == ['CDLENGULFING']
+    assert 'CDLDOJI' not in bullish.names + bearish.names
+    assert 'CDLMARUBOZU' not in bullish.names + bearish.names
+
+
+def test_scan_counts_use_pattern_directions(monkeypatch):
+    index = pd.date_range('2024-01-01', periods=3)
+    data = pd.DataFrame({'Open': 1.0, 'High': 1.0, 'Low': 1.0, 'Close': 1.0, 'Volume': 1.0}, index=index)
+    patterns = pd.DataFrame({'CDLDOJI': [0, 100, 100], 'CDLGRAVESTONEDOJI': [0, 0, 100]}, index=index)
+    monkeypatch.setattr(scan_worker, 'fetch_any_interval', lambda *args, **kwargs: data)
+    monkeypatch.setattr(scan_worker, 'detect_candlestick_patterns', lambda *args, **kwargs: patterns)
+
+    row = scan_worker.scan_ticker('TEST')
+    assert row['訊號數'] == 3
+    assert row['看漲'] == 0
+    assert row['看跌'] == 1
+    assert row['淨強度'] == -100
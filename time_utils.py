@@ -0,0 +1,15 @@
+import pandas as pd
+
+# ------------------------------------------------------
+# 時間點 / 時間索引的時區處理 (只依賴 pandas，事件、快取等輕量模組都可直接 import)
+# ------------------------------------------------------
+
+
+def localize_like(ts, index):
+    """調整時間點的時區，使其能與 index 直接比較"""
+    ts = pd.Timestamp(ts)
+    if index.tz is not None and ts.tz is None:
+        return ts.tz_localize(index.tz)
+    if index.tz is None and ts.tz is not None:
+        return ts.tz_convert(None)
+    return ts
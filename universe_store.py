@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from market_data import BAR_COLUMNS, get_bar_store, normalize_ticker
+
+# ------------------------------------------------------
+# 全市場欄式儲存：
+#   dates.npy        共用日期軸 (epoch 秒, int64)
+#   <Field>.npy      每個欄位一個 (ticker 數 × 日期數) 的 float64 陣列，
+#                    同一檔股票的資料在記憶體中連續，可直接取 1-D view
+#   index.json       ticker -> 列號、有效區間、是否有缺值
+# 以 np.load(mmap_mode='r') 開啟，多個 worker 共用同一份分頁快取，不需複製
+# ------------------------------------------------------
+INDEX_FILE = 'index.json'
+DATES_FILE = 'dates.npy'
+
+
+def build_universe_store(directory, frames, interval='1d'):
+    """
+    將 ticker -> OHLCV DataFrame 寫成欄式儲存 (先寫入暫存目錄再替換，讀取端不會讀到一半的檔案)。
+    同一個儲存內的股票應屬於同一個交易日曆 (例如台股、美股分開建)，否則會出現大量缺值
+    """
+    frames = {normalize_ticker(t): f for t, f in frames.items() if f is not None and not f.empty}
+    if not frames:
+        raise ValueError("沒有可寫入的 K 線資料。")
+    tz = None
+    for frame in frames.values():
+        if frame.index.tz is not None:
+            tz = str(frame.index.tz)
+            break
+    dates = pd.DatetimeIndex(sorted(set().union(*[_utc_naive(f.index) for f in frames.values()])))
+    tickers = sorted(frames)
+
+    tmp_dir = directory.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    epoch = ((dates - pd.Timestamp('1970-01-01')) // pd.Timedelta(seconds=1)).astype('int64')
+    np.save(os.path.join(tmp_dir, DATES_FILE), np.asarray(epoch, dtype='int64'))
+
+    arrays = {
+        field: np.lib.format.open_memmap(os.path.join(tmp_dir, f"{field}.npy"), mode='w+',
+                                         dtype='float64', shape=(len(tickers), len(dates)))
+        for field in BAR_COLUMNS
+    }
+    entries = {}
+    for row, ticker in enumerate(tickers):
+        frame = frames[ticker]
+        positions = dates.get_indexer(_utc_naive(frame.index))
+        for field, array in arrays.items():
+            array[row, :] = np.nan
+            if field in frame.columns:
+                array[row, positions] = frame[field].to_numpy(dtype='float64')
+        first, last = int(positions.min()), int(positions.max())
+        entries[ticker] = {
+            'row': row,
+            'first': first,
+            'last': last,
+            'dense': bool(last - first + 1 == len(positions)),
+        }
+    for array in arrays.values():
+        array.flush()
+    del arrays
+
+    with open(os.path.join(tmp_dir, INDEX_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'interval': interval, 'tz': tz, 'fields': BAR_COLUMNS, 'tickers': entries}, f)
+
+    if os.path.exists(directory):
+        old_dir = directory.rstrip('/') + '.old'
+        shutil.rmtree(old_dir, ignore_errors=True)
+        os.replace(directory, old_dir)
+        os.replace(tmp_dir, directory)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    else:
+        os.replace(tmp_dir, directory)
+    return UniverseStore(directory)
+
+
+def build_from_bar_store(directory, tickers, interval='1d', start=None, store=None):
+    """從本地 K 線快取 (market_data.BarStore) 建立欄式儲存"""
+    store = store or get_bar_store()
+    frames = {}
+    for ticker in tickers:
+        ticker = normalize_ticker(ticker)
+        frame = store.load(ticker, interval, start=start)
+        if frame is not None:
+            frames[ticker] = frame
+    return build_universe_store(directory, frames, interval=interval)
+
+
+def _utc_naive(index):
+    return index.tz_convert('UTC').tz_localize(None) if index.tz is not None else index
+
+
+class UniverseBars:
+    """
+    單一股票的唯讀 K 線 view：data['Close'] 回傳 1-D ndarray，
+    並提供 index / columns，可直接傳給 detect_candlestick_patterns、calculate_selected_indicators
+    """
+
+    def __init__(self, arrays, index):
+        self._arrays = arrays
+        self.index = index
+        self.columns = pd.Index(list(arrays))
+
+    def __getitem__(self, field):
+        return self._arrays[field]
+
+    def __contains__(self, field):
+        return field in self._arrays
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def empty(self):
+        return len(self.index) == 0
+
+    def to_frame(self):
+        return pd.DataFrame({field: np.array(values) for field, values in self._arrays.items()}, index=self.index)
+
+
+class UniverseStore:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        self.interval = meta['interval']
+        self.tz = meta['tz']
+        self.fields = meta['fields']
+        self._entries = meta['tickers']
+        self.tickers = sorted(self._entries, key=lambda t: self._entries[t]['row'])
+        seconds = np.load(os.path.join(directory, DATES_FILE))
+        dates = pd.to_datetime(seconds, unit='s')
+        if self.tz:
+            dates = dates.tz_localize('UTC').tz_convert(self.tz)
+        self.dates = pd.DatetimeIndex(dates, name='Datetime' if self.tz else 'Date')
+        self._arrays = {
+            field: np.load(os.path.join(directory, f"{field}.npy"), mmap_mode='r')
+            for field in self.fields
+        }
+
+    def __contains__(self, ticker):
+        return normalize_ticker(ticker) in self._entries
+
+    def is_dense(self, ticker):
+        """有效區間內沒有缺值 (bars() 可直接回傳零複製 view)"""
+        return self._entries[normalize_ticker(ticker)]['dense']
+
+    def field(self, name):
+        """整個市場單一欄位的 (ticker 數 × 日期數) 唯讀陣列"""
+        return self._arrays[name]
+
+    def bars(self, ticker):
+        """
+        取出單一股票有效區間的 K 線。沒有缺值時為 mmap 上的零複製 view；
+        中間有缺值 (停牌等) 時才壓縮成不含缺值的複本
+        """
+        ticker = normalize_ticker(ticker)
+        entry = self._entries.get(ticker)
+        if entry is None:
+            raise ValueError(f"{ticker} 在所選時間內無資料。")
+        row, first, last = entry['row'], entry['first'], entry['last'] + 1
+        arrays = {field: array[row, first:last] for field, array in self._arrays.items()}
+        index = self.dates[first:last]
+        if not entry['dense']:
+            mask = ~np.isnan(arrays['Close'])
+            arrays = {field: values[mask] for field, values in arrays.items()}
+            index = index[mask]
+        return UniverseBars(arrays, index)
+
+
+# ------------------------------------------------------
+# 命令列：python universe_store.py --tickers-file tw.txt --out cache/universe/tw
+# ------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="由本地 K 線快取建立全市場欄式儲存")
+    parser.add_argument('--tickers-file', required=True, help="股票清單 (一行一檔)")
+    parser.add_argument('--out', required=True, help="輸出目錄")
+    parser.add_argument('--interval', default='1d')
+    args = parser.parse_args()
+
+    with open(args.tickers_file, encoding='utf-8') as f:
+        tickers = [line.split('#', 1)[0].strip() for line in f if line.split('#', 1)[0].strip()]
+    universe = build_from_bar_store(args.out, tickers, interval=args.interval)
+    print(f"{len(universe.tickers)} 檔 × {len(universe.dates)} 根 K 線 -> {args.out}")